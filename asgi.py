@@ -0,0 +1,16 @@
+"""ASGI entry point for uvicorn and other ASGI servers: uvicorn asgi:app --workers 4
+
+The Flask app is synchronous; asgiref's WsgiToAsgi runs each request in a thread pool.
+uvicorn can also serve the WSGI app directly: uvicorn wsgi:app --interface wsgi.
+On SIGTERM uvicorn exits normally, so the atexit hook (shutdown_app) flushes pending mood
+logs. See gunicorn.conf.py for how many worker processes SQLite can take.
+"""
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError as e:
+    raise ImportError("asgi.py needs asgiref (pip install asgiref), "
+                      "or run the WSGI app directly: uvicorn wsgi:app --interface wsgi") from e
+
+from chatbot_app import create_app
+
+app = WsgiToAsgi(create_app())
@@ -0,0 +1,283 @@
+"""Per-endpoint latency and throughput benchmark at several mood_logs scales.
+
+For every --rows scale a fresh database is seeded (rows spread over --users users and
+--span-days days) and two passes are run, each in its own process:
+
+  test_client  Flask's test client, one request at a time. Each session is bound to a
+               seeded user, so history and quote queries run against real data.
+  http         the app served over HTTP (gunicorn when installed, else the threaded
+               werkzeug server) and driven by --concurrency virtual users. These sessions
+               start as new users; the seeded rows still size the tables and indexes.
+
+A session is POST /reset, then chat turns (/chat and /chat/stream) mixed with
+GET /api/mood_history (7 and 30 days), GET /api/daily_quote and GET/POST /api/profile.
+Results (p50/p95/p99 ms, requests/sec per endpoint) are printed and written as JSON.
+
+    python benchmarks/bench_endpoints.py --rows 1000 100000 1000000 --out bench.json
+    python benchmarks/bench_endpoints.py --rows 10000000 --modes test_client
+
+Regression checks (exit status 1 on failure):
+  --thresholds benchmarks/endpoint_thresholds.json   p95 ceilings for test_client runs
+  --baseline old.json                                fail if a p95 grew by more than the
+                                                     file's max_regression (or --max-regression)
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+from load_test import MESSAGES, VirtualUser, free_port, percentile, serve, wait_until_ready # noqa: E402
+
+MOODS = ["Happy", "Sad", "Angry", "Stressed", "Calm"]
+SEED_BATCH = 50000
+
+
+def summarize(samples, elapsed=None):
+    """{endpoint: stats} from (endpoint, seconds) samples. Without elapsed (serial runs),
+    requests/sec is the endpoint's own capacity: count / time spent in it."""
+    by_endpoint = {}
+    for endpoint, seconds in samples:
+        by_endpoint.setdefault(endpoint, []).append(seconds)
+    summary = {}
+    for endpoint, values in sorted(by_endpoint.items()):
+        values.sort()
+        summary[endpoint] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+            "rps": round(len(values) / (elapsed if elapsed else sum(values)), 1),
+        }
+    return summary
+
+
+# --- Seeding (runs in the worker process, MOOD_DATABASE already set) ---
+def seed(chatbot_app, rows, users, span_days):
+    """Creates users and rows with executemany, then rebuilds the rollup, log versions and
+    mood trajectories once instead of maintaining them per row."""
+    start = time.perf_counter()
+    with chatbot_app.db_pool.connection() as db:
+        chatbot_app.apply_migrations(db)
+        now = chatbot_app.to_epoch(datetime.now(timezone.utc))
+        with db:
+            db.executemany("INSERT INTO users (name, created_at) VALUES (?, ?)",
+                           [(f"Bench user {i}", now) for i in range(users)])
+            user_ids = [row[0] for row in db.execute("SELECT id FROM users ORDER BY id")]
+            db.execute("DROP TRIGGER mood_logs_update_daily_agg")
+            db.execute("DROP TRIGGER mood_logs_bump_log_version")
+            db.execute("DROP TABLE mood_daily_agg")
+        rnd = random.Random(42)
+        tz = chatbot_app.get_tz(None) # Seeded users keep the default time zone
+        first_ts = now - span_days * 86400
+        for offset in range(0, rows, SEED_BATCH):
+            timestamps = [rnd.randint(first_ts, now) for _ in range(offset, min(offset + SEED_BATCH, rows))]
+            chunk = [(user_ids[(offset + i) % len(user_ids)], ts, chatbot_app.local_day(ts, tz), rnd.choice(MOODS),
+                      round(rnd.uniform(-1, 1), 4)) for i, ts in enumerate(timestamps)]
+            with db:
+                db.executemany(chatbot_app.MoodLogWriter.INSERT_SQL, chunk)
+        with db:
+            chatbot_app._create_mood_daily_agg(db, chatbot_app.MOOD_AGG_KEYS)
+            chatbot_app._create_log_version_trigger(db)
+            chatbot_app.rebuild_mood_trajectories(db, user_ids)
+        db.execute("ANALYZE")
+    return user_ids, time.perf_counter() - start
+
+
+# --- Test client pass ---
+def run_test_client(chatbot_app, user_ids, sessions, turns):
+    app = chatbot_app.create_app()
+    rnd = random.Random(7)
+    samples = []
+
+    def call(client, method, path, **kwargs):
+        start = time.perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        response.get_data() # Consume streamed bodies too
+        response.close()
+        samples.append((path.split("?")[0], time.perf_counter() - start))
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} -> {response.status_code}")
+
+    for n in range(sessions):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_ids[n % len(user_ids)]
+        call(client, "POST", "/reset")
+        call(client, "GET", "/api/profile")
+        for turn in range(turns):
+            endpoint = "/chat/stream" if turn % 2 else "/chat"
+            call(client, "POST", endpoint, json={"message": rnd.choice(MESSAGES)})
+            if turn % 3 == 2: call(client, "GET", "/api/mood_history?days=7")
+        call(client, "GET", "/api/mood_history?days=30")
+        call(client, "GET", "/api/daily_quote")
+        call(client, "POST", "/api/profile", json={"name": f"Bench {n}", "age": 30, "weight": 70})
+    chatbot_app.shutdown_app()
+    return summarize(samples)
+
+
+# --- HTTP pass ---
+class SessionUser(VirtualUser):
+    """A virtual user that repeats whole chat sessions until the run ends."""
+
+    def run(self):
+        while time.monotonic() < self.stop_at:
+            self.request("/reset", {})
+            self.request("/api/profile")
+            for turn in range(self.rnd.randint(3, 8)):
+                self.request("/chat/stream" if turn % 2 else "/chat", {"message": self.rnd.choice(MESSAGES)})
+                if turn % 3 == 2: self.request("/api/mood_history?days=7")
+            self.request("/api/mood_history?days=30")
+            self.request("/api/daily_quote")
+
+
+def run_http(env, concurrency, duration):
+    try:
+        import gunicorn # noqa: F401
+        kind = "gunicorn"
+    except ImportError:
+        kind = "threaded"
+    port = free_port()
+    server = serve(kind, port, env)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        wait_until_ready(url)
+        stop_at = time.monotonic() + duration
+        users = [SessionUser(url, stop_at, seed) for seed in range(concurrency)]
+        start = time.perf_counter()
+        for user in users: user.start()
+        for user in users: user.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    samples = [sample for user in users for sample in user.samples]
+    result = summarize(samples, elapsed)
+    result["_total"] = dict(summarize([("all", s) for _, s in samples], elapsed)["all"],
+                            errors=sum(user.errors for user in users),
+                            throttled=sum(user.throttled for user in users), server=kind)
+    return result
+
+
+def worker(args):
+    """One scale, one process: seed, then run the requested passes. Prints JSON."""
+    import chatbot_app
+    user_ids, seed_s = seed(chatbot_app, args.worker_rows, args.users, args.span_days)
+    result = {"seed_seconds": round(seed_s, 2)}
+    if "test_client" in args.modes:
+        result["test_client"] = run_test_client(chatbot_app, user_ids, args.sessions, args.turns)
+    if "http" in args.modes:
+        result["http"] = run_http(dict(os.environ), args.concurrency, args.duration)
+    print(json.dumps(result))
+
+
+# --- Regression checks ---
+def check_thresholds(results, thresholds):
+    failures = []
+    for scale, result in results.items():
+        for endpoint, limits in thresholds.get("test_client_p95_ms", {}).items():
+            measured = result.get("test_client", {}).get(endpoint)
+            if "test_client" in result and not measured: # A ceiling for an endpoint the run never hit
+                failures.append(f"{scale} rows {endpoint}: no samples for this threshold")
+            elif measured and measured["p95_ms"] > limits:
+                failures.append(f"{scale} rows {endpoint}: p95 {measured['p95_ms']}ms > {limits}ms")
+    return failures
+
+
+def check_baseline(results, baseline, max_regression):
+    failures = []
+    for scale, result in results.items():
+        for mode in ("test_client", "http"):
+            old_mode = baseline.get("results", {}).get(scale, {}).get(mode, {})
+            for endpoint, stats in result.get(mode, {}).items():
+                old = old_mode.get(endpoint)
+                if endpoint.startswith("_") or not old or not old["p95_ms"]: continue
+                growth = stats["p95_ms"] / old["p95_ms"] - 1
+                if growth > max_regression:
+                    failures.append(f"{scale} rows {mode} {endpoint}: p95 {old['p95_ms']} -> {stats['p95_ms']}ms (+{growth:.0%})")
+    return failures
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000], help="mood_logs scales to seed")
+    parser.add_argument("--users", type=int, default=100, help="seeded users the rows are spread over")
+    parser.add_argument("--span-days", type=int, default=365)
+    parser.add_argument("--modes", nargs="+", choices=["test_client", "http"], default=["test_client", "http"])
+    parser.add_argument("--sessions", type=int, default=200, help="test_client sessions per scale")
+    parser.add_argument("--turns", type=int, default=6, help="chat turns per test_client session")
+    parser.add_argument("--concurrency", type=int, default=8, help="http virtual users")
+    parser.add_argument("--duration", type=float, default=15.0, help="http seconds per scale")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--thresholds", help="JSON file of p95 ceilings")
+    parser.add_argument("--baseline", help="earlier --out report to compare against")
+    parser.add_argument("--max-regression", type=float, default=None, help="allowed p95 growth, e.g. 0.25")
+    parser.add_argument("--worker-rows", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker_rows is not None:
+        worker(args)
+        return 0
+
+    report = {"meta": {"commit": git_commit(), "date": datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z"),
+                       "python": platform.python_version(), "cpus": os.cpu_count(), "users": args.users,
+                       "span_days": args.span_days, "sessions": args.sessions, "turns": args.turns,
+                       "concurrency": args.concurrency, "duration": args.duration},
+              "results": {}}
+    with tempfile.TemporaryDirectory(prefix="mood_endpoints_") as tmp:
+        for rows in args.rows:
+            env = dict(os.environ, MOOD_DATABASE=os.path.join(tmp, f"bench_{rows}.db"), NLTK_WARMUP="1",
+                       RATE_LIMIT_BACKEND="off") # Measure the endpoints, not the limiter
+            cmd = [sys.executable, os.path.abspath(__file__), "--worker-rows", str(rows), "--users", str(args.users),
+                   "--span-days", str(args.span_days), "--sessions", str(args.sessions), "--turns", str(args.turns),
+                   "--concurrency", str(args.concurrency), "--duration", str(args.duration), "--modes", *args.modes]
+            print(f"== {rows:,} rows", file=sys.stderr)
+            output = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True)
+            if output.returncode != 0:
+                print(output.stderr, file=sys.stderr)
+                return output.returncode
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            report["results"][str(rows)] = result
+            for mode in ("test_client", "http"):
+                for endpoint, stats in result.get(mode, {}).items():
+                    print(f"{rows:>10,} {mode:<11} {endpoint:<22} p50 {stats['p50_ms']:>8.2f}  p95 {stats['p95_ms']:>8.2f}  "
+                          f"p99 {stats['p99_ms']:>8.2f} ms  {stats['rps']:>9.1f} req/s", file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if args.thresholds:
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+        failures += check_thresholds(report["results"], thresholds)
+        if args.max_regression is None: args.max_regression = thresholds.get("max_regression")
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += check_baseline(report["results"], json.load(f), args.max_regression or 0.25)
+    for failure in failures:
+        print(f"REGRESSION {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
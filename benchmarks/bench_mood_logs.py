@@ -0,0 +1,116 @@
+"""Benchmarks the mood_logs queries before and after the schema migrations.
+
+Seeds a legacy-schema database (text timestamps, no index) with millions of rows, times
+the original history and daily-quote queries, migrates a copy with apply_migrations()
+and times the indexed raw-log query, the mood_daily_agg rollup query and the latest-mood
+query against it.
+
+    python benchmarks/bench_mood_logs.py --rows 2000000
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chatbot_app # noqa: E402
+
+LEGACY_HISTORY_SQL = ("SELECT timestamp, score FROM mood_logs WHERE date(timestamp) >= date(?) "
+                      "AND date(timestamp) <= date(?) ORDER BY timestamp ASC")
+LEGACY_LATEST_MOOD_SQL = ("SELECT mood FROM mood_logs WHERE timestamp >= ? AND timestamp <= ? "
+                          "ORDER BY timestamp DESC LIMIT 1")
+INDEXED_HISTORY_SQL = "SELECT ts, score FROM mood_logs WHERE user_id = ? AND ts >= ? AND ts < ? ORDER BY ts ASC"
+MOODS = [chatbot_app.HAPPY, chatbot_app.SAD, chatbot_app.ANGRY, chatbot_app.STRESSED, chatbot_app.CALM]
+
+
+def seed_legacy(path, rows, span_days, batch=50000):
+    db = sqlite3.connect(path)
+    chatbot_app._migration_create_mood_logs(db)
+    db.execute("PRAGMA user_version = 1")
+    end = datetime.now(timezone.utc).replace(tzinfo=None) # Legacy timestamps are naive UTC
+    start = end - timedelta(days=span_days)
+    step = (end - start) / rows
+    rnd = random.Random(42)
+    start_time = time.perf_counter()
+    for offset in range(0, rows, batch):
+        chunk = [(start + step * i, rnd.choice(MOODS), round(rnd.uniform(-1, 1), 4))
+                 for i in range(offset, min(offset + batch, rows))]
+        db.executemany("INSERT INTO mood_logs (timestamp, mood, score) VALUES (?, ?, ?)", chunk)
+        db.commit()
+    db.close()
+    return time.perf_counter() - start_time
+
+
+def time_query(db, sql, params, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = db.execute(sql, params).fetchall()
+        best = min(best, time.perf_counter() - start)
+    plan = " | ".join(row[3] for row in db.execute("EXPLAIN QUERY PLAN " + sql, params))
+    return best * 1000, len(rows), plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--span-days", type=int, default=365, help="Seeded rows are spread over this many days")
+    parser.add_argument("--days", type=int, default=7, help="History window, like /api/mood_history?days=")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workdir", default=None, help="Where to put the databases (default: a temp dir)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="mood_bench_")
+    legacy_path = os.path.join(workdir, "legacy.db")
+    migrated_path = os.path.join(workdir, "migrated.db")
+
+    print(f"Seeding {args.rows:,} rows over {args.span_days} days into {legacy_path} ...")
+    print(f"  seeded in {seed_legacy(legacy_path, args.rows, args.span_days):.1f}s")
+    shutil.copyfile(legacy_path, migrated_path)
+
+    migrated = sqlite3.connect(migrated_path)
+    start = time.perf_counter()
+    chatbot_app.apply_migrations(migrated)
+    print(f"  migrated copy in {time.perf_counter() - start:.1f}s")
+
+    now = datetime.now(timezone.utc)
+    window_start = (now - timedelta(days=args.days - 1)).date()
+    today = datetime.combine(now.date(), datetime.min.time())
+    window_start_ts = chatbot_app.to_epoch(datetime.combine(window_start, datetime.min.time()))
+    window_end_ts = chatbot_app.to_epoch(today + timedelta(days=1))
+
+    # Migrated days are local days in the default time zone
+    local_today = datetime.now(chatbot_app.get_tz(None)).date()
+    local_window_start = local_today - timedelta(days=args.days - 1)
+
+    # The migration assigns every pre-existing row to a single legacy user
+    legacy_user_id = migrated.execute("SELECT MIN(id) FROM users").fetchone()[0]
+    legacy = sqlite3.connect(legacy_path)
+    cases = [
+        ("history (legacy)", legacy, LEGACY_HISTORY_SQL,
+         (window_start.strftime('%Y-%m-%d'), now.strftime('%Y-%m-%d'))),
+        ("history (indexed)", migrated, INDEXED_HISTORY_SQL, (legacy_user_id, window_start_ts, window_end_ts)),
+        ("history (rollup)", migrated, chatbot_app.MOOD_HISTORY_SQL,
+         (legacy_user_id, local_window_start.isoformat(), local_today.isoformat())),
+        ("latest mood (legacy)", legacy, LEGACY_LATEST_MOOD_SQL,
+         (today, datetime.combine(now.date(), datetime.max.time()))),
+        ("latest mood (indexed)", migrated, chatbot_app.LATEST_MOOD_SQL, (legacy_user_id, local_today.isoformat())),
+    ]
+    print(f"\n{'query':<24}{'best ms':>10}{'rows':>10}  plan")
+    for name, db, sql, params in cases:
+        ms, count, plan = time_query(db, sql, params, args.repeat)
+        print(f"{name:<24}{ms:>10.2f}{count:>10,}  {plan}")
+
+    legacy.close()
+    migrated.close()
+    if not args.workdir:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Compares scoring throughput in-process and through ScoringPool with 1..N workers.
+
+Client threads score single messages as /chat does (sentiment cache disabled), so the
+in-process run is bound by the GIL while pool runs can use one core per worker.
+
+    python benchmarks/bench_scoring_pool.py --messages 20000 --threads 16 --workers 1 2 4 8
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chatbot_app # noqa: E402
+
+
+def make_messages(n, seed=7):
+    rnd = random.Random(seed)
+    words = sorted(chatbot_app.KEYWORD_MOOD_INDEX) + ["the", "today", "was", "really", "not", "so", "very", "and"]
+    return [" ".join(rnd.choices(words, k=rnd.randint(4, 30))) for _ in range(n)]
+
+
+def run(messages, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as clients:
+        list(clients.map(chatbot_app.get_mood_and_score, messages))
+    return len(messages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=16, help="concurrent client threads")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    chatbot_app.preload_nltk()
+    chatbot_app.sentiment_cache.max_size = 0
+    messages = make_messages(args.messages)
+    print(f"{os.cpu_count()} CPUs, {args.threads} client threads, {len(messages)} messages")
+    baseline = run(messages, args.threads)
+    print(f"in-process     {baseline:10.0f} msg/s")
+    for workers in sorted(set(args.workers)):
+        chatbot_app.scoring_pool.shutdown()
+        chatbot_app.scoring_pool = pool = chatbot_app.ScoringPool(workers=workers)
+        pool.score(messages[:workers]) # Start the workers outside the timed run
+        rate = run(messages, args.threads)
+        stats = pool.stats()
+        print(f"{workers:2d} worker(s)   {rate:10.0f} msg/s  {rate / baseline:5.2f}x  "
+              f"(fallbacks: {stats['rejected']} rejected, {stats['timeouts']} timed out, {stats['errors']} errors)")
+        pool.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Checks KEYWORD_TOKEN_RE against nltk.word_tokenize and times both keyword tokenizers.
+
+Parity is judged on what scoring uses: the per-mood keyword counts of each text. Three
+corpora are checked:
+
+* CASES, hand-written messages covering contractions, quotes, ellipses, dashes and
+  sentence-final periods. Every one must match.
+* an "ordinary" generated corpus of keywords, filler words and common chat punctuation.
+  Every text must match.
+* a "noisy" generated corpus drawing from all ASCII punctuation. Its mismatch rate is only
+  reported; the known divergences are all of this kind:
+    - runs of mixed punctuation: Treebank keeps the second mark glued to the next word
+      ("calm::love" -> ":love", "worried,,happy" -> ",happy");
+    - a quote right after a non-word symbol ("okay+'happy") or a period ("hate.'sad"):
+      Treebank splits the quote off, the regex keeps one token;
+    - commas between digits ("fun,1liked" stays one Treebank token).
+
+When the punkt model is not installed the reference is approximated by splitting sentences
+at . ! ? (optionally followed by one closing bracket or quote) plus whitespace, and
+tokenizing each with word_tokenize(preserve_line=True).
+
+    python benchmarks/bench_tokenizer.py --texts 20000
+"""
+import argparse
+import os
+import random
+import re
+import string
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chatbot_app # noqa: E402
+
+CASES = [
+    "I'm so happy today!", "i am happy. then sad.", "Feeling stressed... really stressed.",
+    "happy--sad", "happy-go-lucky", "it's been a calm, peaceful day", "\"great\" day",
+    "'great' day", "can't relax, won't relax", "today's deadline was awful", "angry?! furious!!",
+    "well... okay", "sad.", "(happy)", "I was happy.) and then", "so tired & exhausted",
+    "love it :)", "ugh :( sad", "overwhelmed/anxious", "happy2day", "super_happy",
+    "it was awesome.’", "he said ''calm'' twice", "tension....sad", "bad... bad.. bad.",
+    "lonely; bitter: angry", "STRESSED", "the end.", "", "   ",
+]
+FILLER = ["the", "i", "today", "was", "really", "don't", "can't", "it's", "so", "very", "my", "day"]
+ORDINARY_PUNCT = [" ", " ", " ", ", ", ". ", "! ", "? ", "... ", "!! ", " - ", " (", ") ", "'s ", " \"", "\" ", ":) "]
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+|(?<=[.!?][)\]}\"'’”])\s+")
+NOISY_PUNCT = list(string.punctuation) + [" ", " ", " ", "\t", "\n", "..", "....", "''", "…", "’", "1"]
+
+
+def reference_tokenize(text):
+    if chatbot_app.punkt_available:
+        return chatbot_app.word_tokenize(text)
+    from nltk.tokenize import word_tokenize
+    sentences = SENTENCE_END_RE.split(text)
+    return [token for sentence in sentences for token in word_tokenize(sentence, preserve_line=True)]
+
+
+def keyword_counts(tokens):
+    counts = Counter()
+    for token in tokens:
+        for mood_idx in chatbot_app.KEYWORD_MOOD_INDEX.get(token, ()):
+            counts[chatbot_app.KEYWORD_MOODS[mood_idx]] += 1
+    return counts
+
+
+def generate(n, punct, seed):
+    rnd = random.Random(seed)
+    words = sorted(chatbot_app.KEYWORD_MOOD_INDEX) + FILLER
+    texts = []
+    for _ in range(n):
+        parts = [rnd.choice(words) + "".join(rnd.choices(punct, k=rnd.randint(1, 2))) for _ in range(rnd.randint(1, 12))]
+        texts.append("".join(parts).lower())
+    return texts
+
+
+def mismatches(texts):
+    found = []
+    for text in texts:
+        lower = text.lower()
+        expected = keyword_counts(reference_tokenize(lower))
+        actual = keyword_counts(chatbot_app.KEYWORD_TOKEN_RE.findall(lower))
+        if expected != actual: found.append((text, dict(expected), dict(actual)))
+    return found
+
+
+def time_per_text(fn, texts, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts: fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(texts) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--texts", type=int, default=20000, help="generated texts per corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="timing repetitions (best is reported)")
+    args = parser.parse_args()
+
+    chatbot_app.wait_for_nltk()
+    print(f"reference: {'nltk.word_tokenize (punkt)' if chatbot_app.punkt_available else 'regex sentence split + word_tokenize(preserve_line=True)'}")
+
+    failed = False
+    for name, texts, strict in (("cases", CASES, True),
+                                ("ordinary", generate(args.texts, ORDINARY_PUNCT, 1), True),
+                                ("noisy", generate(args.texts, NOISY_PUNCT, 2), False)):
+        found = mismatches(texts)
+        print(f"parity {name:<9} {len(texts) - len(found)}/{len(texts)} match ({len(found) / len(texts):.2%} differ)")
+        for text, expected, actual in found[:5]:
+            print(f"    {text!r}: nltk {expected} regex {actual}")
+        failed |= strict and bool(found)
+
+    texts = generate(args.texts, ORDINARY_PUNCT, 3)
+    regex_us = time_per_text(chatbot_app.KEYWORD_TOKEN_RE.findall, texts, args.repeat)
+    nltk_us = time_per_text(reference_tokenize, texts, args.repeat)
+    print(f"tokenize  regex {regex_us:8.2f} us/text   nltk {nltk_us:8.2f} us/text   ({nltk_us / regex_us:.1f}x)")
+
+    chatbot_app.sentiment_cache.max_size = 0 # Time scoring, not the cache
+    tokenize_for_keywords = chatbot_app.tokenize_for_keywords
+    for name, tokenizer in (("regex", chatbot_app.KEYWORD_TOKEN_RE.findall), ("nltk", reference_tokenize)):
+        chatbot_app.tokenize_for_keywords = tokenizer
+        print(f"score     {name:<5} {time_per_text(chatbot_app.get_mood_and_score, texts, args.repeat):8.2f} us/text")
+    chatbot_app.tokenize_for_keywords = tokenize_for_keywords
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""Local HTTP load test: requests/sec and latency of the chat workload.
+
+Each virtual user keeps its own session cookie, starts a conversation with POST /reset and
+then loops over POST /chat (most requests), GET /api/mood_history and GET /api/daily_quote.
+
+Against a running server:
+
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --concurrency 16 --duration 20
+
+Against a running server, requests turned away with 429 (rate limit or scoring admission)
+are counted as "throttled", not as errors.
+
+Before/after comparison, with rate limiting off so both servers take the full load.
+Starts each server on a scratch database, loads it and stops it:
+  before  the old entry point: werkzeug dev server, threaded=False
+  after   gunicorn -c gunicorn.conf.py wsgi:app, or the threaded werkzeug server when
+          gunicorn is not installed
+
+    python benchmarks/load_test.py --compare --concurrency 16 --duration 20
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MESSAGES = [
+    "I had a really great day at work, everything went well!", "Feeling stressed about the deadline tomorrow.",
+    "Honestly I'm just tired and a bit sad.", "It was calm and relaxing, nothing special.",
+    "I'm so angry at how unfair that meeting was.", "Pretty good, had lunch with friends.",
+    "Overwhelmed with everything on my plate right now.", "Just okay I guess.",
+]
+DEV_SERVER = ("import signal, sys, chatbot_app as c; c.create_app(preload=True); "
+              "signal.signal(signal.SIGTERM, lambda *_: sys.exit(0)); "
+              "c.app.run(host='127.0.0.1', port={port}, threaded={threaded})")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(url, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url + "/api/ready", timeout=2) as response:
+                if response.status == 200: return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not become ready")
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, url, stop_at, seed):
+        super().__init__(daemon=True)
+        self.url = url
+        self.stop_at = stop_at
+        self.rnd = random.Random(seed)
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.samples = [] # (endpoint, seconds)
+        self.errors = 0
+        self.throttled = 0 # 429 responses (rate limit or scoring admission)
+
+    def request(self, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.url + path, data=data, method="POST" if data is not None else "GET",
+                                     headers={"Content-Type": "application/json"} if data else {})
+        start = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 429: self.throttled += 1
+            else: self.errors += 1
+            return
+        except OSError:
+            self.errors += 1
+            return
+        self.samples.append((path.split("?")[0], time.perf_counter() - start))
+
+    def run(self):
+        self.request("/reset", {})
+        while time.monotonic() < self.stop_at:
+            roll = self.rnd.random()
+            if roll < 0.8: self.request("/chat", {"message": self.rnd.choice(MESSAGES)})
+            elif roll < 0.9: self.request("/api/mood_history")
+            else: self.request("/api/daily_quote")
+
+
+def percentile(sorted_values, p):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def load(url, concurrency, duration):
+    stop_at = time.monotonic() + duration
+    users = [VirtualUser(url, stop_at, seed) for seed in range(concurrency)]
+    start = time.perf_counter()
+    for user in users: user.start()
+    for user in users: user.join()
+    elapsed = time.perf_counter() - start
+    latencies = sorted(seconds for user in users for _, seconds in user.samples)
+    return {
+        "requests": len(latencies),
+        "errors": sum(user.errors for user in users),
+        "throttled": sum(user.throttled for user in users),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def serve(kind, port, env):
+    if kind == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "wsgi:app"]
+    else:
+        cmd = [sys.executable, "-c", DEV_SERVER.format(port=port, threaded=kind == "threaded")]
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def compare(args):
+    try:
+        import gunicorn # noqa: F401
+        after = "gunicorn"
+    except ImportError:
+        print("gunicorn is not installed; 'after' uses the threaded werkzeug server")
+        after = "threaded"
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, kind in (("before", "dev"), ("after", after)):
+            env = dict(os.environ, MOOD_DATABASE=os.path.join(tmp, f"{label}.db"), RATE_LIMIT_BACKEND="off")
+            port = free_port()
+            server = serve(kind, port, env)
+            try:
+                url = f"http://127.0.0.1:{port}"
+                wait_until_ready(url)
+                results[label] = dict(server=kind, **load(url, args.concurrency, args.duration))
+            finally:
+                server.terminate() # SIGTERM: graceful shutdown, pending logs are flushed
+                server.wait(timeout=30)
+            print(f"{label:<7} {json.dumps(results[label])}")
+    if results["before"]["rps"]:
+        print(f"speedup {results['after']['rps'] / results['before']['rps']:.2f}x requests/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="base URL of a running server")
+    parser.add_argument("--compare", action="store_true", help="start and compare the old and new serving modes")
+    parser.add_argument("--concurrency", type=int, default=16, help="virtual users")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load per run")
+    args = parser.parse_args()
+    if args.compare:
+        compare(args)
+    elif args.url:
+        print(json.dumps(load(args.url.rstrip("/"), args.concurrency, args.duration)))
+    else:
+        parser.error("give --url or --compare")
+
+
+if __name__ == "__main__":
+    main()
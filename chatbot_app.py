@@ -1,20 +1,131 @@
 import random
-import nltk
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
+import atexit
+import bisect
+import calendar
+import csv
+import functools
+import glob
+import gzip
+import io
+import itertools
+import hashlib
+import json
+import logging
+import math
+import mimetypes
+import mmap
+import queue
+import re
+import secrets
+import time
+import gc
+import multiprocessing
+import signal
+import struct
+import subprocess
 import sys
-import statistics
-from datetime import datetime, timedelta, date # Added date
-import pytz
+import urllib.request
+import zlib
+from datetime import datetime, timedelta, timezone, date # Added date
 import sqlite3
-from flask import Flask, request, jsonify, session, render_template, url_for, flash, redirect, send_from_directory
+import click
+from flask.helpers import get_debug_flag
+from flask import Flask, Response, request, jsonify, session, render_template, url_for, flash, redirect, send_file, send_from_directory, g
 import os
-import traceback
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import numpy as np
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
+try:
+    from PIL import Image, ImageOps, features as pil_features
+except ImportError: # Optional: without Pillow, pictures are stored as uploaded (still content-addressed)
+    Image = None
 
 # --- Basic Flask App Setup ---
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-DATABASE = 'mood_data.db'
+PICTURE_SIZES = (64, 256) # Square thumbnails made from each upload (the profile page shows 256)
+PICTURE_FORMAT = os.environ.get('PICTURE_FORMAT', 'webp') # 'webp' or 'jpeg'; JPEG if Pillow lacks WebP
+PICTURE_QUALITY = 82
+PICTURE_MAX_PIXELS = 40_000_000 # Uploads decoding to more pixels are refused (decompression bombs)
+PICTURE_WORKERS = int(os.environ.get('PICTURE_WORKERS', 2)) # Threads resizing and encoding uploads
+PICTURE_WAIT_TIMEOUT = 10.0 # Seconds a request for a thumbnail waits on its pending job
+PICTURE_CACHE_MAX_AGE = 365 * 24 * 3600 # Content-addressed files never change
+ASSET_CACHE_MAX_AGE = 365 * 24 * 3600 # Fingerprinted assets (flask build-assets) never change either
+DATABASE = os.environ.get('MOOD_DATABASE', 'mood_data.db')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8)) # Idle connections kept per process
+DB_BUSY_TIMEOUT = 5.0 # Seconds to wait on a locked database
+DB_CACHE_SIZE_KIB = 16 * 1024 # Page cache per connection
+DB_MMAP_SIZE = 64 * 1024 * 1024
+DB_STATEMENT_CACHE_SIZE = 128 # Compiled statements kept per connection
+MOOD_LOG_WRITE_BEHIND = os.environ.get('MOOD_LOG_WRITE_BEHIND', '1') != '0' # '0' = synchronous INSERT per message
+MOOD_LOG_FLUSH_SIZE = 200 # Flush when this many rows are queued...
+MOOD_LOG_FLUSH_INTERVAL = 0.5 # ...or when the oldest queued row is this many seconds old
+MOOD_LOG_QUEUE_MAX = 10000 # Past this, enqueue writes synchronously (backpressure)
+KEYWORD_TOKENIZER = os.environ.get('KEYWORD_TOKENIZER', 'regex') # 'regex' (KEYWORD_TOKEN_RE) or 'nltk' (punkt, else split)
+NLTK_WARMUP = os.environ.get('NLTK_WARMUP', '1') != '0' # '0' = load NLTK on first use instead of in the background
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite') # 'sqlite' (server-side) or 'cookie' (Flask default)
+# In-memory LRU in front of the sessions table. Only safe when a session is always served by
+# the same process (single worker or sticky routing), so it is off by default.
+SESSION_LRU_SIZE = int(os.environ.get('SESSION_LRU_SIZE', 0))
+SESSION_PURGE_EVERY = 1000 # Delete expired session rows once per this many session writes
+TRAJECTORY_FAST_ALPHA = 0.3 # EWMA weight of the newest score: the current mood level
+TRAJECTORY_SLOW_ALPHA = 0.1 # Slower EWMA (baseline); level - baseline is the trend direction
+TRAJECTORY_TREND_BAND = 0.1 # |level - baseline| below this is a steady trend
+SENTIMENT_CACHE_SIZE = int(os.environ.get('SENTIMENT_CACHE_SIZE', 4096)) # In-memory entries; 0 disables the cache
+SENTIMENT_CACHE_SHARED = os.environ.get('SENTIMENT_CACHE_SHARED', '0') == '1' # SQLite tier shared across workers
+SENTIMENT_CACHE_SHARED_MAX_ROWS = 100000
+SENTIMENT_CACHE_MAX_TEXT_LEN = 256 # Longer messages rarely repeat; don't let them evict short replies
+SCORING_WORKERS = int(os.environ.get('SCORING_WORKERS', 0)) # Scoring processes; 0 = score in the request thread
+SCORING_TIMEOUT = float(os.environ.get('SCORING_TIMEOUT', 5.0)) # Seconds to wait for a slot and for results
+SCORING_MAX_PENDING = int(os.environ.get('SCORING_MAX_PENDING', 32)) # Requests in flight before callers wait (backpressure)
+SCORING_CHUNK_SIZE = 256 # Texts per task when a batch is spread over the workers
+# Scoring requests (chat turns, batch analysis) running at once per process; the rest get 429
+SCORING_MAX_CONCURRENT = int(os.environ.get('SCORING_MAX_CONCURRENT', 2 * (SCORING_WORKERS or os.cpu_count() or 1)))
+SCORING_ADMISSION_WAIT = 0.05 # Seconds a request may wait for a scoring slot before it is turned away
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory') # 'memory' (per process), 'sqlite' (shared) or 'off'
+# Token buckets as "burst,tokens per second", per user (else per client IP); each request takes one token
+RATE_LIMIT_CHAT = os.environ.get('RATE_LIMIT_CHAT', '30,1')
+RATE_LIMIT_ANALYSIS = os.environ.get('RATE_LIMIT_ANALYSIS', '10,0.2') # /api/analyze/batch and imports
+RATE_LIMIT_MAX_KEYS = 100000 # Buckets kept by the memory backend; an evicted one starts full again
+RATE_LIMIT_PURGE_EVERY = 1000 # SQLite backend: delete idle (so full) buckets once per this many checks
+# The pool starts from a request thread while the log, writer and warmup threads run, and a
+# plain fork of a threaded process can deadlock on a lock some thread held; forkserver forks
+# workers from a clean single-threaded server instead.
+SCORING_START_METHOD = os.environ.get('SCORING_START_METHOD',
+                                      'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+RESPONSE_CACHE_USERS = int(os.environ.get('RESPONSE_CACHE_USERS', 1024)) # Users with cached history/quote responses; 0 disables
+RESPONSE_CACHE_KEYS_PER_USER = 16 # Oldest of a user's cached responses goes first
+MAX_HISTORY_DAYS = 366 # /api/mood_history?days= limit; longer ranges use /api/mood_history/range
+MAX_HISTORY_POINTS = 500 # Point budget of /api/mood_history/range (max_points can only lower it)
+MAX_MOOD_LOGS_PAGE = 500 # Rows per /api/mood_logs page
+MAX_PROFILE_AGE = 150 # Years; larger profile ages are rejected
+MAX_PROFILE_WEIGHT = 1000.0 # Upper bound whether the user entered kg or lb
+# start/end query dates are clamped to these, so the local midnight after the last day
+# still has an epoch timestamp in every time zone (datetime stops at year 9999)
+MIN_QUERY_DAY = date(1970, 1, 1)
+MAX_QUERY_DAY = date(9999, 12, 28)
+EXPORT_FETCH_ROWS = 1000 # Rows per fetchmany() and per streamed chunk of an export
+IMPORT_CHUNK_ROWS = 10000 # NDJSON lines parsed, scored and inserted per transaction
+IMPORT_MAX_TS = 253402041600 # 9999-12-29 UTC: the latest instant every time zone can still turn into a date
+IMPORT_MAX_BYTES = int(os.environ.get('IMPORT_MAX_BYTES', 256 * 1024 * 1024)) # Request body limit of /api/mood_logs/import
+DEFAULT_TIMEZONE = os.environ.get('DEFAULT_TIMEZONE', 'Asia/Kolkata') # Users who haven't set one; also for pre-timezone rows
+# 'auto' scores with the compiled lexicon at LEXICON_PATH when it exists and is valid
+# (flask build-lexicon), else parses NLTK's vader_lexicon.txt; 'nltk' always parses.
+LEXICON_BACKEND = os.environ.get('LEXICON_BACKEND', 'auto')
+LEXICON_PATH = os.environ.get('LEXICON_PATH', 'vader_lexicon.bin')
+LEXICON_MEMO_SIZE = 4096 # Recently looked-up words kept in a dict in front of the mapped table
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper() # DEBUG adds per-message chat traces
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -22,86 +133,1332 @@ app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', b'_5#y2L"F4Q8z\n\xec]/')
 
+# --- Logging ---
+# Request threads only put records on a queue; a QueueListener thread formats them and
+# does the (blocking) stderr writes.
+log = logging.getLogger('moodbot')
+log.setLevel(LOG_LEVEL)
+log.propagate = False
+_log_handler = logging.StreamHandler() # stderr, written by the listener thread only
+_log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(threadName)s] %(message)s'))
+_log_queue_handler = QueueHandler(queue.SimpleQueue())
+log.addHandler(_log_queue_handler)
+_log_listener = None
+
+def start_log_listener():
+    """Starts the thread that drains the log queue (again after a fork: threads don't survive it)."""
+    global _log_listener
+    log_queue = queue.SimpleQueue()
+    _log_queue_handler.queue = log_queue
+    _log_listener = QueueListener(log_queue, _log_handler)
+    _log_listener.start()
+
+def stop_log_listener():
+    """Writes out every queued record and stops the listener thread."""
+    global _log_listener
+    listener, _log_listener = _log_listener, None
+    if listener is not None: listener.stop()
+
+start_log_listener()
+os.register_at_fork(after_in_child=start_log_listener)
+atexit.register(stop_log_listener) # Registered first, so it runs after every other exit hook
+
+# --- Timing Spans and Metrics ---
+# Latency histograms with Prometheus semantics (cumulative "le" buckets, in seconds),
+# exposed at /metrics together with the stats() of the pools, caches and writer.
+SPAN_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class Histogram:
+    """Thread-safe histogram: a count per bucket (last one is +Inf), plus sum and count."""
+
+    def __init__(self, buckets=SPAN_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.buckets, seconds) # First bucket with seconds <= le
+        with self._lock:
+            self.counts[i] += 1
+            self.total += seconds
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.total, self.count
+
+class SpanMetrics:
+    """Histograms by name. observe(name, start) records time.perf_counter() - start."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram())
+        return histogram
+
+    def observe(self, name, start):
+        self.histogram(name).observe(time.perf_counter() - start)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, start)
+
+    def items(self):
+        with self._lock:
+            return sorted(self._histograms.items())
+
+spans = SpanMetrics() # Hot-path stages: sentiment, tokenize, question_selection, db_insert, session_*
+request_latency = SpanMetrics() # Per route, until the response headers are ready
+
+def render_histograms(metric, label, metrics, help_text):
+    lines = [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+    for name, histogram in metrics.items():
+        counts, total, count = histogram.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_sum{{{label}="{name}"}} {total:.6f}')
+        lines.append(f'{metric}_count{{{label}="{name}"}} {count}')
+    return lines
+
+def render_gauges(prefix, stats):
+    """Numeric (and boolean) entries of a stats() dict as gauges."""
+    lines = []
+    for key, value in sorted(stats.items()):
+        if isinstance(value, bool): value = int(value)
+        if isinstance(value, (int, float)):
+            lines.append(f"# TYPE {prefix}_{key} gauge")
+            lines.append(f"{prefix}_{key} {value}")
+    return lines
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    start = g.get('request_start')
+    if start is not None:
+        request_latency.observe(request.url_rule.rule if request.url_rule else "<unmatched>", start)
+    return response
+
 # --- Database Setup ---
-def get_db():
-    try:
-        db = sqlite3.connect(DATABASE)
+class SQLiteConnectionPool:
+    """Thread-safe pool of configured SQLite connections to one database file.
+
+    PRAGMAs are applied once, when a connection is opened, and because connections are
+    reused their compiled-statement caches survive across requests. When the pool is
+    empty a new connection is opened instead of blocking; released connections beyond
+    max_size are closed. The pool is per process: after a fork, inherited connections
+    are dropped and the child opens its own.
+    """
+
+    def __init__(self, database, max_size=DB_POOL_SIZE):
+        self.database = database
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._idle = [] # LIFO, so the most recently used (warmest) connection goes out first
+        self._pid = os.getpid()
+        self.opened = 0
+
+    def _connect(self):
+        db = sqlite3.connect(self.database, timeout=DB_BUSY_TIMEOUT, check_same_thread=False,
+                             cached_statements=DB_STATEMENT_CACHE_SIZE)
         db.row_factory = sqlite3.Row
         db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KIB}")
+        db.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        self.opened += 1
         return db
+
+    def _check_pid(self):
+        # SQLite connections must not be shared across fork(); forget the parent's ones.
+        if self._pid != os.getpid():
+            self._idle = []
+            self._pid = os.getpid()
+
+    def acquire(self):
+        with self._lock:
+            self._check_pid()
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def release(self, db):
+        try:
+            if db.in_transaction:
+                db.rollback() # Never hand out a connection with someone else's open transaction
+        except sqlite3.Error:
+            db.close()
+            return
+        with self._lock:
+            self._check_pid()
+            if len(self._idle) < self.max_size:
+                self._idle.append(db)
+                return
+        db.close()
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection outside of a request (background threads, CLI commands)."""
+        db = self.acquire()
+        try:
+            yield db
+        finally:
+            self.release(db)
+
+    def close_all(self):
+        with self._lock:
+            self._check_pid() # A forked child must not close the parent's connections
+            idle, self._idle = self._idle, []
+        for db in idle:
+            db.close()
+
+    def stats(self):
+        with self._lock:
+            return {"idle": len(self._idle), "opened": self.opened, "max_size": self.max_size}
+
+db_pool = SQLiteConnectionPool(DATABASE)
+
+def get_db():
+    """Returns the pooled connection bound to the current app context, or None on error."""
+    if 'db' not in g:
+        try:
+            g.db = db_pool.acquire()
+        except sqlite3.Error as e:
+            log.error("Error connecting to database: %s", e)
+            return None
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    """Returns the app context's connection to the pool instead of closing it."""
+    db = g.pop('db', None)
+    if db is not None:
+        db_pool.release(db)
+
+# --- Write-Behind Mood Logger ---
+class MoodLogWriter:
+    """Queues (user_id, timestamp, local_day, mood, score) rows and writes them to mood_logs on a background thread.
+
+    Rows are flushed with executemany in a single transaction once flush_size rows are
+    queued or the oldest one has waited flush_interval seconds, so /chat can reply before
+    its row reaches disk. flush() waits until the rows queued before it are committed (used
+    by readers that need their own writes), and stop() drains the queue and checkpoints
+    the WAL on shutdown.
+    """
+
+    INSERT_SQL = 'INSERT INTO mood_logs (user_id, ts, local_day, mood, score) VALUES (?, ?, ?, ?, ?)'
+    _FLUSH_NOW = () # Queue marker: write the batch being collected without waiting out the interval
+
+    def __init__(self, pool, flush_size=MOOD_LOG_FLUSH_SIZE, flush_interval=MOOD_LOG_FLUSH_INTERVAL,
+                 max_queue=MOOD_LOG_QUEUE_MAX, enabled=MOOD_LOG_WRITE_BEHIND):
+        self.pool = pool
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.enabled = enabled
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._reset()
+        self.rows_enqueued = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def _reset(self):
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._pending_cond = threading.Condition()
+        self._drain_lock = threading.Lock() # One thread at a time drains the queue when the writer isn't running
+        # Queued rows are numbered in queue order. The writer consumes them in that order, so
+        # once a batch ending at seq N is committed, every row queued up to N is.
+        self._enqueued_seq = 0
+        self._committed_seq = 0
+        self._stopping = False
+        self._pid = os.getpid()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid(): # Forked: the parent's thread and queue don't exist here
+                self._thread = None
+                self._reset()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="mood-log-writer", daemon=True)
+                self._thread.start()
+
+    def enqueue(self, user_id, timestamp, day, mood, score):
+        row = (user_id, to_epoch(timestamp), day, mood, score)
+        if not self.enabled or self._stopping:
+            self._write([row])
+            return
+        self._ensure_started()
+        with self._pending_cond: # Numbering and putting together keeps seq in queue order
+            try:
+                self._queue.put_nowait((self._enqueued_seq + 1, row))
+            except queue.Full:
+                queued = False
+            else:
+                queued = True
+                self._enqueued_seq += 1
+                self.rows_enqueued += 1
+        if not queued:
+            self._write([row]) # Writer is behind; take the hit on this request
+
+    def _collect(self):
+        batch = []
+        deadline = None
+        while len(batch) < self.flush_size:
+            timeout = self.flush_interval if deadline is None else deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None or item is self._FLUSH_NOW: # Stop sentinel / flush() is waiting
+                break
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stopping or not self._queue.empty():
+            batch = self._collect()
+            if batch:
+                self._write([row for _, row in batch], last_seq=batch[-1][0])
+
+    def _write(self, batch, last_seq=None):
+        start = time.perf_counter()
+        ok = True
+        try:
+            with self.pool.connection() as db:
+                with db: # One transaction for the whole batch
+                    db.executemany(self.INSERT_SQL, batch)
+                    update_user_trajectories(db, batch)
+            response_cache.invalidate_users({row[0] for row in batch})
+        except sqlite3.Error as e:
+            ok = False
+            log.error("Failed to write %d mood log row(s): %s", len(batch), e)
+        spans.observe("db_insert", start)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._pending_cond: # Also guards the counters, which several threads update
+            if ok:
+                self.rows_written += len(batch)
+            else:
+                self.flush_errors += 1
+                self.rows_dropped += len(batch)
+            self.flushes += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+            if last_seq is not None: # Failed batches count too, so flush() never waits on dropped rows
+                self._committed_seq = max(self._committed_seq, last_seq)
+                self._pending_cond.notify_all()
+
+    def flush(self, timeout=5.0):
+        """Waits until every row queued before this call is committed.
+
+        Rows queued after the call (other requests' chat turns) are not waited for, so a
+        reader's wait is bounded by the queue as it was, even under sustained traffic.
+        """
+        if self._pid != os.getpid():
+            return
+        with self._pending_cond:
+            target = self._enqueued_seq
+            if self._committed_seq >= target:
+                return
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put_nowait(self._FLUSH_NOW) # Writer stops collecting and commits what it has
+            except queue.Full:
+                pass # A full queue means the writer is flushing by size anyway
+        else:
+            with self._drain_lock:
+                batch = []
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None and item is not self._FLUSH_NOW:
+                        batch.append(item)
+                if batch:
+                    self._write([row for _, row in batch], last_seq=batch[-1][0])
+        with self._pending_cond:
+            self._pending_cond.wait_for(lambda: self._committed_seq >= target, timeout=timeout)
+
+    def stop(self, timeout=10.0):
+        """Durable shutdown: stops the thread, writes everything pending and checkpoints the WAL."""
+        if self._pid != os.getpid():
+            return
+        self._stopping = True
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        self.flush(timeout)
+        try:
+            with self.pool.connection() as db:
+                db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            log.warning("WAL checkpoint on shutdown failed: %s", e)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "queue_depth": self._queue.qsize(),
+            "pending": self._enqueued_seq - self._committed_seq,
+            "rows_enqueued": self.rows_enqueued,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 3),
+        }
+
+mood_log_writer = MoodLogWriter(db_pool)
+atexit.register(mood_log_writer.stop)
+
+def to_epoch(dt_utc):
+    """Converts a UTC datetime (naive or aware) to integer epoch seconds (the mood_logs.ts format)."""
+    return calendar.timegm(dt_utc.utctimetuple())
+
+def utc_isoformat(epoch):
+    """'YYYY-MM-DDTHH:MM:SSZ' for epoch seconds (the timestamp format of the log and export APIs)."""
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+# --- Time Zones ---
+def is_valid_timezone(name):
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError, TypeError): # TypeError: not a string
+        return False
+
+@functools.lru_cache(maxsize=64)
+def get_tz(name):
+    """ZoneInfo for an IANA name, or DEFAULT_TIMEZONE for None/''/unknown names.
+
+    Cached, so a request only pays for the conversion itself (zoneinfo's C implementation;
+    pytz conversions cost about ten times more).
+    """
+    return ZoneInfo(name) if name and is_valid_timezone(name) else ZoneInfo(DEFAULT_TIMEZONE)
+
+def local_day(epoch, tz):
+    """'YYYY-MM-DD' of epoch seconds in tz (the mood_logs.local_day format)."""
+    return datetime.fromtimestamp(epoch, tz).date().isoformat()
+
+def local_day_start(day, tz):
+    """Epoch seconds of the local midnight that starts day (a date) in tz."""
+    return int(datetime.combine(day, datetime.min.time(), tzinfo=tz).timestamp())
+
+# --- Schema Migrations ---
+# Each migration runs in its own transaction and bumps PRAGMA user_version, so init_db
+# only applies the ones a database hasn't seen yet. Append new migrations; never edit
+# or reorder existing ones.
+def _migration_create_mood_logs(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS mood_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            mood TEXT NOT NULL,
+            score REAL NOT NULL
+        )
+    ''')
+
+def _migration_epoch_timestamps(db):
+    # Text timestamps only support range scans if every query compares raw strings;
+    # integer epoch seconds plus a covering index make both endpoints index range scans.
+    db.execute('''
+        CREATE TABLE mood_logs_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts INTEGER NOT NULL, -- Epoch seconds, UTC
+            mood TEXT NOT NULL,
+            score REAL NOT NULL
+        )
+    ''')
+    unparseable = db.execute("SELECT id, timestamp FROM mood_logs WHERE strftime('%s', timestamp) IS NULL").fetchall()
+    if unparseable: # Can't be placed on the time axis; listed so they can be recovered from a backup
+        log.warning("Dropping %d mood_logs rows whose timestamp is not a date: %s", len(unparseable),
+                    ", ".join(f"id {row[0]} ({row[1]!r})" for row in unparseable[:20]) + (", ..." if len(unparseable) > 20 else ""))
+    db.execute('''
+        INSERT INTO mood_logs_new (id, ts, mood, score)
+        SELECT id, CAST(strftime('%s', timestamp) AS INTEGER), mood, score
+        FROM mood_logs WHERE strftime('%s', timestamp) IS NOT NULL
+    ''')
+    db.execute("DROP TABLE mood_logs")
+    db.execute("ALTER TABLE mood_logs_new RENAME TO mood_logs")
+    db.execute("CREATE INDEX idx_mood_logs_ts_mood_score ON mood_logs (ts, mood, score)")
+
+def agg_mood_columns():
+    """(mood, column) pairs for the per-mood histogram columns of mood_daily_agg, e.g. happy_count."""
+    return [(mood, f"{mood.lower()}_count") for mood in KEYWORD_MOODS]
+
+def _create_mood_daily_agg(db, keys):
+    """Creates mood_daily_agg and the trigger that maintains it.
+
+    keys is a list of (column, type, expression) for the rollup key; expressions use
+    {row} where a mood_logs column is referenced, e.g. "date({row}ts, 'unixepoch')".
+    """
+    key_defs = "".join(f"{column} {column_type} NOT NULL, " for column, column_type, _ in keys)
+    key_names = ", ".join(column for column, _, _ in keys)
+    histogram_defs = ", ".join(f"{column} INTEGER NOT NULL DEFAULT 0" for _, column in agg_mood_columns())
+    db.execute(f'''
+        CREATE TABLE mood_daily_agg (
+            {key_defs}
+            count INTEGER NOT NULL,
+            score_sum REAL NOT NULL,
+            score_min REAL NOT NULL,
+            score_max REAL NOT NULL,
+            {histogram_defs},
+            PRIMARY KEY ({key_names})
+        ) WITHOUT ROWID
+    ''')
+    columns = ", ".join(column for _, column in agg_mood_columns())
+    key_values = ", ".join(expression.format(row="NEW.") for _, _, expression in keys)
+    values = ", ".join(f"NEW.mood = '{mood}'" for mood, _ in agg_mood_columns())
+    updates = ", ".join(f"{column} = {column} + excluded.{column}" for _, column in agg_mood_columns())
+    db.execute(f'''
+        CREATE TRIGGER mood_logs_update_daily_agg AFTER INSERT ON mood_logs
+        BEGIN
+            INSERT INTO mood_daily_agg ({key_names}, count, score_sum, score_min, score_max, {columns})
+            VALUES ({key_values}, 1, NEW.score, NEW.score, NEW.score, {values})
+            ON CONFLICT({key_names}) DO UPDATE SET
+                count = count + 1,
+                score_sum = score_sum + excluded.score_sum,
+                score_min = min(score_min, excluded.score_min),
+                score_max = max(score_max, excluded.score_max),
+                {updates};
+        END
+    ''')
+    _fill_mood_daily_agg(db, keys)
+
+def _fill_mood_daily_agg(db, keys):
+    key_names = ", ".join(column for column, _, _ in keys)
+    key_values = ", ".join(expression.format(row="") for _, _, expression in keys)
+    group_by = ", ".join(str(position) for position in range(1, len(keys) + 1))
+    columns = ", ".join(column for _, column in agg_mood_columns())
+    sums = ", ".join(f"SUM(mood = '{mood}')" for mood, _ in agg_mood_columns())
+    db.execute("DELETE FROM mood_daily_agg")
+    cursor = db.execute(f'''
+        INSERT INTO mood_daily_agg ({key_names}, count, score_sum, score_min, score_max, {columns})
+        SELECT {key_values}, COUNT(*), SUM(score), MIN(score), MAX(score), {sums}
+        FROM mood_logs GROUP BY {group_by}
+    ''')
+    return cursor.rowcount
+
+def _migration_mood_daily_agg(db):
+    # One row per UTC day, maintained by a trigger so every insert path (write-behind
+    # batches, imports) keeps it current inside the inserting transaction.
+    _create_mood_daily_agg(db, [("day", "TEXT", "date({row}ts, 'unixepoch')")])
+
+def _migration_users(db):
+    db.execute('''
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL DEFAULT 'User Name',
+            age INTEGER,
+            weight REAL,
+            picture_filename TEXT,
+            created_at INTEGER NOT NULL -- Epoch seconds, UTC
+        )
+    ''')
+    db.execute("ALTER TABLE mood_logs ADD COLUMN user_id INTEGER REFERENCES users(id)")
+    if db.execute("SELECT 1 FROM mood_logs LIMIT 1").fetchone():
+        # Logs written before per-user scoping were one shared timeline; keep them together under one user.
+        cursor = db.execute("INSERT INTO users (name, created_at) VALUES (?, ?)", ('Legacy log', to_epoch(datetime.now(timezone.utc))))
+        db.execute("UPDATE mood_logs SET user_id = ?", (cursor.lastrowid,))
+    db.execute("DROP INDEX idx_mood_logs_ts_mood_score")
+    db.execute("CREATE INDEX idx_mood_logs_user_ts ON mood_logs (user_id, ts, mood, score)")
+    db.execute("DROP TRIGGER mood_logs_update_daily_agg")
+    db.execute("DROP TABLE mood_daily_agg")
+    _create_mood_daily_agg(db, [("user_id", "INTEGER", "{row}user_id"), ("day", "TEXT", "date({row}ts, 'unixepoch')")])
+
+def _migration_sessions(db):
+    db.execute('''
+        CREATE TABLE sessions (
+            sid TEXT PRIMARY KEY,
+            data TEXT NOT NULL, -- JSON
+            expires INTEGER NOT NULL -- Epoch seconds
+        ) WITHOUT ROWID
+    ''')
+    db.execute("CREATE INDEX idx_sessions_expires ON sessions (expires)")
+
+def _migration_sentiment_cache(db):
+    db.execute('''
+        CREATE TABLE sentiment_cache (
+            key TEXT PRIMARY KEY, -- sha256 of the normalized text, so messages aren't stored
+            fingerprint TEXT NOT NULL, -- Scoring configuration the entry was computed with
+            mood TEXT NOT NULL,
+            score REAL NOT NULL
+        )
+    ''')
+
+def _create_log_version_trigger(db):
+    """Creates the trigger that bumps users.log_version on every mood_logs insert, then backfills it.
+
+    log_version is the id of the user's newest row (AUTOINCREMENT ids never repeat) and
+    logs_modified the epoch second it was inserted; they are the HTTP validators of the
+    history and daily quote endpoints.
+    """
+    db.execute('''
+        CREATE TRIGGER mood_logs_bump_log_version AFTER INSERT ON mood_logs
+        BEGIN
+            UPDATE users SET log_version = NEW.id, logs_modified = CAST(strftime('%s', 'now') AS INTEGER)
+            WHERE id = NEW.user_id;
+        END
+    ''')
+    db.execute('''
+        UPDATE users SET
+            log_version = COALESCE((SELECT MAX(id) FROM mood_logs WHERE user_id = users.id), 0),
+            logs_modified = (SELECT MAX(ts) FROM mood_logs WHERE user_id = users.id)
+    ''')
+
+def _migration_log_version(db):
+    db.execute("ALTER TABLE users ADD COLUMN log_version INTEGER NOT NULL DEFAULT 0")
+    db.execute("ALTER TABLE users ADD COLUMN logs_modified INTEGER") # Epoch seconds, UTC
+    _create_log_version_trigger(db)
+
+def _migration_local_day(db):
+    # Days are bucketed in each user's own time zone. The key is computed once, at insert
+    # time, so the rollup trigger and "today" lookups never convert time zones in SQL.
+    db.execute("ALTER TABLE users ADD COLUMN timezone TEXT") # IANA name; NULL = DEFAULT_TIMEZONE
+    db.execute("ALTER TABLE mood_logs ADD COLUMN local_day TEXT") # 'YYYY-MM-DD' in the user's zone at insert
+    # No user has chosen a zone yet, so existing rows get their day in DEFAULT_TIMEZONE
+    db.create_function("moodbot_local_day", 1, lambda ts: local_day(ts, get_tz(None)), deterministic=True)
+    db.execute("UPDATE mood_logs SET local_day = moodbot_local_day(ts)")
+    db.execute("CREATE INDEX idx_mood_logs_user_day ON mood_logs (user_id, local_day, ts, mood)")
+    db.execute("DROP TRIGGER mood_logs_update_daily_agg")
+    db.execute("DROP TABLE mood_daily_agg")
+    _create_mood_daily_agg(db, [("user_id", "INTEGER", "{row}user_id"), ("day", "TEXT", "{row}local_day")])
+
+def _migration_mood_trajectory(db):
+    db.execute("ALTER TABLE users ADD COLUMN mood_trajectory TEXT") # MoodTrajectory.to_json(); NULL = no logs
+    rebuild_mood_trajectories(db) # The one full replay; from here on each flush folds in its own rows
+
+def _migration_rate_limits(db):
+    db.execute('''
+        CREATE TABLE rate_limits (
+            key TEXT PRIMARY KEY, -- limit name and user or client address
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL, -- Epoch seconds of the last check
+            allowed INTEGER NOT NULL -- Outcome of the last check
+        ) WITHOUT ROWID
+    ''')
+
+def _migration_claimable_legacy_log(db):
+    # Migration 4 moved the single-user log to a 'Legacy log' user that no session could reach;
+    # mark it so the first session that needs a user takes it over (create_user).
+    db.execute("ALTER TABLE users ADD COLUMN claimable INTEGER NOT NULL DEFAULT 0")
+    db.execute("CREATE INDEX idx_users_claimable ON users (id) WHERE claimable = 1")
+    db.execute("UPDATE users SET claimable = 1 WHERE id = (SELECT MIN(id) FROM users) AND name = 'Legacy log'")
+
+MIGRATIONS = [
+    (1, "create mood_logs", _migration_create_mood_logs),
+    (2, "epoch ts column and covering (ts, mood, score) index", _migration_epoch_timestamps),
+    (3, "mood_daily_agg rollup table", _migration_mood_daily_agg),
+    (4, "users table, per-user mood_logs and rollup", _migration_users),
+    (5, "server-side sessions table", _migration_sessions),
+    (6, "shared sentiment cache table", _migration_sentiment_cache),
+    (7, "per-user log version for HTTP validators", _migration_log_version),
+    (8, "per-user time zone and local-day keys", _migration_local_day),
+    (9, "per-user mood trajectory", _migration_mood_trajectory),
+    (10, "shared rate limit buckets", _migration_rate_limits),
+    (11, "claimable pre-upgrade mood log user", _migration_claimable_legacy_log),
+]
+
+# Key of mood_daily_agg as of the latest migration (see _create_mood_daily_agg)
+MOOD_AGG_KEYS = [("user_id", "INTEGER", "{row}user_id"), ("day", "TEXT", "{row}local_day")]
+
+def rebuild_mood_daily_agg(db):
+    """Recomputes mood_daily_agg from mood_logs (backfill / repair). Caller commits."""
+    return _fill_mood_daily_agg(db, MOOD_AGG_KEYS)
+
+def get_schema_version(db):
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+def apply_migrations(db):
+    """Brings the schema up to the latest version. Returns the resulting version."""
+    version = get_schema_version(db)
+    for target, description, migrate in MIGRATIONS:
+        if target <= version:
+            continue
+        log.info("Applying schema migration %d: %s", target, description)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            if get_schema_version(db) < target: # Another worker may have migrated meanwhile
+                migrate(db)
+                db.execute(f"PRAGMA user_version = {target}")
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            raise
+        version = target
+    return version
+
+@app.cli.command('rebuild-mood-agg')
+def rebuild_mood_agg_command():
+    """Rebuilds the mood_daily_agg rollup from mood_logs."""
+    with db_pool.connection() as db:
+        apply_migrations(db)
+        with db:
+            days = rebuild_mood_daily_agg(db)
+    print(f"Rebuilt mood_daily_agg: {days} day(s).")
+
+# --- Users ---
+PROFILE_FIELDS = ('name', 'age', 'weight', 'picture_filename', 'timezone')
+
+def create_user(db):
+    """Returns a new user's id; the first call after upgrading a single-user database takes over its old log."""
+    row = db.execute("UPDATE users SET claimable = 0, name = 'User Name' WHERE id = "
+                     "(SELECT id FROM users WHERE claimable = 1 ORDER BY id LIMIT 1) RETURNING id").fetchone()
+    if row is not None:
+        db.commit()
+        log.info("Session took over the pre-upgrade mood log (user %s).", row[0])
+        return row[0]
+    cursor = db.execute("INSERT INTO users (created_at) VALUES (?)", (to_epoch(datetime.now(timezone.utc)),))
+    db.commit()
+    return cursor.lastrowid
+
+def get_current_user_id():
+    """Returns the users.id bound to this session, creating the user on first use (None if the DB is down)."""
+    user_id = session.get('user_id')
+    if user_id is not None:
+        return user_id
+    db = get_db()
+    if not db:
+        return None
+    try:
+        user_id = create_user(db)
     except sqlite3.Error as e:
-        print(f"Error connecting to database: {e}")
+        log.error("Could not create user: %s", e)
         return None
+    session['user_id'] = user_id
+    session.modified = True
+    return user_id
+
+def load_profile(db, user_id):
+    """Returns the profile dict for user_id, or None if the user doesn't exist."""
+    row = db.execute(f"SELECT {', '.join(PROFILE_FIELDS)} FROM users WHERE id = ?", (user_id,)).fetchone()
+    return dict(row) if row else None
+
+def load_current_profile(db):
+    """Returns (user_id, profile) for this session, replacing a session id whose user no longer exists."""
+    user_id = get_current_user_id()
+    profile = load_profile(db, user_id) if user_id is not None else None
+    if profile is None and user_id is not None:
+        session.pop('user_id', None) # e.g. the database was recreated
+        session.pop('timezone', None)
+        user_id = get_current_user_id()
+        profile = load_profile(db, user_id) if user_id is not None else None
+    return user_id, profile
+
+def load_user_timezone(db, user_id):
+    """users.timezone of user_id (None = DEFAULT_TIMEZONE)."""
+    row = db.execute("SELECT timezone FROM users WHERE id = ?", (user_id,)).fetchone()
+    return row['timezone'] if row else None
+
+def get_current_timezone():
+    """ZoneInfo of this session's user. The name is kept in the session ('' = default), so
+    only the first request of a session reads it from users."""
+    name = session.get('timezone')
+    if name is None:
+        user_id = get_current_user_id()
+        db = get_db()
+        try:
+            name = (load_user_timezone(db, user_id) if db and user_id is not None else None) or ''
+        except sqlite3.Error as e:
+            log.error("Could not load time zone: %s", e)
+            return get_tz(None)
+        session['timezone'] = name
+        session.modified = True
+    return get_tz(name)
+
+def save_profile(db, user_id, profile):
+    assignments = ", ".join(f"{field} = ?" for field in PROFILE_FIELDS)
+    db.execute(f"UPDATE users SET {assignments} WHERE id = ?", [profile.get(field) for field in PROFILE_FIELDS] + [user_id])
+    db.commit()
+
+# --- Server-Side Sessions ---
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its id and whether it was changed during the request."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+class SQLiteSessionInterface(SessionInterface):
+    """Stores session data as compact JSON in the sessions table; the cookie carries only a signed id.
+
+    An optional in-process LRU (lru_size > 0) caches the serialized data of recently
+    used sessions so a request doesn't need a SQLite read to open its session.
+    """
+
+    def __init__(self, pool, lru_size=SESSION_LRU_SIZE):
+        self.pool = pool
+        self.lru_size = lru_size
+        self._lru = OrderedDict() # sid -> (data_json, expires)
+        self._lru_lock = threading.Lock()
+        self._writes = 0
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='mood-bot-session-id')
+
+    def _lru_get(self, sid):
+        if not self.lru_size:
+            return None
+        with self._lru_lock:
+            entry = self._lru.get(sid)
+            if entry is not None:
+                self._lru.move_to_end(sid)
+            return entry
+
+    def _lru_put(self, sid, entry):
+        if not self.lru_size:
+            return
+        with self._lru_lock:
+            if entry is None:
+                self._lru.pop(sid, None)
+                return
+            self._lru[sid] = entry
+            self._lru.move_to_end(sid)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _load(self, sid, now):
+        entry = self._lru_get(sid)
+        if entry is None:
+            try:
+                with self.pool.connection() as db:
+                    row = db.execute("SELECT data, expires FROM sessions WHERE sid = ?", (sid,)).fetchone()
+            except sqlite3.Error as e:
+                log.error("Error loading session: %s", e)
+                return None
+            if row is None:
+                return None
+            entry = (row['data'], row['expires'])
+            self._lru_put(sid, entry)
+        data_json, expires = entry
+        if expires <= now:
+            return None
+        return json.loads(data_json)
+
+    def open_session(self, app, request):
+        now = int(time.time())
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie and not request.path.startswith(app.static_url_path + '/'): # Assets never use the session
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                with spans.span("session_load"):
+                    data = self._load(sid, now)
+                if data is not None:
+                    return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified: # Cleared during this request
+                self._delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        response.vary.add("Cookie")
+
+        if session.modified or session.new:
+            save_start = time.perf_counter()
+            expires = int(time.time() + app.permanent_session_lifetime.total_seconds())
+            data_json = json.dumps(dict(session), separators=(',', ':'))
+            try:
+                with self.pool.connection() as db:
+                    with db:
+                        db.execute(
+                            "INSERT INTO sessions (sid, data, expires) VALUES (?, ?, ?) "
+                            "ON CONFLICT(sid) DO UPDATE SET data = excluded.data, expires = excluded.expires",
+                            (session.sid, data_json, expires))
+                        self._writes += 1
+                        if self._writes % SESSION_PURGE_EVERY == 0:
+                            db.execute("DELETE FROM sessions WHERE expires <= ?", (int(time.time()),))
+                self._lru_put(session.sid, (data_json, expires))
+            except sqlite3.Error as e:
+                log.error("Error saving session: %s", e)
+                self._lru_put(session.sid, None)
+            spans.observe("session_save", save_start)
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name, self._signer(app).sign(session.sid.encode()).decode(),
+                expires=self.get_expiration_time(app, session), httponly=self.get_cookie_httponly(app),
+                domain=domain, path=path, secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app))
+
+    def _delete(self, sid):
+        self._lru_put(sid, None)
+        try:
+            with self.pool.connection() as db:
+                with db:
+                    db.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+        except sqlite3.Error as e:
+            log.error("Error deleting session: %s", e)
+
+if SESSION_BACKEND == 'sqlite':
+    app.session_interface = SQLiteSessionInterface(db_pool)
 
 def init_db():
-    db = get_db()
-    if db:
+    with app.app_context():
+        db = get_db()
+        if not db:
+            log.error("Failed to get DB connection for initialization.")
+            return
         try:
-            with app.app_context():
-                 db.execute('''
-                     CREATE TABLE IF NOT EXISTS mood_logs (
-                         id INTEGER PRIMARY KEY AUTOINCREMENT,
-                         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                         mood TEXT NOT NULL,
-                         score REAL NOT NULL
-                     );
-                 ''')
-                 db.commit()
-                 print("Database initialized and mood_logs table ensured.")
+            version = apply_migrations(db)
+            log.info("Database initialized at schema version %d.", version)
         except sqlite3.Error as e:
-            print(f"Error initializing database table: {e}")
-        finally:
-            db.close()
-    else:
-        print("Failed to get DB connection for initialization.")
+            log.error("Error initializing database schema: %s", e)
 
 # --- Helper Function for File Uploads ---
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# --- Profile Picture Pipeline ---
+# An upload is named after the sha256 of its bytes: PICTURE_KEY_RE names the upload
+# ({digest}.{ext}, stored in users.picture_filename) and each thumbnail is {digest}-{size}.{ext}.
+# Identical uploads map to the same files, which are written once and never change.
+PICTURE_KEY_RE = re.compile(r'^([0-9a-f]{20})\.(webp|jpg)$')
+PICTURE_FILE_RE = re.compile(r'^[0-9a-f]{20}-(?:\d+|raw)\.[a-z]+$')
+PICTURE_DECODABLE_FORMATS = {'PNG', 'JPEG', 'GIF'} # Same as ALLOWED_EXTENSIONS
+
+def picture_extension():
+    if Image is not None and PICTURE_FORMAT == 'webp' and pil_features.check('webp'):
+        return 'webp'
+    return 'jpg'
+
+def picture_urls(filename):
+    """{size: URL} of a users.picture_filename; legacy and unprocessed uploads serve one file at every size."""
+    if not filename:
+        return None
+    match = PICTURE_KEY_RE.match(filename)
+    names = {size: f"{match[1]}-{size}.{match[2]}" if match else filename for size in PICTURE_SIZES}
+    return {size: url_for('uploaded_file', filename=name) for size, name in names.items()}
+
+def probe_picture(data):
+    """Reads only the image header; raises ValueError unless it is a supported, reasonably sized image."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            image_format, (width, height) = img.format, img.size
+    except (OSError, Image.DecompressionBombError):
+        raise ValueError("Not a readable image") from None
+    if image_format not in PICTURE_DECODABLE_FORMATS:
+        raise ValueError(f"Unsupported image format {image_format}")
+    if width * height > PICTURE_MAX_PIXELS:
+        raise ValueError("Image is too large")
+
+def render_picture(data, digest, ext, folder):
+    """Decodes an upload and writes its PICTURE_SIZES square thumbnails (center crop) to folder."""
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft('RGB', (max(PICTURE_SIZES) * 2,) * 2) # JPEG: decode at a reduced scale, far cheaper
+        img = ImageOps.exif_transpose(img) # Phone photos are often stored rotated
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+        img = img.convert('RGBA' if has_alpha and ext == 'webp' else 'RGB')
+    side = min(img.size)
+    left, top = (img.width - side) // 2, (img.height - side) // 2
+    square = img.crop((left, top, left + side, top + side))
+    for size in sorted(PICTURE_SIZES, reverse=True):
+        thumbnail = square.resize((size, size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        path = os.path.join(folder, f"{digest}-{size}.{ext}")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if ext == 'webp':
+            thumbnail.save(tmp_path, 'WEBP', quality=PICTURE_QUALITY, method=4)
+        else:
+            thumbnail.save(tmp_path, 'JPEG', quality=PICTURE_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp_path, path) # Readers see a complete file or none
+
+class PicturePipeline:
+    """Resizes and encodes uploads on a small thread pool, so the upload request returns
+    without doing the image work (Pillow releases the GIL while decoding, resizing and
+    encoding).
+
+    Jobs are keyed by digest: a second upload of the same bytes while one is pending joins
+    it, and one whose thumbnails already exist does nothing. wait() lets a request for a
+    thumbnail of a pending job in this process block until it is written, like readers
+    flushing the mood logger. Other processes only see the files once they exist.
+    """
+
+    def __init__(self, folder, workers=PICTURE_WORKERS):
+        self.folder = folder
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = os.getpid()
+        self._pending = {} # digest -> Future
+        self.submitted = 0
+        self.deduplicated = 0 # Uploads whose thumbnails already existed or were pending
+        self.rendered = 0
+        self.errors = 0
+        self.total_render_ms = 0.0
+
+    def _get_executor(self):
+        if self._pid != os.getpid(): # Forked: the parent's threads don't exist here
+            self._executor = None
+            self._pending = {}
+            self._pid = os.getpid()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="picture")
+        return self._executor
+
+    def exists(self, digest, ext):
+        return all(os.path.exists(os.path.join(self.folder, f"{digest}-{size}.{ext}")) for size in PICTURE_SIZES)
+
+    def submit(self, data, digest, ext):
+        with self._lock:
+            if digest in self._pending or self.exists(digest, ext):
+                self.deduplicated += 1
+                return
+            self.submitted += 1
+            future = self._get_executor().submit(self._render, data, digest, ext)
+            self._pending[digest] = future
+        future.add_done_callback(lambda _future: self._finish(digest))
+
+    def _render(self, data, digest, ext):
+        start = time.perf_counter()
+        try:
+            render_picture(data, digest, ext, self.folder)
+        except Exception as e: # A job must not take the pool down; the upload was already validated
+            log.exception("Could not render picture %s: %s", digest, e)
+            with self._lock: self.errors += 1
+            return
+        spans.observe("picture_render", start)
+        with self._lock:
+            self.rendered += 1
+            self.total_render_ms += (time.perf_counter() - start) * 1000
+
+    def _finish(self, digest):
+        with self._lock:
+            self._pending.pop(digest, None)
+
+    def wait(self, digest, timeout=PICTURE_WAIT_TIMEOUT):
+        """Blocks until the pending job for digest (if any, in this process) is done."""
+        with self._lock:
+            future = self._pending.get(digest) if self._pid == os.getpid() else None
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except FutureTimeoutError:
+                pass
+
+    def shutdown(self):
+        """Waits for pending jobs, so no upload is left without thumbnails."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "available": Image is not None,
+                "format": picture_extension(),
+                "workers": self.workers,
+                "pending": len(self._pending),
+                "submitted": self.submitted,
+                "deduplicated": self.deduplicated,
+                "rendered": self.rendered,
+                "errors": self.errors,
+                "avg_render_ms": round(self.total_render_ms / self.rendered, 2) if self.rendered else 0.0,
+            }
+
+picture_pipeline = PicturePipeline(UPLOAD_FOLDER)
+
+# --- Compiled Lexicon ---
+def lexicon_digest(lexicon):
+    """16-byte digest of a word -> valence mapping (part of the scoring fingerprint)."""
+    return hashlib.sha256("".join(f"{word}\t{lexicon[word]!r}\n" for word in sorted(lexicon)).encode()).digest()[:16]
+
+class MappedLexicon:
+    """Read-only word -> valence mapping over a compiled lexicon file (flask build-lexicon).
+
+    The file is memory-mapped and read in place, so every worker shares one copy through
+    the page cache instead of holding its own dict (and, in NLTK's analyzer, the raw lexicon
+    text). Layout, little-endian:
+
+        header    magic, version, entry count, slot count, lexicon digest
+        float64   valence per entry
+        uint32    open-addressing slots, crc32(word) & (slots - 1) -> entry index + 1 (0 = empty)
+        uint32    entry count + 1 offsets into the string table
+        bytes     string table: the UTF-8 words, sorted
+
+    Supports what VADER uses (`in`, [] and get()). A small memo keeps frequent words at
+    dict speed.
+    """
+
+    MAGIC = b'MBLX'
+    VERSION = 2 # 1 also held a keyword mood bitmask
+    HEADER = struct.Struct('<4sHHII16s')
+    HEADER_SIZE = 32 # Padded so the float64 array is 8-byte aligned
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, _, count, slots, self.digest = self.HEADER.unpack_from(self._mmap)
+            if magic != self.MAGIC or version != self.VERSION:
+                raise ValueError(f"{path} is not a version {self.VERSION} compiled lexicon")
+            view = memoryview(self._mmap)
+            start = self.HEADER_SIZE
+            self._valences = view[start:start + 8 * count].cast('d'); start += 8 * count
+            self._slots = view[start:start + 4 * slots].cast('I'); start += 4 * slots
+            self._offsets = view[start:start + 4 * (count + 1)].cast('I'); start += 4 * (count + 1)
+            self._strings = view[start:]
+            if len(self._strings) != self._offsets[count]:
+                raise ValueError(f"{path} is truncated")
+        except (struct.error, TypeError, ValueError, IndexError) as e:
+            self._mmap.close()
+            raise ValueError(f"Invalid compiled lexicon {path}: {e}") from None
+        self._count = count
+        self._mask = slots - 1
+        self._memo = {} # word -> valence, or None for words not in the lexicon
+
+    @classmethod
+    def compile(cls, lexicon, path):
+        """Writes lexicon (word -> valence) to path."""
+        words = sorted(lexicon)
+        encoded = [word.encode() for word in words]
+        slots = 1
+        while slots < 2 * len(words): # Load factor <= 0.5 keeps probe chains short
+            slots *= 2
+        table = [0] * slots
+        for i, word in enumerate(encoded):
+            h = zlib.crc32(word) & (slots - 1)
+            while table[h]:
+                h = (h + 1) & (slots - 1)
+            table[h] = i + 1
+        offsets = list(itertools.accumulate((len(word) for word in encoded), initial=0))
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, 0, len(words), slots, lexicon_digest(lexicon))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header.ljust(cls.HEADER_SIZE, b'\0'))
+            f.write(struct.pack(f'<{len(words)}d', *(lexicon[word] for word in words)))
+            f.write(struct.pack(f'<{slots}I', *table))
+            f.write(struct.pack(f'<{len(offsets)}I', *offsets))
+            f.write(b''.join(encoded))
+        os.replace(tmp_path, path) # Workers mapping the old file keep reading it until they reload
+        return len(words)
+
+    def _find(self, word):
+        encoded = word.encode()
+        h = zlib.crc32(encoded) & self._mask
+        while True:
+            entry = self._slots[h]
+            if not entry:
+                return -1
+            i = entry - 1
+            if self._strings[self._offsets[i]:self._offsets[i + 1]] == encoded:
+                return i
+            h = (h + 1) & self._mask
+
+    def _valence(self, word):
+        try:
+            return self._memo[word]
+        except KeyError:
+            pass
+        i = self._find(word)
+        valence = self._valences[i] if i >= 0 else None
+        if len(self._memo) >= LEXICON_MEMO_SIZE:
+            self._memo.clear()
+        self._memo[word] = valence
+        return valence
+
+    def __contains__(self, word):
+        return self._valence(word) is not None
+
+    def __getitem__(self, word):
+        valence = self._valence(word)
+        if valence is None:
+            raise KeyError(word)
+        return valence
+
+    def get(self, word, default=None):
+        valence = self._valence(word)
+        return default if valence is None else valence
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        for view in (self._valences, self._slots, self._offsets, self._strings):
+            view.release()
+        self._mmap.close()
+
+def load_vader_lexicon():
+    """Parses NLTK's vader_lexicon.txt into a word -> valence dict (raises LookupError if it isn't installed)."""
+    import nltk.data
+    lexicon = {}
+    for line in nltk.data.load("sentiment/vader_lexicon.zip/vader_lexicon/vader_lexicon.txt").split("\n"):
+        word, measure = line.strip().split("\t")[0:2]
+        lexicon[word] = float(measure)
+    return lexicon
+
+def open_compiled_lexicon():
+    """MappedLexicon at LEXICON_PATH, or None if it is missing or invalid."""
+    try:
+        lexicon = MappedLexicon(LEXICON_PATH)
+    except FileNotFoundError:
+        log.info("No compiled lexicon at %s (flask build-lexicon); parsing the NLTK lexicon.", LEXICON_PATH)
+        return None
+    except (OSError, ValueError) as e:
+        log.error("%s; parsing the NLTK lexicon.", e)
+        return None
+    return lexicon
+
+def build_analyzer():
+    """A VADER SentimentIntensityAnalyzer reading the compiled lexicon, or NLTK's own (LEXICON_BACKEND)."""
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer, VaderConstants
+
+    class MappedSentimentIntensityAnalyzer(SentimentIntensityAnalyzer):
+        def __init__(self, lexicon): # Skips loading and parsing vader_lexicon.txt
+            self.lexicon_file = None
+            self.lexicon = lexicon
+            self.constants = VaderConstants()
+
+    lexicon = open_compiled_lexicon() if LEXICON_BACKEND == 'auto' else None
+    if lexicon is not None:
+        return MappedSentimentIntensityAnalyzer(lexicon)
+    return SentimentIntensityAnalyzer()
+
+@app.cli.command('build-lexicon')
+@click.option('--output', default=None, help='Where to write the compiled lexicon (default: LEXICON_PATH).')
+def build_lexicon_command(output):
+    """Compiles NLTK's VADER lexicon into a memory-mappable file."""
+    start = time.perf_counter()
+    try:
+        lexicon = load_vader_lexicon()
+    except LookupError:
+        raise click.ClickException("NLTK 'vader_lexicon' not found: import nltk; nltk.download('vader_lexicon')")
+    path = output or LEXICON_PATH
+    entries = MappedLexicon.compile(lexicon, path)
+    print(f"Wrote {path}: {entries} entries, "
+          f"{os.path.getsize(path)} bytes in {time.perf_counter() - start:.2f}s.")
+
 # --- NLTK Setup ---
+# Importing nltk and loading the VADER lexicon take seconds, so they happen off the startup
+# path: start_nltk_warmup() loads them in a background thread (or preload_nltk() loads them
+# in a pre-fork master). Until `analyzer` is set, scoring uses fallback_polarity_scores().
 analyzer = None
 punkt_available = False
-# ...(Existing setup_nltk_data function - unchanged)...
+word_tokenize = None # nltk.word_tokenize once punkt is known to work
+nltk_status = "pending" # pending -> loading -> ready | failed
+_nltk_lock = threading.Lock()
+_nltk_thread = None
+
 def setup_nltk_data():
-    """Initializes necessary NLTK resources. Run once at startup."""
-    global analyzer, punkt_available
-    print("Setting up NLTK data...")
+    """Initializes necessary NLTK resources. Safe to call from a background thread."""
+    global analyzer, punkt_available, word_tokenize
+    log.info("Setting up NLTK data...")
     try:
+        import nltk
         try:
-            analyzer = SentimentIntensityAnalyzer() #
-            print("NLTK 'vader_lexicon' loaded successfully.") #
+            loaded_analyzer = build_analyzer() #
+            log.info("VADER lexicon loaded (%s).", type(loaded_analyzer.lexicon).__name__) #
         except LookupError:
-            print("\n--- NLTK SETUP ERROR ---") #
-            print("Error: NLTK 'vader_lexicon' not found.") #
-            print("Please download it by running: import nltk; nltk.download('vader_lexicon')") #
-            print("---------------------------\n") #
+            log.error("NLTK 'vader_lexicon' not found. Please download it by running: "
+                      "import nltk; nltk.download('vader_lexicon')") #
             return False
+        loaded_tokenize = None
         try:
             nltk.word_tokenize("Test sentence for punkt.") #
-            print("NLTK 'punkt' tokenizer available.") #
-            punkt_available = True #
+            log.info("NLTK 'punkt' tokenizer available.") #
+            loaded_tokenize = nltk.word_tokenize #
         except LookupError:
-            print("\n--- NLTK SETUP WARNING ---") #
-            print("Warning: NLTK 'punkt' tokenizer not found. Falling back to basic split.") #
-            print("Download with: import nltk; nltk.download('punkt')") #
-            print("---------------------------\n") #
-            punkt_available = False #
+            log.warning("NLTK 'punkt' tokenizer not found. Falling back to basic split. "
+                        "Download with: import nltk; nltk.download('punkt')") #
         except Exception as e:
-            print(f"\n--- NLTK SETUP WARNING ---") #
-            print(f"Warning: Error testing 'punkt': {e}. Falling back to basic split.") #
-            print("---------------------------\n") #
-            punkt_available = False #
-        print("NLTK setup complete.") #
+            log.warning("Error testing 'punkt': %s. Falling back to basic split.", e) #
+        # Publish the tokenizer before the analyzer: request threads treat `analyzer` as the
+        # ready flag and must not see VADER scores paired with the fallback tokenizer.
+        word_tokenize = loaded_tokenize
+        punkt_available = loaded_tokenize is not None
+        analyzer = loaded_analyzer
+        reload_scoring_tables() # Lexicon (re)loaded: cached results may be stale
+        log.info("NLTK setup complete.") #
         return True
     except Exception as e:
-        print(f"\n--- UNEXPECTED NLTK SETUP FAILED ---") #
-        print(f"An unexpected error occurred: {e}") #
-        print("------------------------------------\n") #
+        log.exception("Unexpected NLTK setup failure: %s", e) #
         return False
 
+def _run_nltk_setup():
+    global nltk_status
+    nltk_status = "ready" if setup_nltk_data() else "failed"
+
+def start_nltk_warmup():
+    """Starts loading NLTK in a daemon thread. Idempotent; returns immediately."""
+    global nltk_status, _nltk_thread
+    with _nltk_lock:
+        if nltk_status != "pending": return
+        nltk_status = "loading"
+        _nltk_thread = threading.Thread(target=_run_nltk_setup, name="nltk-warmup", daemon=True)
+        _nltk_thread.start()
+
+def wait_for_nltk(timeout=None):
+    """Blocks until warmup has finished. Returns True if the analyzer is ready."""
+    start_nltk_warmup()
+    thread = _nltk_thread
+    if thread is not None: thread.join(timeout)
+    return nltk_status == "ready"
+
+def _reset_nltk_warmup_in_child():
+    # A warmup thread running in the parent does not exist in a forked child: start over.
+    global nltk_status, _nltk_lock
+    _nltk_lock = threading.Lock()
+    if nltk_status == "loading": nltk_status = "pending"
+
+os.register_at_fork(after_in_child=_reset_nltk_warmup_in_child)
+
+def preload_nltk():
+    """Loads NLTK synchronously in a pre-fork master so forked workers share the lexicon.
+
+    gc.freeze() moves everything allocated so far into the permanent generation; the
+    collector in each worker then never touches those objects, so the refcount writes it
+    would make do not copy the lexicon's pages into every worker.
+    """
+    ready = wait_for_nltk()
+    gc.freeze()
+    return ready
+
 # --- Mood Categories, Constants, Questions, Keywords ---
-# ...(Existing constants, question_banks, keywords - unchanged)...
 HAPPY = "Happy" #
 SAD = "Sad" #
 ANGRY = "Angry" #
@@ -170,6 +1527,295 @@ ANGRY_KEYWORDS = {"angry", "mad", "furious", "pissed", "irritated", "annoyed", "
 STRESSED_KEYWORDS = {"stressed", "overwhelmed", "anxious", "worried", "pressure", "deadline", "busy", "frantic", "tension", "difficult", "hard", "struggle", "tired", "exhausted", "demanding", "hectic", "swamped", "buried", "tight", "nervous", "panicked"} #
 CALM_KEYWORDS = {"calm", "peaceful", "relaxed", "chill", "easy", "smooth", "quiet", "tranquil", "restful", "breeze", "steady", "balanced", "mellow", "content", "okay", "fine", "alright", "neutral", "manageable", "serene", "composed"} #
 KEYWORD_MAX_INFLUENCE = 0.2 #
+POSITIVE_THRESHOLD = 0.35; NEGATIVE_THRESHOLD = -0.35 #
+STRONG_NEG_VADER = 0.20; STRONG_POS_VADER = 0.20 #
+STRONG_OVERRIDE_THRESHOLD = 0.6
+
+# Keyword moods in the same order get_mood_and_score builds keyword_counts,
+# so argmax ties resolve to the same dominant mood.
+KEYWORD_MOODS = (HAPPY, SAD, ANGRY, STRESSED, CALM)
+
+def get_keyword_sets():
+    """The *_KEYWORDS sets in KEYWORD_MOODS order (looked up on each call, so reassignments count)."""
+    return (HAPPY_KEYWORDS, SAD_KEYWORDS, ANGRY_KEYWORDS, STRESSED_KEYWORDS, CALM_KEYWORDS)
+
+def build_keyword_mood_index():
+    """Combines the *_KEYWORDS sets into one word -> tuple of KEYWORD_MOODS indexes map."""
+    index = {}
+    for mood_idx, keywords in enumerate(get_keyword_sets()):
+        for word in keywords:
+            index.setdefault(word, []).append(mood_idx) # A word may count for several moods ("difficult")
+    return {word: tuple(mood_idxs) for word, mood_idxs in index.items()}
+
+KEYWORD_MOOD_INDEX = build_keyword_mood_index()
+
+def compute_scoring_fingerprint():
+    """Hash of everything get_mood_and_score depends on besides the text itself."""
+    h = hashlib.sha256()
+    for keywords in get_keyword_sets():
+        h.update(("|".join(sorted(keywords)) + "\n").encode())
+    h.update(repr((KEYWORD_MAX_INFLUENCE, POSITIVE_THRESHOLD, NEGATIVE_THRESHOLD, STRONG_NEG_VADER,
+                   STRONG_POS_VADER, STRONG_OVERRIDE_THRESHOLD, KEYWORD_TOKENIZER, punkt_available)).encode())
+    if analyzer is not None: # Same digest for both lexicon backends, so they share cache entries
+        h.update(getattr(analyzer.lexicon, 'digest', None) or lexicon_digest(analyzer.lexicon))
+    return h.hexdigest()[:16]
+
+def reload_scoring_tables():
+    """Call after changing the *_KEYWORDS sets, scoring constants or the lexicon."""
+    global KEYWORD_MOOD_INDEX
+    KEYWORD_MOOD_INDEX = build_keyword_mood_index()
+    sentiment_cache.invalidate(compute_scoring_fingerprint())
+
+# --- Mood Trajectory ---
+NEGATIVE_MOODS = (SAD, ANGRY, STRESSED)
+KEYWORD_MOOD_POSITIONS = {mood: i for i, mood in enumerate(KEYWORD_MOODS)}
+
+class MoodTrajectory:
+    """Rolling statistics of a sequence of (mood, score) observations, each update O(1).
+
+    Keeps a fast EWMA of the score (level), a slow one (baseline), the exponentially
+    weighted variance around the level, the current mood streak and counts of
+    mood -> next mood transitions. to_state() is a flat list of numbers, small enough for
+    the session (one per conversation) and users.mood_trajectory (one per user), so neither
+    updating nor reporting a trend re-reads mood_logs.
+    """
+
+    __slots__ = ('count', 'level', 'baseline', 'variance', 'last_mood', 'streak', 'transitions')
+    STATE_VERSION = 1
+
+    def __init__(self):
+        self.count = 0
+        self.level = self.baseline = self.variance = 0.0
+        self.last_mood = None
+        self.streak = 0
+        self.transitions = [0] * len(KEYWORD_MOODS) ** 2 # [from * len(KEYWORD_MOODS) + to]
+
+    def update(self, mood, score):
+        if self.count == 0:
+            self.level = self.baseline = score
+        else:
+            diff = score - self.level
+            increment = TRAJECTORY_FAST_ALPHA * diff
+            self.level += increment
+            self.variance = (1 - TRAJECTORY_FAST_ALPHA) * (self.variance + diff * increment)
+            self.baseline += TRAJECTORY_SLOW_ALPHA * (score - self.baseline)
+        self.count += 1
+        previous, current = KEYWORD_MOOD_POSITIONS.get(self.last_mood), KEYWORD_MOOD_POSITIONS.get(mood)
+        if previous is not None and current is not None:
+            self.transitions[previous * len(KEYWORD_MOODS) + current] += 1
+        self.streak = self.streak + 1 if mood == self.last_mood else 1
+        self.last_mood = mood
+
+    def direction(self):
+        delta = self.level - self.baseline
+        if delta > TRAJECTORY_TREND_BAND: return "improving"
+        if delta < -TRAJECTORY_TREND_BAND: return "declining"
+        return "steady"
+
+    def likely_next(self):
+        """Mood that has most often followed the current one (None without any history)."""
+        position = KEYWORD_MOOD_POSITIONS.get(self.last_mood)
+        if position is None:
+            return None
+        row = self.transitions[position * len(KEYWORD_MOODS):(position + 1) * len(KEYWORD_MOODS)]
+        best = max(range(len(row)), key=row.__getitem__)
+        return KEYWORD_MOODS[best] if row[best] else None
+
+    def trend(self):
+        """JSON summary for API responses (None before the first observation)."""
+        if not self.count:
+            return None
+        return {
+            "count": self.count,
+            "level": round(self.level, 4),
+            "baseline": round(self.baseline, 4),
+            "volatility": round(math.sqrt(self.variance), 4),
+            "direction": self.direction(),
+            "streak": {"mood": self.last_mood, "length": self.streak},
+            "likely_next": self.likely_next(),
+        }
+
+    def to_state(self):
+        return [self.STATE_VERSION, self.count, round(self.level, 6), round(self.baseline, 6), round(self.variance, 6),
+                KEYWORD_MOOD_POSITIONS.get(self.last_mood, -1), self.streak, *self.transitions]
+
+    @classmethod
+    def from_state(cls, state):
+        """Inverse of to_state(); None or a state from another version starts a new trajectory."""
+        trajectory = cls()
+        if not isinstance(state, list) or len(state) != 7 + len(trajectory.transitions) or state[0] != cls.STATE_VERSION:
+            return trajectory
+        _, trajectory.count, trajectory.level, trajectory.baseline, trajectory.variance, position, trajectory.streak = state[:7]
+        trajectory.last_mood = KEYWORD_MOODS[position] if 0 <= position < len(KEYWORD_MOODS) else None
+        trajectory.transitions = list(state[7:])
+        return trajectory
+
+    @classmethod
+    def from_json(cls, text):
+        try:
+            return cls.from_state(json.loads(text) if text else None)
+        except ValueError:
+            return cls()
+
+    def to_json(self):
+        return json.dumps(self.to_state(), separators=(',', ':'))
+
+def choose_mood_context(trajectory, detected_mood):
+    """Mood whose questions come next, given the conversation's trajectory before this message.
+
+    A happy message straight after a negative mood, or while the conversation's level is
+    still below zero, reads as recovery and gets calm questions rather than celebratory ones.
+    """
+    if detected_mood == HAPPY and trajectory.count and (trajectory.last_mood in NEGATIVE_MOODS or trajectory.level < 0):
+        return CALM
+    return detected_mood
+
+def update_user_trajectories(db, rows):
+    """Folds (user_id, ts, local_day, mood, score) rows, in order, into users.mood_trajectory.
+
+    Run inside the transaction that inserts the rows, so concurrent writers can't lose updates.
+    """
+    by_user = {}
+    for user_id, _, _, mood, score in rows:
+        by_user.setdefault(user_id, []).append((mood, score))
+    placeholders = ", ".join("?" * len(by_user))
+    stored = dict(db.execute(f"SELECT id, mood_trajectory FROM users WHERE id IN ({placeholders})", list(by_user)).fetchall())
+    updates = []
+    for user_id, observations in by_user.items():
+        trajectory = MoodTrajectory.from_json(stored.get(user_id))
+        for mood, score in observations:
+            trajectory.update(mood, score)
+        updates.append((trajectory.to_json(), user_id))
+    db.executemany("UPDATE users SET mood_trajectory = ? WHERE id = ?", updates)
+
+def rebuild_mood_trajectories(db, user_ids=None):
+    """Recomputes users.mood_trajectory by replaying mood_logs in time order (migration, imports). Caller commits."""
+    if user_ids is None:
+        user_ids = [row[0] for row in db.execute("SELECT id FROM users")]
+    for user_id in user_ids:
+        trajectory = MoodTrajectory()
+        for mood, score in db.execute("SELECT mood, score FROM mood_logs WHERE user_id = ? ORDER BY ts, id", (user_id,)):
+            trajectory.update(mood, score)
+        db.execute("UPDATE users SET mood_trajectory = ? WHERE id = ?", (trajectory.to_json() if trajectory.count else None, user_id))
+    return len(user_ids)
+
+def load_user_trajectory(db, user_id):
+    row = db.execute("SELECT mood_trajectory FROM users WHERE id = ?", (user_id,)).fetchone()
+    return MoodTrajectory.from_json(row['mood_trajectory'] if row else None)
+
+# --- Sentiment Result Cache ---
+class SentimentCache:
+    """LRU memo of (mood, score) results keyed on whitespace-normalized text.
+
+    Only whitespace is normalized: VADER reacts to case ("GOOD") and punctuation ("!"),
+    so both stay part of the key. With shared=True a second tier in the sentiment_cache
+    table (keyed by a hash of the text) is shared by all workers. Every entry is tagged
+    with the scoring fingerprint; invalidate() clears the memory tier and makes shared
+    entries from another fingerprint misses.
+    """
+
+    def __init__(self, pool, max_size=SENTIMENT_CACHE_SIZE, shared=SENTIMENT_CACHE_SHARED):
+        self.pool = pool
+        self.max_size = max_size
+        self.shared = shared
+        self.fingerprint = None
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._shared_puts = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(text):
+        """Cache key for text, or None if the text shouldn't be cached."""
+        if len(text) > SENTIMENT_CACHE_MAX_TEXT_LEN:
+            return None
+        return " ".join(text.split())
+
+    @staticmethod
+    def _shared_key(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        if key is None or not self.max_size:
+            return None
+        with self._lock:
+            result = self._lru.get(key)
+            if result is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return result
+        if self.shared:
+            try:
+                with self.pool.connection() as db:
+                    row = db.execute("SELECT mood, score FROM sentiment_cache WHERE key = ? AND fingerprint = ?",
+                                     (self._shared_key(key), self.fingerprint)).fetchone()
+            except sqlite3.Error as e:
+                log.warning("Shared sentiment cache read failed: %s", e)
+                row = None
+            if row is not None:
+                result = (row['mood'], row['score'])
+                self._put_local(key, result)
+                with self._lock:
+                    self.shared_hits += 1
+                return result
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _put_local(self, key, result):
+        with self._lock:
+            self._lru[key] = result
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+                self.evictions += 1
+
+    def put(self, key, result):
+        if key is None or not self.max_size:
+            return
+        self._put_local(key, result)
+        if self.shared:
+            try:
+                with self.pool.connection() as db:
+                    with db:
+                        db.execute("INSERT OR REPLACE INTO sentiment_cache (key, fingerprint, mood, score) VALUES (?, ?, ?, ?)",
+                                   (self._shared_key(key), self.fingerprint, result[0], result[1]))
+                        self._shared_puts += 1
+                        if self._shared_puts % 1000 == 0: # Drop stale entries and keep the newest max rows
+                            db.execute("DELETE FROM sentiment_cache WHERE fingerprint != ? OR rowid NOT IN "
+                                       "(SELECT rowid FROM sentiment_cache ORDER BY rowid DESC LIMIT ?)",
+                                       (self.fingerprint, SENTIMENT_CACHE_SHARED_MAX_ROWS))
+            except sqlite3.Error as e:
+                log.warning("Shared sentiment cache write failed: %s", e)
+
+    def invalidate(self, fingerprint):
+        with self._lock:
+            self._lru.clear()
+            self.fingerprint = fingerprint
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._lru),
+                "max_size": self.max_size,
+                "shared": self.shared,
+                "fingerprint": self.fingerprint,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+sentiment_cache = SentimentCache(db_pool)
+sentiment_cache.invalidate(compute_scoring_fingerprint())
 
 
 # --- Quotes ---
@@ -215,25 +1861,28 @@ QUOTES = {
 }
 
 # --- Mood Analysis, Time of Day, Get Next Question Functions ---
-# ...(Existing get_mood_and_score, get_time_of_day_ist, get_next_question functions - unchanged)...
 def get_mood_and_score(text): #
     """Analyzes text using VADER and keywords to determine mood and score.""" #
-    global punkt_available, analyzer #
-    if analyzer is None: #
-        print("ERROR: Sentiment analyzer not initialized!") #
-        return CALM, 0.0 # Fallback
-    vs = analyzer.polarity_scores(text) #
+    if analyzer is None: # Still warming up: score with keywords only and don't cache it
+        start_nltk_warmup()
+        tokens = tokenize_for_keywords(text.lower())
+        return _apply_mood_rules(fallback_polarity_scores(tokens), tokens)
+    cache_key = SentimentCache.key(text)
+    cached = sentiment_cache.get(cache_key)
+    if cached is not None: return cached
+    pooled = scoring_pool.score([text])
+    if pooled is not None: result = pooled[0]
+    else:
+        with spans.span("tokenize"): tokens = tokenize_for_keywords(text.lower())
+        result = _apply_mood_rules(analyzer.polarity_scores(text), tokens)
+    sentiment_cache.put(cache_key, result)
+    return result
+
+def _apply_mood_rules(vs, tokens):
     compound_score = vs['compound'] #
     neg_score = vs['neg'] #
     pos_score = vs['pos'] #
 
-    tokens = [] #
-    text_lower = text.lower() #
-    if punkt_available: #
-        try: tokens = nltk.word_tokenize(text_lower) #
-        except Exception as e: tokens = text_lower.split() #
-    else: tokens = text_lower.split() #
-
     happy_count = sum(1 for w in tokens if w in HAPPY_KEYWORDS) #
     sad_count = sum(1 for w in tokens if w in SAD_KEYWORDS) #
     angry_count = sum(1 for w in tokens if w in ANGRY_KEYWORDS) #
@@ -250,8 +1899,6 @@ def get_mood_and_score(text): #
     combined_score = max(-1.0, min(1.0, compound_score + keyword_influence)) #
 
     mood = CALM #
-    POSITIVE_THRESHOLD = 0.35; NEGATIVE_THRESHOLD = -0.35 #
-    STRONG_NEG_VADER = 0.20; STRONG_POS_VADER = 0.20 #
     keyword_counts = {HAPPY: happy_count, SAD: sad_count, ANGRY: angry_count, STRESSED: stressed_count, CALM: calm_count} #
     dominant_keyword_mood = max(keyword_counts, key=keyword_counts.get) if total_keywords > 0 else None #
     dominant_keyword_count = keyword_counts.get(dominant_keyword_mood, 0) #
@@ -276,90 +1923,714 @@ def get_mood_and_score(text): #
                 else: mood = CALM #
             else: mood = CALM #
         else: mood = CALM #
-    if combined_score > 0.6 and mood != HAPPY: mood = HAPPY #
-    if combined_score < -0.6 and mood not in [SAD, ANGRY, STRESSED]: mood = SAD #
+    if combined_score > STRONG_OVERRIDE_THRESHOLD and mood != HAPPY: mood = HAPPY #
+    if combined_score < -STRONG_OVERRIDE_THRESHOLD and mood not in [SAD, ANGRY, STRESSED]: mood = SAD #
 
     return mood, combined_score #
 
-def get_time_of_day_ist(): #
-    """Determines the current time of day category ('morning', 'midday', 'evening') in IST.""" #
-    try:
-        ist = pytz.timezone('Asia/Kolkata') #
-        hour = datetime.now(ist).hour #
-        if 5 <= hour < 12: return "morning" #
-        elif 12 <= hour < 17: return "midday" #
-        else: return "evening" #
-    except Exception as e:
-        print(f"Warning: Could not get IST time ({e}). Falling back to system local time.") #
-        hour = datetime.now().hour #
-        if 5 <= hour < 12: return "morning" #
-        elif 12 <= hour < 17: return "midday" #
-        else: return "evening" #
+def fallback_polarity_scores(tokens):
+    """Keyword-only stand-in for analyzer.polarity_scores() while NLTK is still loading.
+
+    HAPPY/CALM keywords count as positive words and SAD/ANGRY/STRESSED ones as negative;
+    the compound score uses VADER's normalization (alpha = 15) of the net count.
+    """
+    positive = negative = 0
+    for token in tokens:
+        for mood_idx in KEYWORD_MOOD_INDEX.get(token, ()):
+            if KEYWORD_MOODS[mood_idx] in (HAPPY, CALM): positive += 1
+            else: negative += 1
+    if not tokens: return {'neg': 0.0, 'neu': 0.0, 'pos': 0.0, 'compound': 0.0}
+    net = positive - negative
+    pos = positive / len(tokens); neg = negative / len(tokens)
+    return {'neg': neg, 'neu': max(0.0, 1.0 - pos - neg), 'pos': pos, 'compound': net / (net * net + 15) ** 0.5}
+
+# Single-pass stand-in for nltk.word_tokenize, used only to count *_KEYWORDS hits. The
+# capture group is the word a Treebank tokenizer would emit: separators are whitespace, the
+# punctuation Treebank splits off, "..", "--" and "''"; leading quotes, trailing contraction
+# suffixes ('s 'm 'd 'll 're 've n't ') and a sentence-final period are dropped. Keyword counts
+# match word_tokenize on ordinary text; benchmarks/bench_tokenizer.py checks parity and lists
+# the known divergences (runs of mixed punctuation such as "::" or ",:", quotes after symbols).
+_KEYWORD_SEP = r"\s,;:@#$%&?!()\[\]{}<>\"`*‘’“”«»–—"
+KEYWORD_TOKEN_RE = re.compile(
+    rf"(?:^|(?<=[{_KEYWORD_SEP}])|(?<=\.\.)(?!\.)|(?<=--)|(?<=''))'*"
+    rf"((?:(?!\.\.|--|'')[^{_KEYWORD_SEP}])+?)"
+    rf"(?:'(?:s|m|d|ll|re|ve|')?|n't)?(?:\.(?=[\]\)}}>\"'’”]*(?:\s|$)))?"
+    rf"(?=[{_KEYWORD_SEP}]|\.\.|--|''|$)")
+
+def tokenize_for_keywords(text_lower):
+    """Tokenizes lowercased text for keyword counting (see KEYWORD_TOKENIZER)."""
+    if KEYWORD_TOKENIZER == 'regex': return KEYWORD_TOKEN_RE.findall(text_lower)
+    if punkt_available:
+        try: return word_tokenize(text_lower)
+        except Exception: return text_lower.split()
+    return text_lower.split()
+
+def get_moods_and_scores_batch(texts):
+    """Batch version of get_mood_and_score. Returns a list of (mood, score) tuples, one per text.
+
+    Cached texts are answered from sentiment_cache and repeats within the batch are
+    scored once. The rest are tokenized once each and counted against KEYWORD_MOOD_INDEX
+    in a single pass; the threshold and override rules are then applied to the whole
+    batch with NumPy. Results are identical to calling get_mood_and_score on each text.
+    """
+    n = len(texts)
+    if n == 0: return []
+    if analyzer is None: # Still warming up: keyword-only fallback, never cached
+        start_nltk_warmup()
+        return _score_batch(texts)
+
+    results = [None] * n
+    misses = {} # cache key (or position, for uncacheable texts) -> positions in texts
+    for i, text in enumerate(texts):
+        key = SentimentCache.key(text)
+        cached = sentiment_cache.get(key)
+        if cached is not None: results[i] = cached
+        else: misses.setdefault(key if key is not None else i, []).append(i)
+    if misses:
+        miss_texts = [texts[positions[0]] for positions in misses.values()]
+        scored = scoring_pool.score(miss_texts)
+        if scored is None: scored = _score_batch(miss_texts)
+        for (key, positions), result in zip(misses.items(), scored):
+            if isinstance(key, str): sentiment_cache.put(key, result)
+            for i in positions: results[i] = result
+    return results
+
+def _score_batch(texts):
+    n = len(texts)
+    compound = np.empty(n); pos = np.empty(n); neg = np.empty(n)
+    hit_rows = []; hit_cols = []
+    scorer = analyzer
+    for i, text in enumerate(texts):
+        tokens = tokenize_for_keywords(text.lower())
+        vs = scorer.polarity_scores(text) if scorer is not None else fallback_polarity_scores(tokens)
+        compound[i] = vs['compound']; pos[i] = vs['pos']; neg[i] = vs['neg']
+        for token in tokens:
+            for mood_idx in KEYWORD_MOOD_INDEX.get(token, ()):
+                hit_rows.append(i); hit_cols.append(mood_idx)
+
+    counts = np.zeros((n, len(KEYWORD_MOODS)), dtype=np.int64)
+    np.add.at(counts, (hit_rows, hit_cols), 1)
+    happy, sad, angry, stressed, calm = counts.T
+    total = counts.sum(axis=1)
+    has_keywords = total > 0
+
+    influence = np.zeros(n)
+    np.divide((happy + calm) - (sad + angry + stressed), total, out=influence, where=has_keywords)
+    influence *= KEYWORD_MAX_INFLUENCE
+    combined = np.clip(compound + influence, -1.0, 1.0)
+
+    happy_i, sad_i, angry_i, stressed_i, calm_i = range(len(KEYWORD_MOODS))
+    dominant = counts.argmax(axis=1) # First maximum wins, like max() over keyword_counts
+    dominant_count = counts.max(axis=1)
+
+    positive = (combined >= POSITIVE_THRESHOLD) & (pos >= STRONG_POS_VADER)
+    negative = ~positive & (combined <= NEGATIVE_THRESHOLD) & (neg >= STRONG_NEG_VADER * 0.8)
+    neutral = ~positive & ~negative
+
+    moods = np.full(n, calm_i)
+    calm_dominant = has_keywords & (dominant == calm_i) & (dominant_count > happy)
+    moods[positive & ~calm_dominant] = happy_i
+
+    negative_dominant = has_keywords & np.isin(dominant, (sad_i, angry_i, stressed_i))
+    moods[negative] = np.where(negative_dominant, dominant, sad_i)[negative]
+
+    significant = neutral & has_keywords & (dominant_count >= np.maximum(total * 0.4, 1))
+    moods[significant & (dominant == happy_i) & (pos > neg + 0.1)] = happy_i
+    moods[significant & (dominant == angry_i) & (neg > pos + 0.1)] = angry_i
+    moods[significant & (dominant == stressed_i) & (neg > pos)] = stressed_i
+    moods[significant & (dominant == sad_i) & (neg > pos)] = sad_i
+
+    moods[combined > STRONG_OVERRIDE_THRESHOLD] = happy_i
+    moods[(combined < -STRONG_OVERRIDE_THRESHOLD) & ~np.isin(moods, (sad_i, angry_i, stressed_i))] = sad_i
+
+    return [(KEYWORD_MOODS[m], score) for m, score in zip(moods.tolist(), combined.tolist())]
+
+# --- Scoring Worker Pool ---
+def _init_scoring_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C is the parent's to handle
+    wait_for_nltk() # Already loaded when forked from a preloaded parent; loads once otherwise
+
+def _score_in_worker(texts):
+    if analyzer is None: return None # Lexicon failed to load here; the caller scores in-process
+    return _score_batch(texts)
+
+class ScoringPool:
+    """Runs _score_batch in worker processes so CPU-bound VADER scoring uses every core.
+
+    Each worker loads the analyzer once in its initializer (with the 'fork' start method it
+    inherits a preloaded one, but see SCORING_START_METHOD). A request may have at most max_pending calls in flight; past
+    that, callers wait up to `timeout` for a slot. score() returns None instead of raising
+    when the pool is disabled, saturated, too slow or broken, and the caller then scores
+    in-process. Results are identical to in-process scoring.
+    """
+
+    def __init__(self, workers=SCORING_WORKERS, timeout=SCORING_TIMEOUT, max_pending=SCORING_MAX_PENDING,
+                 chunk_size=SCORING_CHUNK_SIZE, start_method=SCORING_START_METHOD):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.chunk_size = chunk_size
+        self.start_method = start_method
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = os.getpid()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.calls = 0
+        self.texts_scored = 0
+        self.rejected = 0 # No slot within timeout
+        self.timeouts = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._pid != os.getpid(): # Forked: the parent's workers belong to the parent
+                self._executor = None
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+                self._pid = os.getpid()
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_scoring_worker,
+                                                     mp_context=multiprocessing.get_context(self.start_method))
+            return self._executor
+
+    def _discard_executor(self, executor):
+        with self._lock:
+            if self._executor is executor: self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _count(self, name, n=1):
+        with self._lock: setattr(self, name, getattr(self, name) + n)
+
+    def score(self, texts):
+        """List of (mood, score) for texts, or None if the caller should score them itself."""
+        if not self.enabled or not texts: return None
+        deadline = time.monotonic() + self.timeout
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count("rejected")
+            return None
+        executor = self._get_executor()
+        remaining = [1] # Held by this call until submission ends, then by each unfinished task
+        def release(_future=None): # The slot frees once the workers are actually idle again
+            with self._lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last: self._slots.release()
+        futures = []
+        try:
+            for start in range(0, len(texts), self.chunk_size):
+                future = executor.submit(_score_in_worker, texts[start:start + self.chunk_size])
+                with self._lock: remaining[0] += 1
+                future.add_done_callback(release)
+                futures.append(future)
+        except (BrokenProcessPool, RuntimeError) as e:
+            for future in futures: future.cancel()
+            self._discard_executor(executor)
+            self._count("errors")
+            log.error("Scoring pool unavailable (%s); scoring in-process.", e)
+            return None
+        finally:
+            release()
+        self._count("calls")
+        results = []
+        try:
+            for future in futures:
+                chunk = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                if chunk is None: return None
+                results.extend(chunk)
+        except FutureTimeoutError:
+            for future in futures: future.cancel()
+            self._count("timeouts")
+            return None
+        except BrokenProcessPool as e:
+            self._discard_executor(executor)
+            self._count("errors")
+            log.error("Scoring worker died (%s); scoring in-process.", e)
+            return None
+        self._count("texts_scored", len(results))
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "workers": self.workers,
+            "start_method": self.start_method,
+            "running": self._executor is not None,
+            "max_pending": self.max_pending,
+            "calls": self.calls,
+            "texts_scored": self.texts_scored,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
+
+scoring_pool = ScoringPool()
+atexit.register(scoring_pool.shutdown)
+
+def get_time_of_day(local_now=None): #
+    """Determines the current time of day category ('morning', 'midday', 'evening') in the user's time zone.""" #
+    hour = (local_now or datetime.now(get_current_timezone())).hour #
+    if 5 <= hour < 12: return "morning" #
+    elif 12 <= hour < 17: return "midday" #
+    else: return "evening" #
+
+# --- Compiled Question Index ---
+# Question banks are compiled once into tuples plus "all asked" bitmasks. The session keeps
+# one integer per bank whose bit i is set once question i was asked, so selection is a random
+# pick among the remaining bits and resets are plain bit operations.
+MOOD_QUESTIONS = {mood: tuple(bank) for mood, bank in question_banks.items()}
+TIME_QUESTIONS = {category: tuple(bank) for category, bank in time_specific_questions.items()}
+MOOD_FULL_MASKS = {mood: (1 << len(bank)) - 1 for mood, bank in MOOD_QUESTIONS.items()}
+TIME_FULL_MASKS = {category: (1 << len(bank)) - 1 for category, bank in TIME_QUESTIONS.items()}
+QUESTION_INDEX = {mood: {q: i for i, q in enumerate(bank)} for mood, bank in MOOD_QUESTIONS.items()}
+TIME_QUESTION_INDEX = {category: {q: i for i, q in enumerate(bank)} for category, bank in TIME_QUESTIONS.items()}
+
+def random_set_bit(mask):
+    """Position of a uniformly chosen set bit of mask (mask must be non-zero)."""
+    for _ in range(random.randrange(mask.bit_count())):
+        mask &= mask - 1 # Clear the lowest set bit
+    return (mask & -mask).bit_length() - 1
+
+def _to_mask(value, index_map):
+    """Converts older list-based asked state (indexes, or question text) to a bitmask."""
+    if isinstance(value, int): return value
+    mask = 0
+    for item in value or ():
+        idx = item if isinstance(item, int) else index_map.get(item)
+        if idx is not None: mask |= 1 << idx
+    return mask
+
+def normalize_asked_state(asked_mood_questions, asked_time_questions):
+    """Returns ({mood: mask}, {time category: mask}) from whatever the session currently holds."""
+    if not isinstance(asked_mood_questions, dict): asked_mood_questions = {}
+    mood_masks = {mood: _to_mask(asked_mood_questions.get(mood), QUESTION_INDEX[mood]) for mood in MOOD_QUESTIONS}
+    time_masks = {}
+    if isinstance(asked_time_questions, dict):
+        time_masks = {cat: _to_mask(v, TIME_QUESTION_INDEX.get(cat, {})) for cat, v in asked_time_questions.items()}
+    elif isinstance(asked_time_questions, list): # [category, index or text] pairs
+        for category, item in asked_time_questions:
+            time_masks[category] = time_masks.get(category, 0) | _to_mask([item], TIME_QUESTION_INDEX.get(category, {}))
+    return mood_masks, time_masks
+
+def get_asked_state():
+    """Returns the session's (mood masks, time masks), converting older state in place once."""
+    asked_mood, asked_time = session.get('asked_mood_questions'), session.get('asked_time_questions')
+    if not (isinstance(asked_mood, dict) and isinstance(asked_time, dict)
+            and all(isinstance(v, int) for v in asked_mood.values())
+            and all(isinstance(v, int) for v in asked_time.values())):
+        asked_mood, asked_time = normalize_asked_state(asked_mood, asked_time)
+        session['asked_mood_questions'] = asked_mood; session['asked_time_questions'] = asked_time
+    return asked_mood, asked_time
+
+def mark_question_asked(asked_mood_questions, asked_time_questions, mood_context, question, is_time, time_key):
+    """Sets the asked bit for a question returned by get_next_question."""
+    if is_time and time_key:
+        asked_time_questions[time_key] = asked_time_questions.get(time_key, 0) | 1 << TIME_QUESTION_INDEX[time_key][question]
+        return
+    idx = QUESTION_INDEX.get(mood_context, {}).get(question)
+    if idx is None: return # Fallback text or a question from another bank; nothing to mark
+    asked_mood_questions[mood_context] = asked_mood_questions.get(mood_context, 0) | 1 << idx
 
 def get_next_question(mood_context, current_time_category): #
     """Selects the next question based on mood and time, managing asked questions in session.""" #
-    if 'asked_mood_questions' not in session: session['asked_mood_questions'] = {mood: [] for mood in question_banks.keys()} #
-    if 'asked_time_questions' not in session: session['asked_time_questions'] = [] #
-    if mood_context not in session['asked_mood_questions']: session['asked_mood_questions'][mood_context] = [] #
-
-    asked_mood_for_context = session['asked_mood_questions'].get(mood_context, []) #
-    asked_time_tuples = session['asked_time_questions'] #
-
-    possible_questions = [] #
-    is_time_specific_candidate = False #
-    time_bank_key_candidate = None #
-
-    current_mood_bank = question_banks.get(mood_context, []) #
-    unasked_mood_questions = [q for q in current_mood_bank if q not in asked_mood_for_context] #
-    possible_questions.extend(unasked_mood_questions) #
+    asked_mood, asked_time = get_asked_state() #
 
+    current_mood_bank = MOOD_QUESTIONS.get(mood_context, ()) #
+    candidates = MOOD_FULL_MASKS.get(mood_context, 0) & ~asked_mood.get(mood_context, 0) #
+    time_bank = () #
     if mood_context == INITIAL: #
-        time_bank = time_specific_questions.get(current_time_category, []) #
-        unasked_time_questions = [q for q in time_bank if (current_time_category, q) not in asked_time_tuples] #
-        possible_questions.extend(unasked_time_questions) #
-        random.shuffle(possible_questions) #
-
-    if not possible_questions: #
-        print(f"DEBUG (get_next_question): No unasked questions for '{mood_context}'. Resetting.") #
-        session['asked_mood_questions'][mood_context] = [] #
-        possible_questions.extend(current_mood_bank) #
-
-        if mood_context == INITIAL and not possible_questions: #
-             time_bank = time_specific_questions.get(current_time_category, []) #
-             session['asked_time_questions'] = [t for t in asked_time_tuples if t[0] != current_time_category] #
-             unasked_time_questions = [q for q in time_bank if (current_time_category, q) not in session['asked_time_questions']] #
-             possible_questions.extend(unasked_time_questions) #
-             random.shuffle(possible_questions) #
-
-        if not possible_questions and mood_context != CALM: #
-            print(f"DEBUG (get_next_question): Falling back to CALM questions.") #
-            mood_context = CALM #
-            calm_bank = question_banks.get(CALM, []) #
-            if CALM not in session['asked_mood_questions']: session['asked_mood_questions'][CALM] = [] #
-            asked_calm = session['asked_mood_questions'].get(CALM, []) #
-            unasked_calm = [q for q in calm_bank if q not in asked_calm] #
-            if not unasked_calm: #
-                 session['asked_mood_questions'][CALM] = [] #
-                 possible_questions.extend(calm_bank) #
-            else: possible_questions.extend(unasked_calm) #
-
-        if not possible_questions: #
-            print("ERROR (get_next_question): No questions available.") #
+        # Time questions occupy the bits above the mood bank's
+        time_bank = TIME_QUESTIONS.get(current_time_category, ()) #
+        unasked_time = TIME_FULL_MASKS.get(current_time_category, 0) & ~asked_time.get(current_time_category, 0) #
+        candidates |= unasked_time << len(current_mood_bank) #
+
+    if not candidates: #
+        log.debug("get_next_question: No unasked questions for '%s'. Resetting.", mood_context) #
+        asked_mood[mood_context] = 0 #
+        candidates = MOOD_FULL_MASKS.get(mood_context, 0) #
+
+        if mood_context == INITIAL and not candidates: #
+             asked_time[current_time_category] = 0 #
+             candidates = TIME_FULL_MASKS.get(current_time_category, 0) << len(current_mood_bank) #
+
+        if not candidates and mood_context != CALM: #
+            log.debug("get_next_question: Falling back to CALM questions.") #
+            current_mood_bank = MOOD_QUESTIONS.get(CALM, ()) #
+            time_bank = () #
+            candidates = MOOD_FULL_MASKS.get(CALM, 0) & ~asked_mood.get(CALM, 0) #
+            if not candidates: #
+                 asked_mood[CALM] = 0 #
+                 candidates = MOOD_FULL_MASKS.get(CALM, 0) #
+
+        if not candidates: #
+            log.error("get_next_question: No questions available.") #
             return "Is there anything else on your mind?", False, None #
 
-    question_to_ask = random.choice(possible_questions) #
+    bit = random_set_bit(candidates) #
+    if bit < len(current_mood_bank): #
+        return current_mood_bank[bit], False, None #
+    return time_bank[bit - len(current_mood_bank)], True, current_time_category #
+
+
+# --- Static Assets ---
+# flask build-assets copies the static files to static/dist/ under content-hashed names,
+# with .gz (and, when the brotli module is installed, .br) copies of the text ones, and
+# writes static/dist/manifest.json. asset_url() resolves names through the manifest, so a
+# changed file gets a new URL and every built URL can be cached forever. Without a build,
+# pages use the plain static files, and vendored libraries that are missing fall back to
+# their CDN URLs.
+ASSET_DIST_DIR = os.path.join(app.static_folder, 'dist')
+ASSET_SOURCES = ('*.js', '*.css', 'images/*', 'vendor/*') # Globs under static/
+ASSET_COMPRESSIBLE = ('.js', '.css', '.svg', '.json', '.map')
+ASSET_ENCODINGS = (('br', '.br'), ('gzip', '.gz')) # Preference order when a client accepts both
+VENDOR_ASSETS = { # Pinned libraries kept in static/vendor/ so pages work offline
+    'vendor/chart.umd.min.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.min.js',
+    'vendor/chartjs-adapter-date-fns.bundle.min.js':
+        'https://cdn.jsdelivr.net/npm/chartjs-adapter-date-fns@3.0.0/dist/chartjs-adapter-date-fns.bundle.min.js',
+}
+TAILWIND_VERSION = '3.4.17' # Purged build of just the classes the templates and scripts use
+TAILWIND_CSS = 'vendor/tailwind.css' # Generated by flask build-assets; the pages use the CDN runtime without it
+_asset_manifest = None
+
+def get_asset_manifest():
+    """static/dist/manifest.json, read once per process ({} parts when there is no build)."""
+    global _asset_manifest
+    if _asset_manifest is None:
+        try:
+            with open(os.path.join(ASSET_DIST_DIR, 'manifest.json'), encoding='utf-8') as f:
+                _asset_manifest = json.load(f)
+        except (OSError, ValueError):
+            _asset_manifest = {"assets": {}, "encodings": {}}
+    return _asset_manifest
+
+@app.template_global()
+def asset_available(filename):
+    """Whether static/<filename> was built or exists (vendored files are optional)."""
+    return filename in get_asset_manifest()["assets"] or os.path.exists(os.path.join(app.static_folder, filename))
+
+@app.template_global()
+def asset_url(filename, cdn=None):
+    """URL of static/<filename>: its fingerprinted build if there is one, else the file itself, else cdn."""
+    built = get_asset_manifest()["assets"].get(filename)
+    if built:
+        return url_for('built_asset', filename=built)
+    if cdn and not os.path.exists(os.path.join(app.static_folder, filename)):
+        return cdn
+    return url_for('static', filename=filename)
+
+@app.route('/static/dist/<path:filename>')
+def built_asset(filename):
+    """Serves a fingerprinted asset, precompressed when the client accepts it, cacheable forever."""
+    path = safe_join(ASSET_DIST_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        return "Not Found", 404
+    encodings = get_asset_manifest()["encodings"].get(filename, ())
+    for encoding, suffix in ASSET_ENCODINGS:
+        if encoding in encodings and request.accept_encodings[encoding]:
+            response = send_file(path + suffix, mimetype=mimetypes.guess_type(filename)[0], max_age=ASSET_CACHE_MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_file(path, max_age=ASSET_CACHE_MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_CACHE_MAX_AGE}, immutable'
+    return response
 
-    time_bank_for_category = time_specific_questions.get(current_time_category, []) #
-    if question_to_ask in time_bank_for_category: #
-         if (current_time_category, question_to_ask) not in asked_time_tuples: #
-              is_time_specific_candidate = True #
-              time_bank_key_candidate = current_time_category #
+def _brotli_compress():
+    for module in ('brotli', 'brotlicffi'):
+        try:
+            return __import__(module).compress
+        except ImportError:
+            continue
+    return None
+
+def vendor_assets(static_folder):
+    """Downloads missing VENDOR_ASSETS. Returns {name: error} of those still missing."""
+    missing = {}
+    for filename, url in VENDOR_ASSETS.items():
+        path = os.path.join(static_folder, filename)
+        if os.path.exists(path):
+            continue
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                data = response.read()
+        except OSError as e:
+            missing[filename] = str(e)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+    return missing
+
+def build_tailwind_css(static_folder):
+    """Runs the Tailwind CLI (through npx) over the templates and scripts. Returns an error message or None."""
+    source = os.path.join(static_folder, 'dist', 'tailwind.input.css')
+    os.makedirs(os.path.dirname(source), exist_ok=True)
+    with open(source, 'w', encoding='utf-8') as f:
+        f.write("@tailwind base;\n@tailwind components;\n@tailwind utilities;\n")
+    content = f"{os.path.join(app.root_path, 'templates')}/*.html,{static_folder}/*.js"
+    command = ['npx', '--yes', f'tailwindcss@{TAILWIND_VERSION}', '-i', source,
+               '-o', os.path.join(static_folder, TAILWIND_CSS), '--content', content, '--minify']
+    try:
+        subprocess.run(command, check=True, timeout=300, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        output = (e.stderr or "").strip()
+        return output.splitlines()[-1] if output else str(e)
+    except (OSError, subprocess.SubprocessError) as e:
+        return str(e)
+    finally:
+        os.remove(source)
+    return None
+
+def build_asset_manifest(static_folder):
+    """Fingerprints and precompresses the ASSET_SOURCES into static/dist/ and writes its manifest.
+
+    Files of earlier builds are kept, so pages still cached by browsers can load theirs.
+    """
+    dist_dir = os.path.join(static_folder, 'dist')
+    os.makedirs(dist_dir, exist_ok=True)
+    brotli_compress = _brotli_compress()
+    manifest = {"assets": {}, "encodings": {}}
+    sizes = [] # (filename, bytes, gzip bytes, brotli bytes)
+    for pattern in ASSET_SOURCES:
+        for path in sorted(glob.glob(os.path.join(static_folder, pattern))):
+            if not os.path.isfile(path):
+                continue
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(filename)
+            built = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            outputs = {built: data}
+            encodings = []
+            if ext in ASSET_COMPRESSIBLE:
+                if brotli_compress is not None:
+                    outputs[built + '.br'] = brotli_compress(data, quality=11)
+                    encodings.append('br')
+                outputs[built + '.gz'] = gzip.compress(data, compresslevel=9, mtime=0) # Reproducible bytes
+                encodings.append('gzip')
+            for name, payload in outputs.items():
+                out_path = os.path.join(dist_dir, name)
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                with open(f"{out_path}.tmp", 'wb') as f:
+                    f.write(payload)
+                os.replace(f"{out_path}.tmp", out_path)
+            manifest["assets"][filename] = built
+            if encodings:
+                manifest["encodings"][built] = encodings
+            sizes.append((filename, len(data), *(len(outputs[f"{built}.{suffix}"]) if f"{built}.{suffix}" in outputs else None
+                                                  for suffix in ('gz', 'br'))))
+    with open(os.path.join(dist_dir, 'manifest.json.tmp'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(os.path.join(dist_dir, 'manifest.json.tmp'), os.path.join(dist_dir, 'manifest.json')) # Switch last
+    return sizes
+
+@app.cli.command('build-assets')
+@click.option('--vendor/--no-vendor', default=True, help='Download missing vendored libraries (needs network).')
+@click.option('--tailwind/--no-tailwind', default=True, help='Build the purged Tailwind CSS (needs npx).')
+def build_assets_command(vendor, tailwind):
+    """Vendors libraries, builds Tailwind and fingerprints and precompresses the static files."""
+    global _asset_manifest
+    start = time.perf_counter()
+    if vendor:
+        for filename, error in vendor_assets(app.static_folder).items():
+            print(f"Warning: could not download {filename} ({error}); pages load it from its CDN.")
+    error = build_tailwind_css(app.static_folder) if tailwind else None
+    if error:
+        print(f"Warning: Tailwind build failed ({error}); pages keep the Tailwind CDN runtime.")
+    sizes = build_asset_manifest(app.static_folder)
+    _asset_manifest = None
+    for filename, size, gzip_size, brotli_size in sizes:
+        print(f"  {filename:<48} {size:>9} B" + (f"  gzip {gzip_size:>8} B" if gzip_size else "")
+              + (f"  br {brotli_size:>8} B" if brotli_size else ""))
+    if _brotli_compress() is None:
+        print("The brotli module is not installed; only gzip copies were written.")
+    print(f"Built {len(sizes)} asset(s) into {ASSET_DIST_DIR} in {time.perf_counter() - start:.2f}s.")
+
+# --- Rate Limiting and Admission Control ---
+RATE_LIMITED_ENDPOINTS = {'chat_endpoint': 'chat', 'chat_stream_endpoint': 'chat',
+                          'analyze_batch': 'analysis', 'import_mood_logs_endpoint': 'analysis'}
+SCORING_ENDPOINTS = {'chat_endpoint', 'chat_stream_endpoint', 'analyze_batch'} # Held for the whole view
+
+def parse_rate_limit(text):
+    """'burst,tokens per second' -> (capacity, rate)."""
+    capacity, rate = (float(part) for part in text.split(','))
+    if capacity < 1 or rate <= 0:
+        raise ValueError(f"Invalid rate limit {text!r}")
+    return capacity, rate
+
+RATE_LIMITS = {'chat': parse_rate_limit(RATE_LIMIT_CHAT), 'analysis': parse_rate_limit(RATE_LIMIT_ANALYSIS)}
+
+class RateLimiter:
+    """Token buckets: a key holds up to `capacity` tokens, refilled at `rate` per second.
+
+    acquire() takes `cost` tokens and returns 0.0, or, when the bucket is short, takes
+    nothing and returns the seconds until it would succeed (the Retry-After).
+    """
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    def _count(self, retry_after):
+        with self._stats_lock:
+            if retry_after: self.limited += 1
+            else: self.allowed += 1
+        return retry_after
+
+    def stats(self):
+        return {"backend": type(self).__name__, "allowed": self.allowed, "limited": self.limited, "errors": self.errors}
+
+class MemoryRateLimiter(RateLimiter):
+    """Buckets in a per-process LRU dict. With several workers each keeps its own, so a
+    client spread over N workers gets up to N times the limit."""
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        super().__init__()
+        self.max_keys = max_keys
+        self._buckets = OrderedDict() # key -> (tokens, monotonic time of the last check)
+        self._lock = threading.Lock()
+
+    def acquire(self, key, capacity, rate, cost=1.0):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            retry_after = 0.0 if tokens >= cost else (cost - tokens) / rate
+            self._buckets[key] = (tokens - cost if not retry_after else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return self._count(retry_after)
+
+    def stats(self):
+        return dict(super().stats(), keys=len(self._buckets))
+
+class SQLiteRateLimiter(RateLimiter):
+    """Buckets in the rate_limits table, shared by every worker process.
+
+    One UPSERT refills the bucket, takes the tokens and records the outcome atomically,
+    so there is no read-modify-write race between processes. If the database is busy or
+    failing the request is let through (fail open): limiting must not take /chat down.
+    """
+
+    ACQUIRE_SQL = '''
+        INSERT INTO rate_limits (key, tokens, updated, allowed) VALUES (:key, :capacity - :cost, :now, 1)
+        ON CONFLICT(key) DO UPDATE SET
+            tokens = MIN(:capacity, tokens + (:now - updated) * :rate)
+                     - (CASE WHEN MIN(:capacity, tokens + (:now - updated) * :rate) >= :cost THEN :cost ELSE 0 END),
+            updated = :now,
+            allowed = MIN(:capacity, tokens + (:now - updated) * :rate) >= :cost
+        RETURNING tokens, allowed
+    ''' # SET expressions all see the row as it was before the update
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        self._checks = 0
+
+    def acquire(self, key, capacity, rate, cost=1.0):
+        now = time.time() # Wall clock: buckets are shared between processes
+        params = {"key": key, "capacity": capacity, "rate": rate, "cost": cost, "now": now}
+        try:
+            with self.pool.connection() as db:
+                with db:
+                    tokens, allowed = db.execute(self.ACQUIRE_SQL, params).fetchone()
+                    self._checks += 1
+                    if self._checks % RATE_LIMIT_PURGE_EVERY == 0:
+                        idle = max(capacity / rate for capacity, rate in RATE_LIMITS.values())
+                        db.execute("DELETE FROM rate_limits WHERE updated < ?", (now - idle,))
+        except sqlite3.Error as e:
+            with self._stats_lock: self.errors += 1
+            log.warning("Rate limit check failed, allowing the request: %s", e)
+            return 0.0
+        return self._count(0.0 if allowed else (cost - tokens) / rate)
 
-    return question_to_ask, is_time_specific_candidate, time_bank_key_candidate #
+def create_rate_limiter(backend=RATE_LIMIT_BACKEND):
+    if backend == 'off':
+        return None
+    if backend == 'sqlite':
+        return SQLiteRateLimiter(db_pool)
+    return MemoryRateLimiter()
+
+rate_limiter = create_rate_limiter()
+
+class ScoringAdmission:
+    """Caps how many scoring requests run at once in this process.
+
+    A request that can't get a slot within `wait` seconds is answered 429 right away
+    instead of queueing behind the others, so during a spike the admitted requests keep
+    their latency and the rest learn to retry quickly, without costing a VADER run.
+    """
+
+    def __init__(self, limit=SCORING_MAX_CONCURRENT, wait=SCORING_ADMISSION_WAIT):
+        self.limit = limit
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def try_enter(self):
+        if not self._slots.acquire(timeout=self.wait):
+            with self._lock: self.rejected += 1
+            return False
+        with self._lock:
+            self.active += 1
+            self.admitted += 1
+        return True
 
+    def leave(self):
+        with self._lock: self.active -= 1
+        self._slots.release()
+
+    def stats(self):
+        return {"limit": self.limit, "active": self.active, "admitted": self.admitted, "rejected": self.rejected}
+
+scoring_admission = ScoringAdmission()
+
+def too_many_requests(message, retry_after):
+    seconds = max(1, math.ceil(retry_after))
+    response = jsonify({"error": message, "retry_after": seconds})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(seconds)
+    return response
+
+def rate_limit_key():
+    """The session's user, else the client address (clients without a session cookie share it)."""
+    user_id = session.get('user_id')
+    return f"user:{user_id}" if user_id is not None else f"ip:{request.remote_addr}"
+
+@app.before_request
+def admit_request():
+    """Rate limit, then scoring admission, for the endpoints that score text; both fail fast with 429."""
+    limit = RATE_LIMITED_ENDPOINTS.get(request.endpoint)
+    if limit is not None and rate_limiter is not None:
+        retry_after = rate_limiter.acquire(f"{limit}:{rate_limit_key()}", *RATE_LIMITS[limit])
+        if retry_after:
+            return too_many_requests("Too many requests; please slow down.", retry_after)
+    if request.endpoint in SCORING_ENDPOINTS:
+        if not scoring_admission.try_enter():
+            return too_many_requests("The server is busy; please try again shortly.", 1)
+        g.scoring_admitted = True
+
+@app.teardown_request
+def release_scoring_slot(exception):
+    if g.pop('scoring_admitted', False):
+        scoring_admission.leave()
 
 # --- Flask Routes ---
-# ...(Existing routes: index, chatbot_page, profile, api/profile GET/POST, api/profile/picture, uploaded_file - unchanged)...
 @app.route('/')
 def index():
     """Serves the main landing page (index.html)."""
@@ -367,16 +2638,10 @@ def index():
     # Initialize session keys if they don't exist
     session.setdefault('initialized', True)
     session.setdefault('current_mood_context', INITIAL)
-    session.setdefault('asked_mood_questions', {mood: [] for mood in question_banks.keys()})
-    session.setdefault('asked_time_questions', [])
-    session.setdefault('conversation_scores', []) # Still keep for immediate avg? Optional.
-    # Initialize profile data in session if not present
-    session.setdefault('profile', {
-        'name': 'User Name', # Default values
-        'age': None,
-        'weight': None,
-        'picture_filename': None # Store only filename
-    })
+    session.setdefault('asked_mood_questions', {mood: 0 for mood in question_banks.keys()})
+    session.setdefault('asked_time_questions', {})
+    session.setdefault('mood_trajectory', MoodTrajectory().to_state())
+    get_current_user_id() # Profile lives in the users table; the session only holds the id
     session.modified = True # Ensure changes are saved
     # Pass theme variable to template
     return render_template('index.html', theme='dark') # Assuming dark theme is default for now
@@ -391,10 +2656,8 @@ def chatbot_page():
 @app.route('/profile')
 def profile():
     """Serves the profile page."""
-    # Initialize profile in session if it doesn't exist (e.g., direct navigation)
-    session.setdefault('profile', {
-        'name': 'User Name', 'age': None, 'weight': None, 'picture_filename': None
-    })
+    # Create the user if it doesn't exist (e.g., direct navigation)
+    get_current_user_id()
     # Pass theme variable to template
     return render_template('profile.html', theme='dark')
 
@@ -403,91 +2666,139 @@ def profile():
 
 @app.route('/api/profile', methods=['GET'])
 def get_profile():
-    """API endpoint to get current profile data from session."""
-    profile_data = session.get('profile', { # Provide default if somehow missing
-        'name': 'N/A', 'age': None, 'weight': None, 'picture_filename': None
-    })
+    """API endpoint to get the current user's profile data."""
+    db = get_db()
+    if not db:
+        return jsonify({"detail": "Database connection failed"}), 500
+    mood_log_writer.flush() # Make this session's queued rows part of the trend
+    try:
+        user_id, profile_data = load_current_profile(db)
+        if profile_data is not None:
+            profile_data['picture_urls'] = picture_urls(profile_data['picture_filename'])
+            profile_data['mood_trend'] = load_user_trajectory(db, user_id).trend() # Maintained on each flush
+    except sqlite3.Error as e:
+        log.error("Error loading profile: %s", e)
+        profile_data = None
+    if profile_data is None:
+        return jsonify({"detail": "Could not load profile"}), 500
     return jsonify(profile_data)
 
 @app.route('/api/profile', methods=['POST'])
 def update_profile():
-    """API endpoint to update profile text data in session."""
+    """API endpoint to update the current user's profile text data."""
     data = request.json
     if not data:
         return jsonify({"detail": "Invalid request format"}), 400
 
-    current_profile = session.get('profile', {}) # Get current or empty dict
+    db = get_db()
+    if not db:
+        return jsonify({"detail": "Database connection failed"}), 500
+    user_id, current_profile = load_current_profile(db)
+    if current_profile is None:
+        return jsonify({"detail": "Could not load profile"}), 500
 
     # Update only provided fields
     if 'name' in data:
-        current_profile['name'] = data['name']
+        if data['name'] is not None and not isinstance(data['name'], str):
+            return jsonify({"detail": "Invalid name format"}), 400
+        current_profile['name'] = data['name'] or '' # users.name is NOT NULL
     if 'age' in data:
         try:
              # Handle potential empty string or null from frontend
              current_profile['age'] = int(data['age']) if data.get('age') else None
-        except (ValueError, TypeError):
+             if current_profile['age'] is not None and not 0 <= current_profile['age'] <= MAX_PROFILE_AGE:
+                 raise ValueError(current_profile['age']) # Also keeps it inside SQLite's INTEGER range
+        except (ValueError, TypeError, OverflowError): # OverflowError: int(Infinity)
              return jsonify({"detail": "Invalid age format"}), 400
     if 'weight' in data:
          try:
               # Handle potential empty string or null from frontend
               current_profile['weight'] = float(data['weight']) if data.get('weight') else None
-         except (ValueError, TypeError):
+              if current_profile['weight'] is not None and not 0 <= current_profile['weight'] <= MAX_PROFILE_WEIGHT:
+                  raise ValueError(current_profile['weight']) # Also rejects NaN and Infinity
+         except (ValueError, TypeError, OverflowError): # OverflowError: float() of a huge int
               return jsonify({"detail": "Invalid weight format"}), 400
+    if 'timezone' in data:
+        if data['timezone'] is not None and not isinstance(data['timezone'], str):
+            return jsonify({"detail": "Invalid time zone format"}), 400
+        if data['timezone'] and not is_valid_timezone(data['timezone']):
+            return jsonify({"detail": "Unknown time zone"}), 400
+        current_profile['timezone'] = data['timezone'] or None
 
-    session['profile'] = current_profile # Save back to session
-    session.modified = True
-    print(f"DEBUG: Profile updated in session: {session['profile']}")
+    try:
+        save_profile(db, user_id, current_profile)
+    except sqlite3.Error as e:
+        log.error("Error saving profile: %s", e)
+        return jsonify({"detail": "Could not save profile"}), 500
+    session['timezone'] = current_profile['timezone'] or ''
+    response_cache.invalidate_users([user_id]) # Cached days were bucketed in the old zone
+    log.debug("Profile updated for user %s: %s", user_id, current_profile)
     return jsonify({"message": "Profile updated successfully", "profile": current_profile})
 
 @app.route('/api/profile/picture', methods=['POST'])
 def update_profile_picture():
-    """API endpoint to handle profile picture upload."""
+    """API endpoint to handle profile picture upload.
+
+    The upload is named after its content hash and its thumbnails are made on the picture
+    pipeline's threads; the reply doesn't wait for them.
+    """
     if 'profile_picture' not in request.files:
         return jsonify({"detail": "No picture file part"}), 400
     file = request.files['profile_picture']
     if file.filename == '':
         return jsonify({"detail": "No selected picture file"}), 400
+    if not allowed_file(file.filename):
+        return jsonify({"detail": "File type not allowed"}), 400
 
-    if file and allowed_file(file.filename):
-        # Generate a more unique filename to avoid conflicts
-        # Using timestamp + original filename is safer
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        unique_filename = f"{timestamp}_{secure_filename(file.filename)}"
-
-        # Construct full path
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-
+    data = file.read() # At most MAX_CONTENT_LENGTH
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    if Image is not None:
         try:
-            # Optional: Delete old picture if it exists
-            old_filename = session.get('profile', {}).get('picture_filename')
-            if old_filename:
-                 old_file_path = os.path.join(app.config['UPLOAD_FOLDER'], old_filename)
-                 if os.path.exists(old_file_path):
-                    try:
-                        os.remove(old_file_path)
-                        print(f"DEBUG: Deleted old profile picture: {old_filename}")
-                    except OSError as e:
-                        print(f"Error deleting old file {old_filename}: {e}")
-
+            probe_picture(data) # Header only; the full decode happens on the pipeline
+        except ValueError as e:
+            return jsonify({"detail": str(e)}), 400
+        ext = picture_extension()
+        unique_filename = f"{digest}.{ext}"
+        picture_pipeline.submit(data, digest, ext)
+    else: # No Pillow: keep the upload as it is, still stored once per content
+        unique_filename = f"{digest}-raw.{file.filename.rsplit('.', 1)[1].lower()}"
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+        if not os.path.exists(file_path):
+            tmp_path = f"{file_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, file_path)
 
-            file.save(file_path)
-            print(f"DEBUG: Profile picture saved to: {file_path}")
+    db = get_db()
+    if not db:
+        return jsonify({"detail": "Database connection failed"}), 500
+    try:
+        user_id, current_profile = load_current_profile(db)
+        if current_profile is None:
+            return jsonify({"detail": "Could not load profile"}), 500
+
+        # Delete the old picture only if it predates content addressing; hashed files may be shared
+        old_filename = current_profile.get('picture_filename')
+        if old_filename and not PICTURE_KEY_RE.match(old_filename) and not PICTURE_FILE_RE.match(old_filename):
+            old_file_path = os.path.join(app.config['UPLOAD_FOLDER'], old_filename)
+            if os.path.exists(old_file_path):
+                try:
+                    os.remove(old_file_path)
+                    log.debug("Deleted old profile picture: %s", old_filename)
+                except OSError as e:
+                    log.error("Error deleting old file %s: %s", old_filename, e)
 
-            # Update filename in session
-            current_profile = session.get('profile', {})
-            current_profile['picture_filename'] = unique_filename
-            session['profile'] = current_profile
-            session.modified = True
-            print(f"DEBUG: Profile picture filename updated in session: {unique_filename}")
+        # Update filename in the user's profile
+        current_profile['picture_filename'] = unique_filename
+        save_profile(db, user_id, current_profile)
+        log.debug("Profile picture filename updated for user %s: %s", user_id, unique_filename)
 
-            return jsonify({"message": "Picture uploaded successfully", "filename": unique_filename})
+        return jsonify({"message": "Picture uploaded successfully", "filename": unique_filename,
+                        "urls": picture_urls(unique_filename)})
 
-        except Exception as e:
-            print(f"ERROR saving profile picture: {e}")
-            traceback.print_exc()
-            return jsonify({"detail": f"Could not save picture: {e}"}), 500
-    else:
-        return jsonify({"detail": "File type not allowed"}), 400
+    except Exception as e:
+        log.exception("Error saving profile picture: %s", e)
+        return jsonify({"detail": f"Could not save picture: {e}"}), 500
 
 # Serve uploaded files (needed for the <img> tag src)
 @app.route('/static/uploads/<filename>')
@@ -502,306 +2813,849 @@ def uploaded_file(filename):
           # Directory traversal attempt
           return "Not Found", 404
 
-     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+     if not PICTURE_FILE_RE.match(filename): # Legacy upload: may be replaced under the same name
+          return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+     picture_pipeline.wait(filename[:20]) # Thumbnail of an upload this process is still rendering
+     response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=PICTURE_CACHE_MAX_AGE)
+     response.headers['Cache-Control'] = f'public, max-age={PICTURE_CACHE_MAX_AGE}, immutable'
+     return response
 
 
 # --- Chatbot API Routes ---
-# ...(Existing /chat and /reset routes - /chat modified for DB logging, /reset unchanged)...
-@app.route('/chat', methods=['POST'])
-def chat_endpoint():
-    """Handles chat messages, logs mood/score to DB, and returns bot reply."""
+def run_chat_turn(user_message):
+    """Scores the message, picks the next question and updates the session.
+
+    Returns (bot_reply, mood, log_row). mood is the (detected mood, score, trajectory) that
+    mood_summary() turns into the rest of the /chat body. log_row is the (user_id, timestamp,
+    local_day, mood, score) row for log_chat_mood(), or None when there is nothing to log.
+    Both are left to the caller, so the streaming endpoint can send the reply first.
+    """
     if not session.get('initialized'):
-        print("ERROR: /chat called but session not initialized. Re-initializing.")
+        log.warning("/chat called but session not initialized. Re-initializing.")
+        user_id = session.get('user_id')
         session.clear(); session['initialized'] = True; session['current_mood_context'] = INITIAL
-        session['asked_mood_questions'] = {mood: [] for mood in question_banks.keys()}
-        session['asked_time_questions'] = []; session['conversation_scores'] = []
-        session.setdefault('profile', { 'name': 'User Name', 'age': None, 'weight': None, 'picture_filename': None })
+        if user_id is not None: session['user_id'] = user_id
+        session['asked_mood_questions'] = {mood: 0 for mood in question_banks.keys()}
+        session['asked_time_questions'] = {}; session['mood_trajectory'] = MoodTrajectory().to_state()
         session.modified = True
 
-    data = request.json
-    if data is None: return jsonify({"error": "Invalid request format"}), 400
-    user_message = data.get('message')
-
     current_mood_context = session.get('current_mood_context', INITIAL)
     # Ensure these session variables exist and have correct types
-    asked_mood_questions = session.setdefault('asked_mood_questions', {mood: [] for mood in question_banks.keys()})
-    asked_time_questions = session.setdefault('asked_time_questions', [])
-    conversation_scores = session.setdefault('conversation_scores', []) # Still keep for immediate avg? Optional.
-
-    if not isinstance(asked_mood_questions, dict): asked_mood_questions = {mood: [] for mood in question_banks.keys()}
-    for mood in question_banks.keys():
-        asked_mood_questions.setdefault(mood, [])
-    if not isinstance(asked_time_questions, list): asked_time_questions = []
-    if not isinstance(conversation_scores, list): conversation_scores = []
+    asked_mood_questions, asked_time_questions = get_asked_state() # {bank: bitmask}
+    trajectory = MoodTrajectory.from_state(session.get('mood_trajectory')) # This conversation's rolling statistics
 
     bot_reply = "Something went wrong."
     detected_mood_for_response = current_mood_context
     score_for_response = 0.0 # Initialize score
     next_mood_context_for_session = current_mood_context
+    log_row = None
+    local_now = datetime.now(get_current_timezone())
+    timestamp_utc = local_now.astimezone(timezone.utc).replace(tzinfo=None) # Same instant as local_now
 
-    try:
-        if user_message is not None: # Process user message
-            print(f"\n--- Processing User Message ---")
-            print(f"DEBUG: Received: '{user_message[:50]}...' | Current Context: {current_mood_context}")
+    if user_message is not None: # Process user message
+        log.debug("Received: '%.50s...' | Current Context: %s", user_message, current_mood_context)
 
+        with spans.span("sentiment"):
             detected_mood, score = get_mood_and_score(user_message)
-            detected_mood_for_response = detected_mood
-            score_for_response = score # Capture the score
+        detected_mood_for_response = detected_mood
+        score_for_response = score # Capture the score
 
-            print(f"SCORE_ACCESS: Score for this message: {score:.4f}")
-            conversation_scores.append(score) # Optional: keep session scores for other uses
+        log.debug("Score for this message: %.4f", score)
 
-            # --- Log to Database ---
-            db = get_db()
-            if db:
-                try:
-                    # Use UTC for database storage for consistency
-                    timestamp_utc = datetime.utcnow()
-                    # Convert to IST for logging message if needed, but store UTC
-                    # timestamp_ist = timestamp_utc.replace(tzinfo=pytz.utc).astimezone(pytz.timezone('Asia/Kolkata'))
-
-                    db.execute(
-                        'INSERT INTO mood_logs (timestamp, mood, score) VALUES (?, ?, ?)',
-                        (timestamp_utc, detected_mood, score) # Store UTC timestamp
-                    )
-                    db.commit()
-                    print(f"DB_LOG: Logged (UTC): {timestamp_utc.strftime('%Y-%m-%d %H:%M:%S')}, {detected_mood}, {score:.4f}")
-                except sqlite3.Error as e:
-                    print(f"ERROR: Failed to log mood to database: {e}")
-                    # Should we return an error to the user? Maybe not for logging failure.
-                finally:
-                    db.close()
-            else:
-                print("ERROR: Could not get DB connection for logging.")
-            # --- End Log to Database ---
-
-            print(f"DEBUG: Mood detected: {detected_mood}")
-            next_mood_context_for_session = detected_mood
-            if current_mood_context == SAD and detected_mood == HAPPY: next_mood_context_for_session = CALM
-            elif current_mood_context in [ANGRY, STRESSED] and detected_mood == HAPPY: next_mood_context_for_session = CALM
-
-            current_time = get_time_of_day_ist()
-            question, is_time, time_key = get_next_question(next_mood_context_for_session, current_time)
-            bot_reply = question
-            print(f"DEBUG: Selected Reply: '{bot_reply[:50]}...'")
-
-            # Update asked questions in session
-            if is_time and time_key:
-                 if (time_key, question) not in asked_time_questions: asked_time_questions.append((time_key, question))
-            else:
-                 context_to_mark = next_mood_context_for_session
-                 asked_mood_questions.setdefault(context_to_mark, []) # Ensure key exists
-                 if question not in asked_mood_questions[context_to_mark]: asked_mood_questions[context_to_mark].append(question)
-            print("--- End Processing User Message ---\n")
-
-        else: # Handle Initial Request (when message is null)
-            print("\n--- Processing Initial Request ---")
-            current_time = get_time_of_day_ist()
-            question, is_time, time_key = get_next_question(INITIAL, current_time)
-            bot_reply = question
-            detected_mood_for_response = INITIAL
-            score_for_response = 0.0 # No score for initial message
-            next_mood_context_for_session = INITIAL
-            print(f"DEBUG: Selected Initial Reply: '{bot_reply[:50]}...'")
-            # Update asked questions in session
-            if is_time and time_key:
-                 if (time_key, question) not in asked_time_questions: asked_time_questions.append((time_key, question))
-            else:
-                 asked_mood_questions.setdefault(INITIAL, []) # Ensure key exists
-                 if question not in asked_mood_questions[INITIAL]: asked_mood_questions[INITIAL].append(question)
-            print("--- End Initial Request ---\n")
-
-        # Update session state
-        session['current_mood_context'] = next_mood_context_for_session
-        session['asked_mood_questions'] = asked_mood_questions
-        session['asked_time_questions'] = asked_time_questions
-        session['conversation_scores'] = conversation_scores
-        session.modified = True
+        # --- Row for the database (UTC for consistency); the caller queues it ---
+        user_id = get_current_user_id()
+        if user_id is not None:
+            log_row = (user_id, timestamp_utc, local_now.date().isoformat(), detected_mood, score)
+        else:
+            log.error("Could not get a user for logging.")
+
+        log.debug("Mood detected: %s", detected_mood)
+        next_mood_context_for_session = choose_mood_context(trajectory, detected_mood)
+        trajectory.update(detected_mood, score)
 
-        # Return mood and score along with reply (frontend doesn't use this yet)
-        return jsonify({
-            "bot_reply": bot_reply,
-            "detected_mood": detected_mood_for_response,
-            "score": score_for_response
-        })
+        current_time = get_time_of_day(local_now)
+        selection_start = time.perf_counter()
+        question, is_time, time_key = get_next_question(next_mood_context_for_session, current_time)
+        bot_reply = question
+        log.debug("Selected Reply: '%.50s...'", bot_reply)
 
+        # Update asked questions in session
+        mark_question_asked(asked_mood_questions, asked_time_questions, next_mood_context_for_session, question, is_time, time_key)
+        spans.observe("question_selection", selection_start)
+
+    else: # Handle Initial Request (when message is null)
+        current_time = get_time_of_day(local_now)
+        selection_start = time.perf_counter()
+        question, is_time, time_key = get_next_question(INITIAL, current_time)
+        bot_reply = question
+        detected_mood_for_response = INITIAL
+        score_for_response = 0.0 # No score for initial message
+        next_mood_context_for_session = INITIAL
+        log.debug("Selected Initial Reply: '%.50s...'", bot_reply)
+        # Update asked questions in session
+        mark_question_asked(asked_mood_questions, asked_time_questions, INITIAL, question, is_time, time_key)
+        spans.observe("question_selection", selection_start)
+
+    # Update session state
+    session['current_mood_context'] = next_mood_context_for_session
+    session['asked_mood_questions'] = asked_mood_questions
+    session['asked_time_questions'] = asked_time_questions
+    session['mood_trajectory'] = trajectory.to_state()
+    session.pop('conversation_scores', None) # Replaced by mood_trajectory
+    session.modified = True
+
+    return bot_reply, (detected_mood_for_response, score_for_response, trajectory), log_row
+
+def mood_summary(mood):
+    """The detected_mood/score/trend part of a /chat body, from run_chat_turn's mood."""
+    detected_mood, score, trajectory = mood
+    return {"detected_mood": detected_mood, "score": score, "trend": trajectory.trend()}
+
+def log_chat_mood(log_row):
+    """Queues a row from run_chat_turn on the write-behind logger (the rollup trigger runs on flush)."""
+    user_id, timestamp_utc, day, mood, score = log_row
+    mood_log_writer.enqueue(user_id, timestamp_utc, day, mood, score)
+    log.debug("Queued mood log (UTC): %s (local day %s), user %s, %s, %.4f", timestamp_utc, day, user_id, mood, score)
+
+def chat_error_response(e):
+    log.exception("Error in /chat: %s: %s", type(e).__name__, e)
+    session.modified = True # Still try to save session if possible
+    return jsonify({"error": f"Internal error: {type(e).__name__}.", "bot_reply": "Oops! My circuits are tangled."}), 500
+
+@app.route('/chat', methods=['POST'])
+def chat_endpoint():
+    """Handles chat messages, logs mood/score to DB, and returns bot reply."""
+    data = request.json
+    if data is None: return jsonify({"error": "Invalid request format"}), 400
+    try:
+        bot_reply, mood, log_row = run_chat_turn(data.get('message'))
+    except Exception as e:
+        return chat_error_response(e)
+    if log_row is not None: log_chat_mood(log_row) # Write-behind: the reply doesn't wait for the INSERT
+    # Return mood and score along with reply (frontend doesn't use this yet)
+    return jsonify({"bot_reply": bot_reply, **mood_summary(mood)})
+
+def sse_event(event, data):
+    """One server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream_endpoint():
+    """/chat as server-sent events. Only scoring and question selection run before the
+    `reply` event; the `mood` event (trend) is built after it, and the mood row is queued
+    once the response is closed. Its batch write updates the rollup and drops cached history.
+
+    The session is saved when the view returns, before the body starts, so every session
+    change (asked questions, mood context, trajectory) is made in run_chat_turn.
+    """
+    data = request.get_json(silent=True)
+    if data is None: return jsonify({"error": "Invalid request format"}), 400
+    try:
+        bot_reply, mood, log_row = run_chat_turn(data.get('message'))
     except Exception as e:
-        print("\n!!!!!!!!!!!!!! ERROR in /chat !!!!!!!!!!!!!!")
-        print(f"Error Type: {type(e).__name__}: {e}")
-        traceback.print_exc()
-        print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\n")
-        session.modified = True # Still try to save session if possible
-        return jsonify({"error": f"Internal error: {type(e).__name__}.", "bot_reply": "Oops! My circuits are tangled."}), 500
+        return chat_error_response(e)
 
+    def events():
+        yield sse_event("reply", {"bot_reply": bot_reply})
+        yield sse_event("mood", mood_summary(mood))
+        yield sse_event("done", {})
+
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}) # No proxy buffering
+    if log_row is not None: response.call_on_close(lambda: log_chat_mood(log_row))
+    return response
 
 @app.route('/reset', methods=['POST'])
 def reset_session():
     """Clears the session and provides a new initial question."""
-    print("DEBUG (Backend /reset): Resetting session.")
-    profile_data = session.get('profile', None) # Preserve profile
-    session.clear() # Clears everything including profile
+    log.debug("/reset: Resetting session.")
+    user_id = session.get('user_id') # Preserve the user (and so the profile and mood history)
+    session.clear() # Clears everything including the user id
     # Re-initialize essential session keys after clearing
     session['initialized'] = True; session['current_mood_context'] = INITIAL
-    session['asked_mood_questions'] = {mood: [] for mood in question_banks.keys()}
-    session['asked_time_questions'] = []; session['conversation_scores'] = []
-    # Restore or re-initialize profile data
-    if profile_data:
-        session['profile'] = profile_data
-    else:
-         session.setdefault('profile', { 'name': 'User Name', 'age': None, 'weight': None, 'picture_filename': None })
+    session['asked_mood_questions'] = {mood: 0 for mood in question_banks.keys()}
+    session['asked_time_questions'] = {}; session['mood_trajectory'] = MoodTrajectory().to_state()
+    if user_id is not None:
+        session['user_id'] = user_id
 
     initial_question = "Okay, let's start over. How are you feeling now?"
     try:
-        current_time = get_time_of_day_ist()
+        current_time = get_time_of_day()
         question, is_time, time_key = get_next_question(INITIAL, current_time)
         initial_question = question
         # Update asked questions in session
-        if is_time and time_key:
-             if (time_key, question) not in session['asked_time_questions']: session['asked_time_questions'].append((time_key, question))
-        else:
-             session['asked_mood_questions'].setdefault(INITIAL, [])
-             if question not in session['asked_mood_questions'][INITIAL]: session['asked_mood_questions'][INITIAL].append(question)
+        mark_question_asked(session['asked_mood_questions'], session['asked_time_questions'], INITIAL, question, is_time, time_key)
         session.modified = True
         return jsonify({"status": "success", "initial_message": initial_question})
     except Exception as e:
-         print(f"ERROR during session reset's get_next_question: {e}")
-         traceback.print_exc()
+         log.exception("Error during session reset's get_next_question: %s", e)
          session.modified = True
          return jsonify({"status": "error", "message": "Failed to get new question after reset."}), 500
 
 
+# --- Readiness API ---
+@app.route('/api/ready', methods=['GET'])
+def readiness():
+    """200 once the VADER analyzer is loaded; 503 while scoring still uses the keyword fallback."""
+    if nltk_status == "pending" and NLTK_WARMUP: start_nltk_warmup()
+    ready = analyzer is not None
+    body = {"ready": ready, "nltk": nltk_status, "scorer": "vader" if ready else "keyword-fallback",
+            "punkt": punkt_available}
+    return jsonify(body), 200 if ready else 503
+
+
+# --- Sentiment Cache Metrics API ---
+@app.route('/api/metrics/sentiment_cache', methods=['GET'])
+def sentiment_cache_metrics():
+    """Hit, miss and eviction counters for the sentiment result cache."""
+    return jsonify(sentiment_cache.stats())
+
+
+# --- Mood Logger Metrics API ---
+@app.route('/api/metrics/mood_logger', methods=['GET'])
+def mood_logger_metrics():
+    """Queue depth, flush latency and row counters for the write-behind mood logger."""
+    return jsonify(mood_log_writer.stats())
+
+
+# --- Scoring Pool Metrics API ---
+@app.route('/api/metrics/scoring_pool', methods=['GET'])
+def scoring_pool_metrics():
+    """Worker count, call counters and fallbacks (rejected, timeouts, errors) of the scoring pool."""
+    return jsonify(scoring_pool.stats())
+
+
+# --- Prometheus Metrics ---
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Span and request latency histograms plus the component gauges, in Prometheus text format."""
+    lines = render_histograms("moodbot_span_seconds", "span", spans, "Time spent in hot-path stages.")
+    lines += render_histograms("moodbot_request_seconds", "endpoint", request_latency, "Request handling time by route.")
+    lines += render_gauges("moodbot_mood_logger", mood_log_writer.stats())
+    lines += render_gauges("moodbot_sentiment_cache", sentiment_cache.stats())
+    lines += render_gauges("moodbot_scoring_pool", scoring_pool.stats())
+    lines += render_gauges("moodbot_db_pool", db_pool.stats())
+    lines += render_gauges("moodbot_response_cache", response_cache.stats())
+    lines += render_gauges("moodbot_picture_pipeline", picture_pipeline.stats())
+    lines += render_gauges("moodbot_scoring_admission", scoring_admission.stats())
+    if rate_limiter is not None: lines += render_gauges("moodbot_rate_limiter", rate_limiter.stats())
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+# --- Batch Analysis API ---
+MAX_ANALYZE_BATCH_SIZE = 5000
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Scores a list of messages in one call (imports, re-scoring). Nothing is logged to the database."""
+    data = request.json
+    messages = data.get('messages') if isinstance(data, dict) else None
+    if not isinstance(messages, list):
+        return jsonify({"error": "Expected a JSON body with a 'messages' list"}), 400
+    if len(messages) > MAX_ANALYZE_BATCH_SIZE:
+        return jsonify({"error": f"Too many messages (max {MAX_ANALYZE_BATCH_SIZE} per batch)"}), 400
+    if not all(isinstance(m, str) for m in messages):
+        return jsonify({"error": "Every message must be a string"}), 400
+
+    try:
+        with spans.span("sentiment_batch"):
+            results = get_moods_and_scores_batch(messages)
+    except Exception as e:
+        log.exception("Error in /api/analyze/batch: %s: %s", type(e).__name__, e)
+        return jsonify({"error": f"Internal error: {type(e).__name__}."}), 500
+
+    return jsonify({
+        "count": len(results),
+        "results": [{"mood": mood, "score": score} for mood, score in results]
+    })
+
+
+# --- Conditional Responses ---
+class ResponseCache:
+    """Per-user LRU of JSON payloads built by the history and daily quote endpoints.
+
+    Each payload is stored under a key such as ("history", days) together with the ETag
+    it was built for; get() only returns it while the ETag still matches, so a mood_logs
+    insert from any worker (which bumps users.log_version) or a new day makes it a miss.
+    Rows written by this process also drop the user's entries right away.
+    """
+
+    def __init__(self, max_users=RESPONSE_CACHE_USERS):
+        self.max_users = max_users
+        self._lru = OrderedDict() # user_id -> {key: (etag, payload)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id, key, etag):
+        with self._lock:
+            entry = self._lru.get(user_id, {}).get(key)
+            if entry is not None and entry[0] == etag:
+                self._lru.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, user_id, key, etag, payload):
+        if not self.max_users:
+            return
+        with self._lock:
+            entries = self._lru.setdefault(user_id, {})
+            entries.pop(key, None)
+            entries[key] = (etag, payload)
+            while len(entries) > RESPONSE_CACHE_KEYS_PER_USER: # e.g. many distinct ranges
+                del entries[next(iter(entries))]
+            self._lru.move_to_end(user_id)
+            while len(self._lru) > self.max_users:
+                self._lru.popitem(last=False)
+
+    def invalidate_users(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                if self._lru.pop(user_id, None) is not None:
+                    self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._lru),
+                "max_users": self.max_users,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+response_cache = ResponseCache()
+
+def get_log_validators(db, user_id):
+    """(log_version, logs_modified) of user_id; see _create_log_version_trigger."""
+    row = db.execute("SELECT log_version, logs_modified FROM users WHERE id = ?", (user_id,)).fetchone()
+    return (row['log_version'], row['logs_modified']) if row else (0, None)
+
+def cached_json_response(db, user_id, key, day, tz, build):
+    """JSON response for build() with ETag/Last-Modified, or 304 if the client's copy is current.
+
+    The payload depends only on the user's logs and their local day (a date, in tz), so all
+    of these go into the ETag.
+    build() returns (payload, cacheable); payloads built after a database error are sent
+    without validators and not cached.
+    """
+    try:
+        log_version, logs_modified = get_log_validators(db, user_id)
+    except sqlite3.Error as e:
+        log.error("Error reading log version: %s", e)
+        payload, _ = build()
+        return jsonify(payload)
+    etag = "-".join(str(part) for part in (user_id, log_version, tz.key, day) + key)
+    last_modified = datetime.fromtimestamp(max(logs_modified or 0, local_day_start(day, tz)), timezone.utc)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        payload = response_cache.get(user_id, key, etag)
+        if payload is None:
+            payload, cacheable = build()
+            if not cacheable:
+                return jsonify(payload)
+            response_cache.put(user_id, key, etag, payload)
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache' # Revalidate every time; usually a 304
+    return response
+
+
 # --- Mood History API (with Dummy Data) ---
+# Days are the user's local days, stored with each row. History reads at most one
+# mood_daily_agg row per day; the latest-mood lookup is an equality seek into idx_mood_logs_user_day.
+MOOD_HISTORY_SQL = "SELECT day, count, score_sum FROM mood_daily_agg WHERE user_id = ? AND day >= ? AND day <= ?"
+LATEST_MOOD_SQL = ("SELECT mood FROM mood_logs WHERE user_id = ? AND local_day = ? "
+                   "ORDER BY ts DESC, id DESC LIMIT 1")
+
 @app.route('/api/mood_history', methods=['GET'])
 def get_mood_history():
     """API endpoint to fetch mood data for the chart, includes dummy data if needed."""
-    days = request.args.get('days', 7, type=int)
-    # Use UTC for date calculations to match database storage
-    end_date_utc = datetime.utcnow()
-    start_date_utc = end_date_utc - timedelta(days=days -1) # Include today
+    days = min(max(request.args.get('days', 7, type=int), 1), MAX_HISTORY_DAYS)
+    # Dates are in the user's time zone, like the local_day keys of the rollup
+    tz = get_current_timezone()
+    end_date = datetime.now(tz).date()
+    start_date = end_date - timedelta(days=days -1) # Include today
+    today = end_date.isoformat()
+
+    mood_log_writer.flush() # Make this session's queued rows visible
+    db = get_db()
+    user_id = get_current_user_id()
+    if not db or user_id is None:
+        return jsonify({"error": "Database connection failed"}), 500
 
+    def build():
+        daily_rows = []
+        cacheable = True
+        try:
+            cursor = db.cursor()
+            cursor.execute(MOOD_HISTORY_SQL, (user_id, start_date.isoformat(), today))
+            daily_rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            log.error("Error fetching mood history: %s", e)
+            cacheable = False
+            # Don't return error yet, try generating dummy data
+
+        # --- Process data: Daily average from the rollup ---
+        daily_averages = {row['day']: row['score_sum'] / row['count'] for row in daily_rows} # Key: 'YYYY-MM-DD'
+
+        chart_labels = []
+        chart_values = []
+        has_real_data = bool(daily_rows) # Flag to know if we used real data
+        dummy_random = random.Random(f"{user_id}:{today}:{days}") # Same dummy chart all day, so the ETag holds
+
+        # Generate labels and values for the specified range
+        current_date = start_date
+        while current_date <= end_date:
+            day_str = current_date.isoformat()
+            chart_labels.append(day_str)
+            if day_str in daily_averages:
+                chart_values.append(round(daily_averages[day_str], 2))
+            else:
+                # If no real data exists at all for the period, add dummy data
+                if not has_real_data:
+                     # Generate somewhat random dummy score between -0.8 and 0.8
+                     dummy_score = round(dummy_random.uniform(-0.8, 0.8), 2)
+                     chart_values.append(dummy_score)
+                else:
+                    # If there's some real data, but not for this day, use null
+                    chart_values.append(None)
+            current_date += timedelta(days=1)
+
+        # Data formatted for Chart.js
+        return {
+            "labels": chart_labels,
+            "scores": chart_values,
+            "has_real_data": has_real_data # Indicate if dummy data was used
+        }, cacheable
+
+    return cached_json_response(db, user_id, ("history", days), end_date, tz, build)
+
+
+# --- Range History API ---
+# Buckets are aggregated in SQL: hours from mood_logs (a range scan of idx_mood_logs_user_ts),
+# days, weeks (starting Monday) and months from the mood_daily_agg rollup. All of them are
+# in the user's time zone: hours are aligned to its UTC offset (which matters for zones such
+# as +05:30) and rollup days are local days. Values are (approximate bucket seconds, bucket
+# expression), finest first.
+HISTORY_RESOLUTIONS = OrderedDict([
+    ("hour", (3600, "ts - (ts + {utc_offset}) % 3600")),
+    ("day", (86400, "day")),
+    ("week", (7 * 86400, "date(day, '-6 days', 'weekday 1')")),
+    ("month", (30 * 86400, "substr(day, 1, 7) || '-01'")),
+])
+HOURLY_HISTORY_SQL = ("SELECT {bucket} AS bucket, COUNT(*) AS count, SUM(score) AS score_sum, "
+                      "MIN(score) AS score_min, MAX(score) AS score_max "
+                      "FROM mood_logs WHERE user_id = ? AND ts >= ? AND ts < ? GROUP BY bucket ORDER BY bucket")
+ROLLUP_HISTORY_SQL = ("SELECT {bucket} AS bucket, SUM(count) AS count, SUM(score_sum) AS score_sum, "
+                      "MIN(score_min) AS score_min, MAX(score_max) AS score_max "
+                      "FROM mood_daily_agg WHERE user_id = ? AND day >= ? AND day <= ? GROUP BY bucket ORDER BY bucket")
+
+def parse_day_arg(name, default):
+    """The YYYY-MM-DD query argument name (or default) as a date clamped to MIN_QUERY_DAY..MAX_QUERY_DAY;
+    raises ValueError if it is malformed."""
+    value = request.args.get(name)
+    day = default
+    if value:
+        try:
+            day = datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError(f"'{name}' must be a date (YYYY-MM-DD)") from None
+    return min(max(day, MIN_QUERY_DAY), MAX_QUERY_DAY)
+
+def parse_log_range_args(tz):
+    """(first_ts, end_ts) epoch bounds of the start..end local days (default: everything up to
+    today) for the raw log and export endpoints; end_ts is exclusive. Raises ValueError."""
+    end_day = parse_day_arg('end', datetime.now(tz).date())
+    start_day = parse_day_arg('start', MIN_QUERY_DAY)
+    return local_day_start(start_day, tz), local_day_start(end_day + timedelta(days=1), tz)
+
+def choose_history_resolution(requested, start_day, end_day, max_points):
+    """The requested resolution, or the next coarser one whose bucket count fits max_points.
+
+    "auto" starts from the finest resolution. Months are the coarsest and always accepted.
+    """
+    names = list(HISTORY_RESOLUTIONS)
+    span_seconds = ((end_day - start_day).days + 1) * 86400
+    for name in names[names.index(requested) if requested != "auto" else 0:]:
+        if span_seconds / HISTORY_RESOLUTIONS[name][0] <= max_points:
+            return name
+    return names[-1]
+
+@app.route('/api/mood_history/range', methods=['GET'])
+def get_mood_history_range():
+    """Mood averages between start and end (inclusive local days) at hour/day/week/month resolution.
+
+    Only buckets with data are returned. Ranges that would exceed max_points buckets are
+    served at a coarser resolution; the response says which one was used.
+    """
+    tz = get_current_timezone()
+    today = datetime.now(tz).date()
+    try:
+        end_day = parse_day_arg('end', today)
+        start_day = parse_day_arg('start', end_day - timedelta(days=29))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if start_day > end_day:
+        return jsonify({"error": "'start' must not be after 'end'"}), 400
+    requested = request.args.get('resolution', 'auto')
+    if requested != "auto" and requested not in HISTORY_RESOLUTIONS:
+        return jsonify({"error": f"'resolution' must be auto or one of {', '.join(HISTORY_RESOLUTIONS)}"}), 400
+    max_points = min(max(request.args.get('max_points', MAX_HISTORY_POINTS, type=int), 1), MAX_HISTORY_POINTS)
+    resolution = choose_history_resolution(requested, start_day, end_day, max_points)
+
+    mood_log_writer.flush() # Make this session's queued rows visible
     db = get_db()
-    if not db:
+    user_id = get_current_user_id()
+    if not db or user_id is None:
         return jsonify({"error": "Database connection failed"}), 500
 
-    logs = []
+    def build():
+        utc_offset = int(datetime.now(tz).utcoffset().total_seconds())
+        bucket = HISTORY_RESOLUTIONS[resolution][1].format(utc_offset=utc_offset)
+        try:
+            if resolution == "hour":
+                first_ts = local_day_start(start_day, tz)
+                end_ts = local_day_start(end_day + timedelta(days=1), tz) # Exclusive
+                rows = db.execute(HOURLY_HISTORY_SQL.format(bucket=bucket), (user_id, first_ts, end_ts)).fetchall()
+            else:
+                rows = db.execute(ROLLUP_HISTORY_SQL.format(bucket=bucket),
+                                  (user_id, start_day.isoformat(), end_day.isoformat())).fetchall()
+        except sqlite3.Error as e:
+            log.error("Error fetching mood history range: %s", e)
+            return {"error": "Could not read mood history"}, False
+        if resolution == "hour":
+            labels = [datetime.fromtimestamp(row['bucket'], tz).strftime('%Y-%m-%dT%H:%M') for row in rows]
+        else:
+            labels = [row['bucket'] for row in rows]
+        return {
+            "start": start_day.isoformat(),
+            "end": end_day.isoformat(),
+            "resolution": resolution,
+            "timezone": tz.key,
+            "labels": labels, # Bucket start (local): hour, day, week (Monday) or month (first day)
+            "scores": [round(row['score_sum'] / row['count'], 4) for row in rows],
+            "counts": [row['count'] for row in rows],
+            "min": [row['score_min'] for row in rows],
+            "max": [row['score_max'] for row in rows],
+        }, True
+
+    key = ("range", start_day, end_day, resolution)
+    return cached_json_response(db, user_id, key, today, tz, build)
+
+
+# --- Raw Mood Logs API ---
+# Keyset pagination, newest first: the cursor is the (ts, id) of the last row sent, so every
+# page is one range scan of idx_mood_logs_user_ts (which also holds the rowid) however deep it is.
+MOOD_LOGS_PAGE_SQL = ("SELECT id, ts, mood, score FROM mood_logs WHERE user_id = ? AND ts >= ? AND ts < ? "
+                      "ORDER BY ts DESC, id DESC LIMIT ?")
+MOOD_LOGS_AFTER_CURSOR_SQL = ("SELECT id, ts, mood, score FROM mood_logs WHERE user_id = ? AND ts >= ? "
+                              "AND (ts < ? OR (ts = ? AND id < ?)) ORDER BY ts DESC, id DESC LIMIT ?")
+
+@app.route('/api/mood_logs', methods=['GET'])
+def get_mood_logs():
+    """One page of this user's mood log rows between start and end (inclusive local days), newest first.
+
+    Pass the returned next_cursor as ?cursor= to get the following page; it is null on the last one.
+    """
     try:
-        cursor = db.cursor()
-        cursor.execute(
-            "SELECT timestamp, score FROM mood_logs WHERE date(timestamp) >= date(?) AND date(timestamp) <= date(?) ORDER BY timestamp ASC",
-             (start_date_utc.strftime('%Y-%m-%d'), end_date_utc.strftime('%Y-%m-%d')) # Compare dates only
-        )
-        logs = cursor.fetchall()
-    except sqlite3.Error as e:
-        print(f"Error fetching mood history: {e}")
-        # Don't return error yet, try generating dummy data
-    finally:
-        if db:
-            db.close()
+        first_ts, end_ts = parse_log_range_args(get_current_timezone())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    limit = min(max(request.args.get('limit', 100, type=int), 1), MAX_MOOD_LOGS_PAGE)
+    cursor_arg = request.args.get('cursor')
+    if cursor_arg:
+        try:
+            cursor_ts, cursor_id = (int(part) for part in cursor_arg.split(':'))
+            if not (-2**63 <= cursor_ts < 2**63 and -2**63 <= cursor_id < 2**63): # SQLite INTEGER range
+                raise ValueError(cursor_arg)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
 
-    # --- Process data: Calculate daily average ---
-    daily_scores = {} # Key: 'YYYY-MM-DD', Value: list of scores
-    if logs:
-        for log in logs:
-            ts_str = log['timestamp']
-            try:
-                # Timestamps stored as UTC TEXT 'YYYY-MM-DD HH:MM:SS.ffffff'
-                ts_utc = datetime.strptime(ts_str.split('.')[0], '%Y-%m-%d %H:%M:%S')
-                day_str = ts_utc.strftime('%Y-%m-%d')
-                if day_str not in daily_scores:
-                    daily_scores[day_str] = []
-                daily_scores[day_str].append(log['score'])
-            except (ValueError, TypeError) as parse_err:
-                 print(f"Warning: Could not parse timestamp '{ts_str}'. Skipping log. Error: {parse_err}")
-                 continue
-
-    chart_labels = []
-    chart_values = []
-    has_real_data = bool(logs) # Flag to know if we used real data
-
-    # Generate labels and values for the specified range
-    current_date_utc = start_date_utc
-    while current_date_utc.date() <= end_date_utc.date():
-        day_str = current_date_utc.strftime('%Y-%m-%d')
-        chart_labels.append(day_str)
-        if day_str in daily_scores:
-            avg_score = statistics.mean(daily_scores[day_str])
-            chart_values.append(round(avg_score, 2))
+    mood_log_writer.flush() # Make this session's queued rows visible
+    db = get_db()
+    user_id = get_current_user_id()
+    if not db or user_id is None:
+        return jsonify({"error": "Database connection failed"}), 500
+    try:
+        if cursor_arg:
+            rows = db.execute(MOOD_LOGS_AFTER_CURSOR_SQL,
+                              (user_id, first_ts, cursor_ts, cursor_ts, cursor_id, limit + 1)).fetchall()
         else:
-            # If no real data exists at all for the period, add dummy data
-            if not has_real_data:
-                 # Generate somewhat random dummy score between -0.8 and 0.8
-                 dummy_score = round(random.uniform(-0.8, 0.8), 2)
-                 chart_values.append(dummy_score)
-            else:
-                # If there's some real data, but not for this day, use null
-                chart_values.append(None)
-        current_date_utc += timedelta(days=1)
+            rows = db.execute(MOOD_LOGS_PAGE_SQL, (user_id, first_ts, end_ts, limit + 1)).fetchall()
+    except sqlite3.Error as e:
+        log.error("Error fetching mood logs: %s", e)
+        return jsonify({"error": "Could not read mood logs"}), 500
 
-    # Return data formatted for Chart.js
+    page = rows[:limit] # The extra row only tells whether there is a next page
+    next_cursor = f"{page[-1]['ts']}:{page[-1]['id']}" if len(rows) > limit else None
     return jsonify({
-        "labels": chart_labels,
-        "scores": chart_values,
-        "has_real_data": has_real_data # Indicate if dummy data was used
+        "logs": [{"id": row['id'], "timestamp": utc_isoformat(row['ts']),
+                  "mood": row['mood'], "score": row['score']} for row in page],
+        "next_cursor": next_cursor,
     })
 
 
+# --- Export / Import ---
+EXPORT_SQL = ("SELECT id, ts, mood, score FROM mood_logs WHERE user_id = ? AND ts >= ? AND ts < ? "
+              "ORDER BY ts, id")
+EXPORT_COLUMNS = ('id', 'timestamp', 'mood', 'score')
+EXPORT_NDJSON_LINE = '{"id": %d, "timestamp": "%s", "mood": %s, "score": %r}\n' # Same as json.dumps, without a dict per row
+
+def iter_mood_log_export(user_id, first_ts, end_ts, fmt):
+    """Yields the user's rows as CSV or NDJSON text, EXPORT_FETCH_ROWS rows per chunk.
+
+    Runs after the request has returned, so it holds its own pooled connection. The SQLite
+    cursor steps through the index as rows are fetched; only one chunk is in memory.
+    """
+    with db_pool.connection() as db:
+        cursor = db.execute(EXPORT_SQL, (user_id, first_ts, end_ts))
+        try:
+            if fmt == 'csv':
+                yield ",".join(EXPORT_COLUMNS) + "\r\n"
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_ROWS)
+                if not rows:
+                    break
+                if fmt == 'csv':
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows((row['id'], utc_isoformat(row['ts']),
+                                                  row['mood'], row['score']) for row in rows)
+                    yield buffer.getvalue()
+                else:
+                    yield "".join(EXPORT_NDJSON_LINE % (row['id'], utc_isoformat(row['ts']),
+                                                        json.dumps(row['mood']), row['score']) for row in rows)
+        finally:
+            cursor.close() # Also when the client disconnects mid-stream
+
+@app.route('/api/mood_logs/export', methods=['GET'])
+def export_mood_logs():
+    """Streams this user's mood logs between start and end (inclusive local days) as CSV or NDJSON."""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "'format' must be csv or ndjson"}), 400
+    try:
+        first_ts, end_ts = parse_log_range_args(get_current_timezone())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    mood_log_writer.flush() # Make this session's queued rows visible
+    user_id = get_current_user_id()
+    if user_id is None:
+        return jsonify({"error": "Database connection failed"}), 500
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(iter_mood_log_export(user_id, first_ts, end_ts, fmt), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="mood_logs.{fmt}"'
+    return response
+
+def parse_import_row(record, score_text):
+    """(ts, mood, score, text) from one NDJSON record; raises ValueError if it is unusable.
+
+    The timestamp is "ts" (epoch seconds) or "timestamp" (ISO 8601, UTC unless it has an
+    offset), as written by the export. With score_text, records with a "text" field are
+    scored and their mood/score fields ignored; the text itself is never stored.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("not a JSON object")
+    if 'ts' in record:
+        ts = record['ts']
+        if isinstance(ts, bool) or not isinstance(ts, (int, float)) or not math.isfinite(ts):
+            raise ValueError("'ts' must be epoch seconds")
+        ts = int(ts)
+    elif isinstance(record.get('timestamp'), str):
+        moment = datetime.fromisoformat(record['timestamp']) # ValueError if malformed
+        try:
+            ts = int(moment.timestamp()) if moment.tzinfo else to_epoch(moment)
+        except (OverflowError, OSError):
+            raise ValueError("'timestamp' is out of range") from None
+    else:
+        raise ValueError("missing 'ts' or 'timestamp'")
+    if not 0 <= ts <= IMPORT_MAX_TS:
+        raise ValueError("timestamp must be between 1970 and 9999")
+    text = record.get('text')
+    if score_text and isinstance(text, str):
+        return ts, None, None, text
+    mood, score = record.get('mood'), record.get('score')
+    if mood not in KEYWORD_MOODS:
+        raise ValueError(f"'mood' must be one of {', '.join(KEYWORD_MOODS)}")
+    if isinstance(score, bool) or not isinstance(score, (int, float)) or not -1.0 <= score <= 1.0:
+        raise ValueError("'score' must be a number between -1 and 1")
+    return ts, mood, float(score), None
+
+def import_mood_logs(db, lines, user_id, tz, score_text=False, max_errors=20):
+    """Inserts NDJSON mood log lines for user_id, IMPORT_CHUNK_ROWS per transaction.
+
+    Each row's local_day is computed in tz, the user's time zone.
+    Texts in a chunk are scored together with get_moods_and_scores_batch. Bad lines are
+    skipped and the first max_errors are reported by line number. Returns a stats dict.
+    """
+    start = time.perf_counter()
+    imported = skipped = scored = 0
+    errors = []
+    numbered = enumerate(lines, 1)
+    while True:
+        chunk = list(itertools.islice(numbered, IMPORT_CHUNK_ROWS))
+        if not chunk:
+            break
+        rows = []
+        to_score = [] # (index in rows, text)
+        for line_no, line in chunk:
+            if not line.strip():
+                continue
+            try:
+                ts, mood, score, text = parse_import_row(json.loads(line), score_text)
+                day = local_day(ts, tz)
+            except (ValueError, OverflowError, OSError) as e: # json.JSONDecodeError is a ValueError too
+                skipped += 1
+                if len(errors) < max_errors:
+                    errors.append({"line": line_no, "error": str(e)})
+                continue
+            if text is not None:
+                to_score.append((len(rows), text))
+            rows.append([user_id, ts, day, mood, score])
+        if to_score:
+            with spans.span("sentiment_batch"):
+                results = get_moods_and_scores_batch([text for _, text in to_score])
+            for (i, _), (mood, score) in zip(to_score, results):
+                rows[i][3], rows[i][4] = mood, score
+            scored += len(to_score)
+        with db: # One transaction per chunk; the rollup and log version triggers run inside it
+            db.executemany(MoodLogWriter.INSERT_SQL, rows)
+        imported += len(rows)
+    with db: # Imported rows may predate logged ones, so replay the user's logs in time order
+        rebuild_mood_trajectories(db, [user_id])
+    response_cache.invalidate_users([user_id])
+    seconds = time.perf_counter() - start
+    return {
+        "imported": imported,
+        "scored": scored,
+        "skipped": skipped,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(imported / seconds, 1) if seconds else 0.0,
+    }
+
+@app.route('/api/mood_logs/import', methods=['POST'])
+def import_mood_logs_endpoint():
+    """Bulk-inserts an NDJSON body (one mood log per line) for this user; ?score=1 scores "text" fields."""
+    request.max_content_length = IMPORT_MAX_BYTES # Above the app-wide upload limit
+    db = get_db()
+    user_id = get_current_user_id()
+    if not db or user_id is None:
+        return jsonify({"error": "Database connection failed"}), 500
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8', errors='replace')
+    try:
+        stats = import_mood_logs(db, lines, user_id, get_current_timezone(), score_text=request.args.get('score') == '1')
+    except sqlite3.Error as e:
+        log.error("Error importing mood logs: %s", e)
+        return jsonify({"error": "Import failed; rows of the current chunk were rolled back"}), 500
+    log.info("Imported %d mood log row(s) for user %s (%.1f rows/s)", stats['imported'], user_id, stats['rows_per_sec'])
+    return jsonify(stats)
+
+@app.cli.command('import-mood-logs')
+@click.argument('path', type=click.File('r', encoding='utf-8'))
+@click.option('--user-id', type=int, help='User to import for; a new user is created if omitted.')
+@click.option('--score', is_flag=True, help='Score "text" fields with the sentiment analyzer.')
+def import_mood_logs_command(path, user_id, score):
+    """Imports an NDJSON file of mood logs (PATH may be - for stdin)."""
+    if score and not wait_for_nltk():
+        print("Warning: VADER is unavailable; texts are scored with keywords only.")
+    with db_pool.connection() as db:
+        apply_migrations(db)
+        if user_id is None:
+            user_id = create_user(db)
+        stats = import_mood_logs(db, path, user_id, get_tz(load_user_timezone(db, user_id)), score_text=score)
+    print(f"Imported {stats['imported']} row(s) for user {user_id} in {stats['seconds']}s "
+          f"({stats['rows_per_sec']} rows/s); {stats['scored']} scored, {stats['skipped']} skipped.")
+    for error in stats['errors']:
+        print(f"  line {error['line']}: {error['error']}")
+
+
 # --- Daily Quote API ---
 @app.route('/api/daily_quote', methods=['GET'])
 def get_daily_quote():
-    """Provides a quote based on the latest mood entry for today."""
-    today_start_utc = datetime.combine(datetime.utcnow().date(), datetime.min.time())
-    today_end_utc = datetime.combine(datetime.utcnow().date(), datetime.max.time())
+    """Provides a quote based on the latest mood entry for today, the same one all day per mood."""
+    tz = get_current_timezone()
+    today = datetime.now(tz).date() # The user's day, matching mood_logs.local_day
 
+    mood_log_writer.flush() # Make this session's queued rows visible
     db = get_db()
-    if not db:
+    user_id = get_current_user_id()
+    if not db or user_id is None:
         # Fallback to general quote if DB fails
         return jsonify({"quote": random.choice(QUOTES["general"])})
 
-    latest_mood = None
-    try:
-        cursor = db.cursor()
-        # Get the mood from the most recent entry today
-        cursor.execute(
-            """
-            SELECT mood FROM mood_logs
-            WHERE timestamp >= ? AND timestamp <= ?
-            ORDER BY timestamp DESC
-            LIMIT 1
-            """,
-            (today_start_utc, today_end_utc)
-        )
-        result = cursor.fetchone()
-        if result:
-            latest_mood = result['mood']
-    except sqlite3.Error as e:
-        print(f"Error fetching latest mood for quote: {e}")
-        # Fallback to general quote on error
-    finally:
-        if db:
-            db.close()
-
-    quote = ""
-    if latest_mood == HAPPY:
-        quote = random.choice(QUOTES["positive"])
-    elif latest_mood == SAD or latest_mood == ANGRY or latest_mood == STRESSED:
-        quote = random.choice(QUOTES["uplifting"])
-    elif latest_mood == CALM:
-         quote = random.choice(QUOTES["calm"])
-    else: # No mood found for today or error occurred
-        quote = random.choice(QUOTES["general"])
-
-    return jsonify({"quote": quote})
+    def build():
+        latest_mood = None
+        cacheable = True
+        try:
+            cursor = db.cursor()
+            # Get the mood from the most recent entry today
+            cursor.execute(LATEST_MOOD_SQL, (user_id, today.isoformat()))
+            result = cursor.fetchone()
+            if result:
+                latest_mood = result['mood']
+        except sqlite3.Error as e:
+            log.error("Error fetching latest mood for quote: %s", e)
+            cacheable = False
+            # Fallback to general quote on error
+
+        if latest_mood == HAPPY:
+            quotes = QUOTES["positive"]
+        elif latest_mood == SAD or latest_mood == ANGRY or latest_mood == STRESSED:
+            quotes = QUOTES["uplifting"]
+        elif latest_mood == CALM:
+            quotes = QUOTES["calm"]
+        else: # No mood found for today or error occurred
+            quotes = QUOTES["general"]
+        # Seeded by user and day: reloading the page doesn't re-roll the quote
+        return {"quote": random.Random(f"{user_id}:{today}").choice(quotes)}, cacheable
+
+    return cached_json_response(db, user_id, ("quote",), today, tz, build)
+
+
+# --- Serving Entry Points ---
+def create_app(preload=True):
+    """Readies the app for serving and returns it (wsgi.py, asgi.py, gunicorn.conf.py).
+
+    Routes are registered on the module-level app, so every call returns that same object.
+    Applies pending schema migrations, then either loads NLTK now and freezes the GC
+    (preload=True: a pre-fork master loads once and workers share it copy-on-write) or
+    warms it in a background thread so the server can take traffic at once.
+    """
+    init_db()
+    if preload:
+        db_pool.close_all() # Fork with no open SQLite handles
+        preload_nltk()
+    elif NLTK_WARMUP: start_nltk_warmup()
+    return app
+
+def shutdown_app():
+    """Graceful shutdown for one process: writes pending mood logs and thumbnails, stops
+    scoring workers, closes pooled connections. Safe to call more than once (it also runs at exit)."""
+    mood_log_writer.stop()
+    picture_pipeline.shutdown()
+    scoring_pool.shutdown()
+    db_pool.close_all()
+
+atexit.register(shutdown_app)
 
 
 # --- Main Execution ---
+# Development server. For production use gunicorn (gunicorn -c gunicorn.conf.py wsgi:app),
+# or uvicorn with asgi.py; gunicorn.conf.py explains how many workers SQLite can take.
 if __name__ == '__main__':
     print("Starting Mood Reflect Bot application...")
-    init_db() # Initialize the database on startup
-    if not setup_nltk_data():
-        print("\nExiting: NLTK setup failed.")
-        sys.exit(1)
-    try: import pytz; print("pytz library found.")
-    except ImportError: print("\n--- WARNING: 'pytz' not installed. Using system local time. (pip install pytz)\n")
+    create_app(preload=False) # Migrate the schema; VADER loads in the background (/api/ready)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # Run the atexit flush on `kill` too
 
     print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"Database file at: {os.path.abspath(DATABASE)}")
@@ -810,6 +3664,6 @@ if __name__ == '__main__':
     print("Access the app at: http://127.0.0.1:5000/")
     print("Access profile page at: http://127.0.0.1:5000/profile")
     print("Press CTRL+C to stop.")
-    # Use threaded=False if using SQLite locally
-    app.run(debug=True, port=5000, host='127.0.0.1', threaded=False)
-
+    # The debugger allows running code from the browser, so it is off unless FLASK_DEBUG=1.
+    # WAL plus one pooled connection per request thread make a threaded server safe with SQLite.
+    app.run(debug=get_debug_flag(), port=5000, host='127.0.0.1', threaded=True)
@@ -0,0 +1,47 @@
+"""Gunicorn settings: gunicorn -c gunicorn.conf.py wsgi:app
+
+How many workers SQLite can take
+--------------------------------
+All workers share one database file. In WAL mode readers never block, but SQLite lets
+one connection write at a time across all processes. Each process batches its mood logs
+through the write-behind logger (one transaction per MOOD_LOG_FLUSH_INTERVAL or
+MOOD_LOG_FLUSH_SIZE rows), and a blocked writer waits DB_BUSY_TIMEOUT seconds rather than
+failing. So writes are rarely the limit; CPU-bound scoring is.
+
+* WEB_WORKERS: one per core, and no more than about 8 on a single SQLite file. Beyond that,
+  per-process flushes and session writes start queueing on the write lock.
+* WEB_THREADS: 4 to 8 threads per worker (gthread). Request threads mostly wait on SQLite
+  or the network, and each holds its own pooled connection.
+* SCORING_WORKERS: either leave it at 0 with one web worker per core, or run 1-2 web
+  workers with SCORING_WORKERS set to the core count. Every web worker starts its own
+  scoring pool, so using both multiplies the number of processes.
+* RATE_LIMIT_BACKEND=sqlite shares the per-user rate limits between workers (one small
+  write per /chat); the default in-memory buckets are per worker. SCORING_MAX_CONCURRENT
+  applies per worker.
+* Keep the database on a local disk. WAL needs shared memory between the processes, so
+  network filesystems are unsafe.
+
+preload_app imports wsgi.py once in the master, which migrates the schema and loads
+the VADER lexicon (then gc.freeze()), so forked workers share it copy-on-write and start
+at once. Run `flask build-lexicon` once per deploy: workers then map the compiled
+lexicon file (LEXICON_PATH) from the shared page cache instead of each parsing their own
+copy. Run `flask build-assets` too, so pages link fingerprinted, precompressed static
+files. On shutdown each worker flushes its queued mood logs before exiting.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("WEB_WORKERS", min(multiprocessing.cpu_count(), 8)))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 4))
+preload_app = True
+timeout = 30
+graceful_timeout = 20 # Covers a final mood-log flush and WAL checkpoint
+keepalive = 5
+accesslog = os.environ.get("ACCESS_LOG") # e.g. "-" for stdout; off by default
+
+
+def worker_exit(server, worker):
+    import chatbot_app
+    chatbot_app.shutdown_app()
@@ -7,6 +7,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // Profile elements
     const profilePicturePreview = document.getElementById('profile-picture-preview');
     const profilePictureUpload = document.getElementById('profile-picture-upload');
+    const placeholderSrc = profilePicturePreview.src; // Fingerprinted URL from the template
     const profilePictureEditDiv = document.querySelector('.edit-mode-element.text-center');
     const nameView = document.getElementById('profile-name-view');
     const ageView = document.getElementById('profile-age-view');
@@ -67,11 +68,11 @@ document.addEventListener('DOMContentLoaded', () => {
         ageView.textContent = data.age || 'N/A';
         weightView.textContent = data.weight ? `${data.weight} kg` : 'N/A';
 
-        if (data.picture_filename) {
-            profilePicturePreview.src = `/static/uploads/${data.picture_filename}?t=${new Date().getTime()}`;
+        if (data.picture_urls) {
+            profilePicturePreview.src = data.picture_urls[256]; // Content-addressed: a new picture is a new URL
         } else {
             // Use a placeholder suitable for dark mode if needed, or keep the current one
-            profilePicturePreview.src = '/static/images/placeholder.png';
+            profilePicturePreview.src = placeholderSrc;
         }
 
         nameEdit.value = data.name || '';
@@ -91,9 +92,9 @@ document.addEventListener('DOMContentLoaded', () => {
         });
 
         if (!isEditing) {
-             profilePicturePreview.src = currentProfileData.picture_filename
-                ? `/static/uploads/${currentProfileData.picture_filename}?t=${new Date().getTime()}`
-                : '/static/images/placeholder.png';
+             profilePicturePreview.src = currentProfileData.picture_urls
+                ? currentProfileData.picture_urls[256]
+                : placeholderSrc;
              selectedFile = null;
              profilePictureUpload.value = null;
         }
@@ -162,6 +163,7 @@ document.addEventListener('DOMContentLoaded', () => {
              const result = await response.json();
              console.log('Picture uploaded successfully:', result);
              currentProfileData.picture_filename = result.filename;
+             currentProfileData.picture_urls = result.urls;
              selectedFile = null; profilePictureUpload.value = null;
          } catch (error) {
               console.error('Error uploading picture:', error); throw error;
@@ -60,6 +60,65 @@ function setInputDisabled(isDisabled) {
     // }
 }
 
+function parseSseEvent(block) {
+    const event = { type: 'message', data: null };
+    const dataLines = [];
+    block.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event.type = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+    });
+    if (dataLines.length) event.data = JSON.parse(dataLines.join('\n'));
+    return event;
+}
+
+async function drainStream(reader) {
+    try { while (!(await reader.read()).done) { /* mood/done events are not used yet */ } } catch (e) { /* ignore */ }
+}
+
+// Posts to the streaming chat endpoint and resolves with the bot reply as soon as the
+// server's `reply` event arrives, without waiting for the rest of the response.
+async function fetchBotReply(message) {
+    const response = await fetch('/chat/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ message: message }),
+    });
+
+    if (!response.ok) {
+        // Try to parse error from response, otherwise use status text
+        let errorMsg = `HTTP error! Status: ${response.status}`;
+        try {
+            const errorData = await response.json();
+            errorMsg = errorData.error || errorData.message || errorMsg;
+        } catch (e) { /* Ignore if response is not JSON */ }
+        throw new Error(errorMsg);
+    }
+
+    if (!response.body || typeof TextDecoder === 'undefined') { // No streaming support: read it whole
+        const reply = (await response.text()).split('\n\n').map(parseSseEvent).find(e => e.type === 'reply');
+        return reply ? reply.data.bot_reply : null;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const event = parseSseEvent(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            if (event.type === 'reply') {
+                drainStream(reader); // Let the rest of the stream finish in the background
+                return event.data.bot_reply;
+            }
+        }
+    }
+    return null;
+}
+
 messageForm.addEventListener('submit', async (event) => {
     event.preventDefault(); // Prevent default form submission
     const userMessage = messageInput.value.trim();
@@ -71,32 +130,14 @@ messageForm.addEventListener('submit', async (event) => {
         showLoading(true); // Show loading indicator
 
         try {
-            // Send message to the backend
-            const response = await fetch('/chat', { // Ensure this path is correct
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ message: userMessage }),
-            });
+            // Send message to the backend; the reply is shown as soon as it is streamed
+            const botReply = await fetchBotReply(userMessage);
 
             showLoading(false); // Hide loading indicator
 
-            if (!response.ok) {
-                // Try to parse error from response, otherwise use status text
-                let errorMsg = `HTTP error! Status: ${response.status}`;
-                try {
-                    const errorData = await response.json();
-                    errorMsg = errorData.error || errorData.message || errorMsg;
-                } catch (e) { /* Ignore if response is not JSON */ }
-                throw new Error(errorMsg);
-            }
-
-            const data = await response.json();
-
             // Display bot reply or error
-            if (data.bot_reply) {
-                addMessage('bot', data.bot_reply);
-            } else if (data.error) {
-                 addMessage('bot', `Sorry, an error occurred: ${data.error}`);
+            if (botReply) {
+                addMessage('bot', botReply);
             } else {
                  addMessage('bot', "Sorry, I received an unexpected response.");
             }
@@ -119,19 +160,9 @@ async function getInitialMessage() {
     setInputDisabled(true);
     try {
         // Post null message to get initial greeting
-        const response = await fetch('/chat', { // Ensure this path is correct
-             method: 'POST',
-             headers: {'Content-Type': 'application/json'},
-             body: JSON.stringify({ message: null }) // Sending null or specific init signal
-        });
-        if (!response.ok) {
-             let errorMsg = `Failed to get initial message. Status: ${response.status}`;
-             try { const errorData = await response.json(); errorMsg = errorData.error || errorData.message || errorMsg; } catch (e) {}
-             throw new Error(errorMsg);
-        }
-        const data = await response.json();
-        if (data.bot_reply) {
-             addMessage('bot', data.bot_reply);
+        const botReply = await fetchBotReply(null); // Sending null or specific init signal
+        if (botReply) {
+             addMessage('bot', botReply);
         } else {
              // Fallback initial message
              addMessage('bot', "Hello! Ready when you are.");
@@ -0,0 +1,54 @@
+"""get_moods_and_scores_batch must return exactly what get_mood_and_score returns per text."""
+import os
+import random
+import string
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chatbot_app # noqa: E402
+
+FILLER = ["i", "am", "not", "very", "so", "today", "was", "really", "but", "don't", "can't", "it's", "my", "day",
+          "good", "great", "bad", "terrible", "love", "hate", "kind of", "extremely", "never"]
+PUNCT = [" ", " ", " ", ", ", ". ", "! ", "? ", "... ", "!! ", " - ", " :) ", " :( ", "'s ", " \"", "\n"]
+EDGE_CASES = ["", "   ", "fine", "Fine", "fine ", "okay", "not great", "NOT GREAT!!!", "happy happy happy",
+              "sad but calm", "x" * (chatbot_app.SENTIMENT_CACHE_MAX_TEXT_LEN + 1), "😀 so happy", "difficult"]
+
+
+def fuzzed_texts(n, seed):
+    rnd = random.Random(seed)
+    words = sorted(chatbot_app.KEYWORD_MOOD_INDEX) + FILLER
+    texts = []
+    for _ in range(n):
+        text = "".join(rnd.choice(words) + rnd.choice(PUNCT) for _ in range(rnd.randint(1, 15)))
+        if rnd.random() < 0.2: text = text.upper()
+        if rnd.random() < 0.1: text += rnd.choice(string.punctuation)
+        texts.append(text)
+    return texts + texts[:50] + EDGE_CASES # Repeats within one batch are scored once
+
+
+@pytest.fixture
+def uncached(monkeypatch):
+    """No memory or shared cache tier and no worker pool: every text is really scored."""
+    monkeypatch.setattr(chatbot_app.sentiment_cache, "max_size", 0)
+    monkeypatch.setattr(chatbot_app.sentiment_cache, "shared", False)
+    monkeypatch.setattr(chatbot_app.scoring_pool, "workers", 0)
+
+
+def test_batch_matches_single_scoring(uncached):
+    if not chatbot_app.wait_for_nltk(timeout=60):
+        pytest.skip("NLTK vader_lexicon is not installed")
+    texts = fuzzed_texts(2000, seed=1)
+    assert chatbot_app.get_moods_and_scores_batch(texts) == [chatbot_app.get_mood_and_score(t) for t in texts]
+
+
+def test_batch_matches_single_scoring_during_warmup(uncached, monkeypatch):
+    monkeypatch.setattr(chatbot_app, "analyzer", None) # Keyword-only fallback
+    monkeypatch.setattr(chatbot_app, "start_nltk_warmup", lambda: None)
+    texts = fuzzed_texts(500, seed=2)
+    assert chatbot_app.get_moods_and_scores_batch(texts) == [chatbot_app.get_mood_and_score(t) for t in texts]
+
+
+def test_empty_batch(uncached):
+    assert chatbot_app.get_moods_and_scores_batch([]) == []
@@ -0,0 +1,107 @@
+"""The migration chain from the original single-table schema to the latest version."""
+import calendar
+import logging
+import os
+import sqlite3
+import sys
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chatbot_app # noqa: E402
+
+# (timestamp text as the original app stored it, mood, score)
+BASELINE_ROWS = [
+    ("2026-10-10 08:00:00", "Happy", 0.5),
+    ("2026-10-10 20:00:00.250000", "Sad", -0.4), # datetime.utcnow() through sqlite3's adapter
+    ("2026-10-11T03:15:00", "Calm", 0.1),
+    ("not a date", "Angry", -0.9), # Dropped by migration 2
+]
+
+
+def epoch(text):
+    return calendar.timegm(datetime.fromisoformat(text).timetuple())
+
+
+def local_day(text):
+    return datetime.fromtimestamp(epoch(text), ZoneInfo(chatbot_app.DEFAULT_TIMEZONE)).date().isoformat()
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    """A database as the original app left it: one mood_logs table, user_version 0."""
+    db = sqlite3.connect(tmp_path / "baseline.db")
+    db.row_factory = sqlite3.Row
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS mood_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            mood TEXT NOT NULL,
+            score REAL NOT NULL
+        );
+    ''')
+    db.executemany("INSERT INTO mood_logs (timestamp, mood, score) VALUES (?, ?, ?)", BASELINE_ROWS)
+    db.commit()
+    yield db
+    db.close()
+
+
+def test_migrates_baseline_schema(baseline_db, caplog):
+    db = baseline_db
+    with caplog.at_level(logging.WARNING, logger=chatbot_app.log.name):
+        version = chatbot_app.apply_migrations(db)
+
+    latest = chatbot_app.MIGRATIONS[-1][0]
+    assert version == latest
+    assert db.execute("PRAGMA user_version").fetchone()[0] == latest
+    assert "Dropping 1 mood_logs rows" in caplog.text and "'not a date'" in caplog.text
+
+    legacy = db.execute("SELECT id, name, claimable FROM users").fetchall()
+    assert [(row['name'], row['claimable']) for row in legacy] == [("Legacy log", 1)]
+    legacy_id = legacy[0]['id']
+
+    rows = db.execute("SELECT id, ts, user_id, local_day, mood, score FROM mood_logs ORDER BY id").fetchall()
+    assert [tuple(row) for row in rows] == [
+        (i + 1, epoch(text), legacy_id, local_day(text), mood, score)
+        for i, (text, mood, score) in enumerate(BASELINE_ROWS[:3])
+    ]
+
+    expected = {}
+    for text, mood, score in BASELINE_ROWS[:3]:
+        expected.setdefault(local_day(text), []).append((mood, score))
+    agg = db.execute("SELECT * FROM mood_daily_agg ORDER BY day").fetchall()
+    assert [(row['user_id'], row['day']) for row in agg] == [(legacy_id, day) for day in sorted(expected)]
+    for row in agg:
+        moods = expected[row['day']]
+        assert row['count'] == len(moods)
+        assert row['score_sum'] == pytest.approx(sum(score for _, score in moods))
+        assert row['score_min'] == min(score for _, score in moods)
+        assert row['score_max'] == max(score for _, score in moods)
+        for mood, column in chatbot_app.agg_mood_columns():
+            assert row[column] == sum(1 for m, _ in moods if m == mood)
+
+    trajectory = db.execute("SELECT mood_trajectory FROM users WHERE id = ?", (legacy_id,)).fetchone()[0]
+    assert chatbot_app.MoodTrajectory.from_json(trajectory).count == 3
+
+
+def test_rollup_trigger_after_migration(baseline_db):
+    db = baseline_db
+    chatbot_app.apply_migrations(db)
+    user_id = db.execute("SELECT id FROM users").fetchone()[0]
+    with db:
+        db.execute("INSERT INTO mood_logs (ts, user_id, local_day, mood, score) VALUES (?, ?, ?, ?, ?)",
+                   (epoch("2026-12-01 12:00:00"), user_id, "2026-12-01", "Happy", 0.8))
+    row = db.execute("SELECT count, score_sum, happy_count FROM mood_daily_agg WHERE user_id = ? AND day = ?",
+                     (user_id, "2026-12-01")).fetchone()
+    assert tuple(row) == (1, 0.8, 1)
+
+
+def test_migrations_are_idempotent(baseline_db):
+    db = baseline_db
+    version = chatbot_app.apply_migrations(db)
+    before = db.execute("SELECT * FROM mood_logs ORDER BY id").fetchall()
+    assert chatbot_app.apply_migrations(db) == version
+    assert db.execute("SELECT * FROM mood_logs ORDER BY id").fetchall() == before
+    assert db.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
@@ -0,0 +1,102 @@
+"""KEYWORD_TOKEN_RE against the nltk.word_tokenize behaviour it stands in for.
+
+Scoring only uses the tokens to count *_KEYWORDS hits, so the regex emits the words a
+Treebank tokenizer would, without the punctuation and contraction-suffix tokens. The
+divergences documented next to KEYWORD_TOKEN_RE (and measured by
+benchmarks/bench_tokenizer.py) are pinned too, so a change to either side is noticed.
+"""
+import os
+import re
+import sys
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chatbot_app # noqa: E402
+
+# text -> KEYWORD_TOKEN_RE tokens: word_tokenize's output minus punctuation and 's 'm n't ...
+CASES = [
+    ("I'm so happy today!", ["i", "so", "happy", "today"]),
+    ("i am happy. then sad.", ["i", "am", "happy", "then", "sad"]),
+    ("Feeling stressed... really stressed.", ["feeling", "stressed", "really", "stressed"]),
+    ("happy--sad", ["happy", "sad"]),
+    ("happy-go-lucky", ["happy-go-lucky"]),
+    ("it's been a calm, peaceful day", ["it", "been", "a", "calm", "peaceful", "day"]),
+    ("\"great\" day", ["great", "day"]),
+    ("'great' day", ["great", "day"]),
+    ("can't relax, won't relax", ["ca", "relax", "wo", "relax"]),
+    ("today's deadline was awful", ["today", "deadline", "was", "awful"]),
+    ("angry?! furious!!", ["angry", "furious"]),
+    ("well... okay", ["well", "okay"]),
+    ("sad.", ["sad"]),
+    ("(happy)", ["happy"]),
+    ("I was happy.) and then", ["i", "was", "happy", "and", "then"]),
+    ("so tired & exhausted", ["so", "tired", "exhausted"]),
+    ("love it :)", ["love", "it"]),
+    ("ugh :( sad", ["ugh", "sad"]),
+    ("overwhelmed/anxious", ["overwhelmed/anxious"]),
+    ("happy2day", ["happy2day"]),
+    ("super_happy", ["super_happy"]),
+    ("it was awesome.’", ["it", "was", "awesome"]),
+    ("he said ''calm'' twice", ["he", "said", "calm", "twice"]),
+    ("tension....sad", ["tension", "sad"]),
+    ("bad... bad.. bad.", ["bad", "bad", "bad"]),
+    ("lonely; bitter: angry", ["lonely", "bitter", "angry"]),
+    ("STRESSED", ["stressed"]),
+    ("the end.", ["the", "end"]),
+    ("", []),
+    ("   ", []),
+]
+
+# Accepted divergences on noisy input: (text, KEYWORD_TOKEN_RE tokens, word_tokenize tokens).
+DIVERGENCES = [
+    ("calm::love", ["calm", "love"], ["calm", ":", ":love"]), # Mixed punctuation runs
+    ("worried,,happy", ["worried", "happy"], ["worried", ",", ",happy"]),
+    ("okay+'happy", ["okay+'happy"], ["okay+", "'", "happy"]), # Quote after a symbol
+    ("hate.'sad", ["hate.'sad"], ["hate.", "'", "sad"]), # ... or after a period
+    ("fun,1liked", ["fun", "1liked"], ["fun,1liked"]), # Comma between word and digit
+]
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+|(?<=[.!?][)\]}\"'’”])\s+")
+
+
+def reference_tokenize(text):
+    """nltk.word_tokenize, approximating punkt's sentence split when the model isn't installed."""
+    nltk_tokenize = pytest.importorskip("nltk.tokenize")
+    try:
+        return nltk_tokenize.word_tokenize(text)
+    except LookupError: # No punkt model
+        return [token for sentence in SENTENCE_END_RE.split(text)
+                for token in nltk_tokenize.word_tokenize(sentence, preserve_line=True)]
+
+
+def keyword_counts(tokens):
+    counts = Counter()
+    for token in tokens:
+        for mood_idx in chatbot_app.KEYWORD_MOOD_INDEX.get(token, ()):
+            counts[chatbot_app.KEYWORD_MOODS[mood_idx]] += 1
+    return counts
+
+
+@pytest.mark.parametrize("text,expected", CASES)
+def test_keyword_tokens(text, expected):
+    assert chatbot_app.KEYWORD_TOKEN_RE.findall(text.lower()) == expected
+
+
+@pytest.mark.parametrize("text,expected", CASES)
+def test_keyword_counts_match_word_tokenize(text, expected):
+    lower = text.lower()
+    assert keyword_counts(chatbot_app.KEYWORD_TOKEN_RE.findall(lower)) == keyword_counts(reference_tokenize(lower))
+
+
+@pytest.mark.parametrize("text,regex_tokens,treebank_tokens", DIVERGENCES)
+def test_accepted_divergences(text, regex_tokens, treebank_tokens):
+    assert chatbot_app.KEYWORD_TOKEN_RE.findall(text) == regex_tokens
+    assert reference_tokenize(text) == treebank_tokens
+    assert keyword_counts(regex_tokens) != keyword_counts(treebank_tokens)
+
+
+def test_tokenize_for_keywords_uses_regex(monkeypatch):
+    monkeypatch.setattr(chatbot_app, "KEYWORD_TOKENIZER", "regex")
+    assert chatbot_app.tokenize_for_keywords("so happy... then sad.") == ["so", "happy", "then", "sad"]
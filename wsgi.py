@@ -0,0 +1,8 @@
+"""WSGI entry point: gunicorn -c gunicorn.conf.py wsgi:app
+
+Importing this module migrates the schema and loads NLTK (create_app(preload=True)), so
+with gunicorn's preload_app it happens once in the master before workers are forked.
+"""
+from chatbot_app import create_app
+
+app = create_app()